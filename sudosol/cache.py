@@ -0,0 +1,171 @@
+"""
+Cache of solving results for sudosol.
+
+Results are keyed by the candidate state of the grid (gvc string) and the list
+of techniques used to solve it. A result is made of the history of moves, the
+final grid and the hardest technique used. The final grid validates the replay
+of a result: a result whose replay does not give it is invalidated. Results are
+kept in an in-memory LRU dictionary in front of an optional SQLite database.
+The number of results in both stores is bounded, least recently used results
+being evicted first. The number of rows of the database is counted once when
+opening it and then kept in memory. Access times of database results are kept
+in memory and written by batches.
+"""
+
+
+import json
+import time
+import hashlib
+from collections import OrderedDict
+
+
+class SolveCache:
+    def __init__(self, filename=None, memsize=1024, dbsize=100000, usedsize=1000):
+        """filename: SQLite database, None for an in-memory only cache.
+        memsize, dbsize: maximum number of results in memory and in the database.
+        usedsize: number of access times kept before writing them.
+        """
+        self.memsize = memsize
+        self.dbsize = dbsize
+        self.usedsize = usedsize
+        self.lru = OrderedDict()
+        self.used = {}
+        self.hits = 0
+        self.misses = 0
+        self.db = None
+        self.count = 0
+        if filename:
+            import sqlite3
+            # autocommit without sync: losing the latest results is harmless
+            self.db = sqlite3.connect(filename, isolation_level=None)
+            self.db.execute('PRAGMA synchronous = OFF')
+            self.db.execute('CREATE TABLE IF NOT EXISTS results '
+                            '(key TEXT PRIMARY KEY, history TEXT, final TEXT, hardest TEXT, used REAL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+            self.count, = self.db.execute('SELECT COUNT(*) FROM results').fetchone()
+
+    def close(self):
+        if self.db:
+            self.flush_used()
+            self.db.close()
+            self.db = None
+
+    @staticmethod
+    def key(grid, list_techniques):
+        string = grid.output_gvc() + ':' + ','.join(list_techniques)
+        return hashlib.sha1(string.encode()).hexdigest()
+
+    def get(self, key):
+        """return the result (history, final, hardest) for key or None
+        """
+        if key in self.lru:
+            self.lru.move_to_end(key)
+            self.hits += 1
+            return self.lru[key]
+
+        if self.db:
+            row = self.db.execute('SELECT history, final, hardest FROM results WHERE key = ?', (key,)).fetchone()
+            if row:
+                self.used[key] = time.time()
+                if len(self.used) >= self.usedsize:
+                    self.flush_used()
+                result = (json.loads(row[0]), row[1], row[2])
+                self.remember(key, result)
+                self.hits += 1
+                return result
+
+        self.misses += 1
+        return None
+
+    def put(self, key, history, final, hardest):
+        result = (history, final, hardest)
+        self.remember(key, result)
+        if self.db:
+            row = (key, json.dumps(history), final, hardest, time.time())
+            if self.db.execute('INSERT OR IGNORE INTO results VALUES (?, ?, ?, ?, ?)', row).rowcount:
+                self.count += 1
+                if self.count > self.dbsize:
+                    self.evict()
+            else:
+                self.db.execute('UPDATE results SET history = ?, final = ?, hardest = ?, used = ? '
+                                'WHERE key = ?', row[1:] + row[:1])
+
+    def invalidate(self, key):
+        """remove a result found invalid, the lookup counts as a miss
+        """
+        self.lru.pop(key, None)
+        self.used.pop(key, None)
+        if self.db:
+            self.count -= self.db.execute('DELETE FROM results WHERE key = ?', (key,)).rowcount
+        self.hits -= 1
+        self.misses += 1
+
+    def remember(self, key, result):
+        self.lru[key] = result
+        self.lru.move_to_end(key)
+        while len(self.lru) > self.memsize:
+            self.lru.popitem(last=False)
+
+    def flush_used(self):
+        """write the access times of the results read from the database
+        """
+        if self.used:
+            self.db.executemany('UPDATE results SET used = ? WHERE key = ?',
+                                [(used, key) for key, used in self.used.items()])
+            self.used = {}
+
+    def evict(self):
+        """remove the least recently used results above dbsize
+        """
+        self.flush_used()
+        self.count -= self.db.execute('DELETE FROM results WHERE key IN '
+                                      '(SELECT key FROM results ORDER BY used LIMIT ?)',
+                                      (self.count - self.dbsize,)).rowcount
+
+
+def open_cache(options):
+    """return the cache given by the --cache option or None
+    """
+    cache = getattr(options, 'cache', None)
+    if cache is None or isinstance(cache, SolveCache):
+        return cache
+    else:
+        options.cache = SolveCache(None if cache == 'memory' else cache)
+        return options.cache
+
+
+def close_cache(options):
+    cache = getattr(options, 'cache', None)
+    if isinstance(cache, SolveCache):
+        cache.close()
+        options.cache = None
+
+
+def history_to_json(history):
+    """return history items with cell numbers instead of cells
+    """
+    items = []
+    for item in history:
+        if item.move == 'value':
+            items.append([item.caption, 'value', item.cell.cellnum, item.value,
+                          discarded_to_json(item.discarded)])
+        else:
+            items.append([item.caption, 'discard', discarded_to_json(item.discarded)])
+    return items
+
+
+def discarded_to_json(discarded):
+    return {str(digit): sorted(cell.cellnum for cell in cells) for digit, cells in discarded.items()}
+
+
+def replay_history(grid, items):
+    """apply and push on grid history the moves of a cached result
+    """
+    for item in items:
+        if item[1] == 'value':
+            caption, _, cellnum, value, _ = item
+            grid.place(caption, grid.cells[cellnum], value)
+        else:
+            caption, _, discarded = item
+            discarded = {int(digit): {grid.cells[num] for num in nums} for digit, nums in discarded.items()}
+            grid.remove_candidates(caption, discarded)
@@ -0,0 +1,171 @@
+"""
+Canonical form of sudoku puzzles.
+
+The canonical form of a puzzle is the lexicographic minimum (empty cells
+counting as 0) of all its equivalent puzzles, obtained by transposition,
+permutations of bands, stacks, rows inside bands and columns inside stacks,
+and relabeling of digits. Digits are relabeled in order of first appearance,
+so the minimum is only searched over the geometric transformations.
+
+The minimum is built row by row. For each output row, only the partial
+transformations giving the minimal rows so far are kept, with the set of
+column permutations still compatible with them. Most of the 3359232
+transformations are discarded on the first rows.
+"""
+
+
+import sys
+import re
+import time
+import itertools
+
+
+def make_column_permutations():
+    """return the 1296 permutations of columns preserving stacks
+    """
+    permutations = []
+    for stacks in itertools.permutations(range(3)):
+        for cols in itertools.product(itertools.permutations(range(3)), repeat=3):
+            permutations.append(tuple(stack * 3 + cols[index][i] for index, stack in enumerate(stacks) for i in range(3)))
+    return permutations
+
+
+COLUMN_PERMUTATIONS = make_column_permutations()
+
+
+def string_to_rows(s81):
+    values = [int(char) if char in '123456789' else 0 for char in s81[:81]]
+    return tuple(tuple(values[row * 9:row * 9 + 9]) for row in range(9))
+
+
+def candidate_rows(used):
+    """return the rows which can be chosen as next output row, given the rows
+    already chosen in output order
+    """
+    if len(used) % 3 == 0:
+        bands = {row // 3 for row in used}
+        return [row for row in range(9) if row // 3 not in bands]
+    else:
+        band = used[-1] // 3
+        return [row for row in range(band * 3, band * 3 + 3) if row not in used]
+
+
+def first_row_permutations(row):
+    """return the column permutations giving the minimal image of a row when no
+    digit is labeled yet: stacks sorted by increasing number of values, empty
+    cells first inside stacks. The image only depends on the empty cells.
+    """
+    stacks = [[col for col in range(stack * 3, stack * 3 + 3)] for stack in range(3)]
+    count = [sum(1 for col in cols if row[col]) for cols in stacks]
+    orders = [order for order in itertools.permutations(range(3))
+              if all(count[order[i]] <= count[order[i + 1]] for i in range(2))]
+    inside = []
+    for cols in stacks:
+        empty = [col for col in cols if not row[col]]
+        full = [col for col in cols if row[col]]
+        inside.append([zeros + values for zeros in itertools.permutations(empty)
+                                       for values in itertools.permutations(full)])
+    permutations = []
+    for order in orders:
+        for cols in itertools.product(*(inside[stack] for stack in order)):
+            permutations.append(cols[0] + cols[1] + cols[2])
+    return permutations
+
+
+def relabel_row(row, permutation, labels, nextlabel, best):
+    """return the image of a row by a column permutation and a relabeling,
+    completed in order of first appearance, and the updated relabeling. Return
+    None as soon as the image is known to be greater than best.
+    """
+    image = []
+    smaller = best is None
+    for index, col in enumerate(permutation):
+        value = row[col]
+        if value:
+            if not labels[value]:
+                labels = labels[:value] + (nextlabel,) + labels[value + 1:]
+                nextlabel += 1
+            value = labels[value]
+        if not smaller:
+            if value > best[index]:
+                return None
+            smaller = value < best[index]
+        image.append(value)
+    return tuple(image), labels, nextlabel
+
+
+def canonical_form(s81, unknown='.'):
+    """return the canonical form of a puzzle given as a 81 character string,
+    with '0' or '.' for empty cells, as a 81 character string.
+    """
+    rows = string_to_rows(s81)
+    transposed = tuple(zip(*rows))
+
+    # state: rows, chosen rows, labels, next label -> compatible column permutations,
+    # None while only empty rows have been chosen
+    states = {}
+    for grid in (rows, transposed) if rows != transposed else (rows,):
+        states[grid, (), (0,) * 10, 1] = None
+
+    result = []
+    for _ in range(9):
+        best = None
+        newstates = {}
+        for (grid, used, labels, nextlabel), permutations in states.items():
+            for rownum in candidate_rows(used):
+                row = grid[rownum]
+                if not any(row):
+                    # empty row: no constraint on columns
+                    image = (0,) * 9
+                    if best is None or image < best:
+                        best = image
+                        newstates = {}
+                    if image == best:
+                        newstates[grid, used + (rownum,), labels, nextlabel] = permutations
+                    continue
+                for permutation in permutations or first_row_permutations(row):
+                    image = relabel_row(row, permutation, labels, nextlabel, best)
+                    if image is None:
+                        continue
+                    image, newlabels, newnext = image
+                    if best is None or image < best:
+                        best = image
+                        newstates = {}
+                    key = (grid, used + (rownum,), newlabels, newnext)
+                    newstates.setdefault(key, set()).add(permutation)
+        result.extend(best)
+        states = newstates
+
+    return ''.join(str(value) if value else unknown for value in result)
+
+
+def dedupe(options):
+    """Stream the puzzles of a file and print each puzzle whose canonical form
+    has not been met before. Comments and empty lines are kept.
+    """
+    t0 = time.time()
+    seen = set()
+    total = 0
+    try:
+        f = open(options.output, 'wt') if options.output else sys.stdout
+        with open(options.dedupe) as puzzles:
+            for line in puzzles:
+                if not line.strip() or line[0] in ';#':
+                    print(line, end='', file=f)
+                    continue
+                total += 1
+                s81 = line.split()[0]
+                if not re.match(r'[\d.]{81}$', s81):
+                    print(f'sudosol error: incorrect puzzle format: {s81}')
+                    return False, time.time() - t0
+                key = canonical_form(s81)
+                if key not in seen:
+                    seen.add(key)
+                    print(line, end='', file=f)
+    finally:
+        if options.output:
+            f.close()
+
+    timing = time.time() - t0
+    print(f'Dedupe file: {options.dedupe:20} Puzzles: {total} Unique: {len(seen)} Time: {timing:0.3}', file=sys.stderr)
+    return True, timing
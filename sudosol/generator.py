@@ -1,5 +1,7 @@
 import random
 import time
+from typing import Optional
+
 import sudosol
 
 try:
@@ -22,14 +24,17 @@ def chose_cell(grid):
             return cell
 
 
-def chose_cell_(grid):
+def chose_cell_(grid, rng=random):
     """Chose a random cell without value. Much slower than returning the first one.
     """
     # not used
-    return random.choice([cell for cell in grid.cells if not cell.value])
+    return rng.choice([cell for cell in grid.cells if not cell.value])
 
 
-def genrec(grid):
+def genrec(grid, rng=random):
+    """Complete grid with random values. rng: random.Random instance or the
+    random module (default, global state) used by all random functions.
+    """
     if grid.is_solved():
         return grid
     elif not candleft(grid):
@@ -37,40 +42,41 @@ def genrec(grid):
     else:
         cell = chose_cell(grid)
         candidates = list(cell.candidates)
-        random.shuffle(candidates)
+        rng.shuffle(candidates)
         for cand in candidates:
-            discarded = grid.set_value(cell, cand)
-            grid.push(('random', 'value', cell, cand, discarded))
-            r = genrec(grid)
+            mark = grid.mark()
+            grid.assign(cell, cand)
+            r = genrec(grid, rng)
             if r:
                 return grid
             else:
-                grid.undo()
+                grid.rollback(mark)
         return None
 
 
-def random_full_sudoku():
+def random_full_sudoku(rng=random):
     grid = sudosol.Grid()
     digits = [1, 2, 3, 4, 5, 6, 7, 8, 9]
-    random.shuffle(digits)
+    rng.shuffle(digits)
     for cell, digit in zip(grid.boxes[0], digits):
         grid.set_value(cell, digit)
-    random.shuffle(digits)
+    rng.shuffle(digits)
     for cell, digit in zip(grid.boxes[4], digits):
         grid.set_value(cell, digit)
-    random.shuffle(digits)
+    rng.shuffle(digits)
     for cell, digit in zip(grid.boxes[8], digits):
         grid.set_value(cell, digit)
 
-    grid = genrec(grid)
+    grid = genrec(grid, rng)
     return grid
 
 
 class Options:
     """minimal options for sudosol grid
     """
-    def __init__(self):
+    def __init__(self, cache=None):
         self.step = False
+        self.cache = cache
 
 
 def unicity(grid:sudosol.Grid) -> bool:
@@ -82,101 +88,142 @@ def unicity(grid:sudosol.Grid) -> bool:
     return True
 
 
-def remove_given(grid, tempo=False):
+def remove_given(grid, tempo=False, rng=random):
     """Make one attempt to remove as many as possible given from a full grid.
-    tempo used during background generation.
+    tempo used during background generation. Unicity only depends on values,
+    candidates are computed once at the end.
     """
     cells = grid.cells[:]
-    random.shuffle(cells)
+    rng.shuffle(cells)
     for cell in cells:
         value = cell.value
-        grid.rem_value(cell)
+        cell.value = None
         if not unicity(grid):
-            grid.set_value(cell, value)
+            cell.value = value
         if tempo and cell.cellnum % 10 == 0:
             time.sleep(0.01)
+    grid.update_candidates()
 
 
-def remove_given_sym(grid, tempo=False):
+def remove_given_sym(grid, tempo=False, rng=random):
     """Make one attempt to remove as many as possible given from a full grid while
     preserving central symmetry.
     tempo used during background generation.
     """
     cells = grid.cells[:41]
-    random.shuffle(cells)
+    rng.shuffle(cells)
     for cell in cells:
         value = cell.value
-        grid.rem_value(cell)
-        if cell.cellnum != 40:
-            cell2 = grid.cells[9 * (8 - cell.rownum) + (8 - cell.colnum)]
-            value2 = cell2.value
-            grid.rem_value(cell2)
+        cell.value = None
+        cell2 = grid.cells[9 * (8 - cell.rownum) + (8 - cell.colnum)]
+        value2 = cell2.value
+        cell2.value = None
         if not unicity(grid):
-            grid.set_value(cell, value)
-            grid.set_value(cell2, value2)
+            # restore cell after cell2, they are the same for the center cell
+            cell2.value = value2
+            cell.value = value
         if tempo and cell.cellnum % 10 == 0:
             time.sleep(0.01)
+    grid.update_candidates()
 
 
-def test_level(grid, level_1:None|str, level_2:str) -> None|str:
+def test_level(grid, level_1:Optional[str], level_2:str, cache=None) -> Optional[str]:
     """Test if puzzle solved by level_2 but not by level_1.
+    cache: optional SolveCache for solving results.
     """
     s81 = grid.output_s81()
     if level_1:
-        sudosol.solve(grid, Options(), techniques=level_1, explain=False, step=False)
+        sudosol.solve(grid, Options(cache), techniques=level_1, explain=False, step=False)
         if grid.is_solved():
             return None
-    sudosol.solve(grid, Options(), techniques=level_2, explain=False, step=False)
+    sudosol.solve(grid, Options(cache), techniques=level_2, explain=False, step=False)
     if grid.is_solved():
         return s81
     else:
         return None
 
 
-def attempt_sudoku(level_1:None|str, level_2:str, symmetric=True) -> None|str:
+def attempt_sudoku(level_1:Optional[str], level_2:str, symmetric=True, rng=random, cache=None) -> Optional[str]:
     """Make one attempt to generate a puzzle solved by level_2 but not by level_1.
     Return the grid if success, None otherwise.
+    cache: optional SolveCache for solving results.
     """
-    grid = random_full_sudoku()
+    grid = random_full_sudoku(rng)
     if symmetric:
-        remove_given_sym(grid)
+        remove_given_sym(grid, rng=rng)
     else:
-        remove_given(grid)
-    return test_level(grid, level_1, level_2)
+        remove_given(grid, rng=rng)
+    return test_level(grid, level_1, level_2, cache)
 
 
-def attempt_sudoku_any(symmetric=True, tempo=False): # -> None|(int,str)
+def attempt_sudoku_any(symmetric=True, tempo=False, rng=random, cache=None): # -> None|(int,str)
     """Make one attempt to generate a puzzle solved by any sudogui level.
     Return the grid if success, None otherwise.
+    cache: optional SolveCache for solving results.
     """
-    grid = random_full_sudoku()
+    grid = random_full_sudoku(rng)
     if symmetric:
-        remove_given_sym(grid, tempo=tempo)
+        remove_given_sym(grid, tempo=tempo, rng=rng)
     else:
-        remove_given(grid, tempo=tempo)
+        remove_given(grid, tempo=tempo, rng=rng)
     s81 = grid.output_s81()
     for level in range(6):
         grid.input(s81)
         level_1 = None if level == 0 else f'sudosol-level-{level}'
         level_2 = f'sudosol-level-{level + 1}'
-        if test_level(grid, level_1, level_2):
+        if test_level(grid, level_1, level_2, cache):
             return level + 1, s81
     return None
 
 
-def random_sudoku(level_1:None|str, level_2:str) -> str:
+def random_sudoku(level_1:Optional[str], level_2:str, rng=random, cache=None) -> str:
     """Return a puzzle solved by level_2 but not by level_1.
     """
     while True:
-        grid = attempt_sudoku(level_1, level_2)
+        grid = attempt_sudoku(level_1, level_2, rng=rng, cache=cache)
         if grid is not None:
             return grid
 
 
+# Reproducible generation
+#
+# Puzzle number index of a batch generated with seed is generated with its own
+# random.Random seeded with the string '<seed>-<index>' (string seeds do not
+# depend on hash randomization). A batch can then be split into shards
+# generated by separate processes or machines, and any puzzle can be
+# regenerated from its seed.
+
+
+def puzzle_seed(seed, index) -> str:
+    return f'{seed}-{index}'
+
+
+def generate_one(pseed:str, symmetric=True, cache=None): # -> (int,str)
+    """Generate the puzzle of a puzzle seed. Return its level and puzzle.
+    """
+    rng = random.Random(pseed)
+    while True:
+        result = attempt_sudoku_any(symmetric=symmetric, rng=rng, cache=cache)
+        if result is not None:
+            return result
+
+
+def generate_batch(seed, count, shard=0, shards=1, symmetric=True, cache=None): # -> iterator of (str,int,str)
+    """Generate the puzzles of the batch of count puzzles given by seed, or
+    only the ones of shard number shard (0 to shards - 1) when the batch is
+    split in shards (puzzles of index shard, shard + shards, ...). Return an
+    iterator on (puzzle seed, level, puzzle). The cache does not change the
+    puzzles generated.
+    """
+    for index in range(shard, count, shards):
+        pseed = puzzle_seed(seed, index)
+        yield (pseed, *generate_one(pseed, symmetric, cache))
+
+
 def main():
     T0 = time.time()
-    for _ in range (1000):
-        grid = attempt_sudoku_any()
+    for _ in generate_batch(0, 1000):
+        pass
     T1 = time.time()
     print(int((T1 - T0) * 1000))
 
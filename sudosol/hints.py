@@ -0,0 +1,60 @@
+"""
+Next step hints for interactive use.
+
+A hint service answers "what is the next step?" for a position. The first
+request on a grid solves it step by step and records, for each position along
+the path, the number of the path, the index of the step in the path and the
+step itself. Next requests on positions of the path are answered by a
+dictionary lookup. Positions off the path are solved in the same way and their
+path is recorded as well, with a new path number.
+"""
+
+
+import sudosol
+
+try:
+    import cache
+except ImportError:
+    from . import cache
+
+
+class HintService:
+    def __init__(self, techniques='ssts'):
+        self.list_techniques = sudosol.get_strategy(techniques)
+        # position (gvc string) -> (path, index, technique, step) or None if no step
+        self.hints = {}
+        self.paths = 0
+
+    def hint(self, grid):
+        """return the next step for grid as a tuple (path, index, technique,
+        step), step being a history item with cell numbers instead of cells, or
+        None if the grid is solved or no technique applies. Steps of a path
+        have the same path number and consecutive indices.
+        """
+        position = grid.output_gvc()
+        if position not in self.hints:
+            self.precompute(grid)
+        return self.hints[position]
+
+    def precompute(self, grid):
+        """solve a copy of grid step by step and record the step applied on each
+        position of the path. Stop when reaching a known position.
+        """
+        work = sudosol.Grid()
+        work.input_gvc(grid.output_gvc())
+        path = self.paths
+        self.paths += 1
+        index = 0
+        while True:
+            position = work.output_gvc()
+            if position in self.hints:
+                break
+            technique = None
+            if not work.is_solved():
+                technique = sudosol.apply_strategy(work, self.list_techniques, explain=False)
+            if not technique:
+                self.hints[position] = None
+                break
+            step, = cache.history_to_json([work.history[work.history_top]])
+            self.hints[position] = (path, index, technique, step)
+            index += 1
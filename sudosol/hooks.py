@@ -0,0 +1,276 @@
+"""
+Instrumentation hooks of solving for sudosol.
+
+A hook object is given to solve() or apply_strategy(), or set as options.hooks.
+Its methods are called around techniques:
+
+- on_solve_start(grid): start of solving a grid
+- on_technique_start(grid, technique): before a technique is tried
+- on_technique_end(grid, technique, found, eliminated, elapsed_ns): after it,
+  found being the result of the technique and eliminated the number of
+  candidates removed
+- on_step(grid, technique, first): after a step, made of the history items
+  from first to the top of history
+- close(): end of the command
+
+Without hooks, techniques are called directly. The sinks of this module are
+built from command line options by open_hooks: --trace-json (JSON lines of
+steps), --chrome-trace (trace events for chrome://tracing or Perfetto),
+--histogram (distribution of technique timings) and --profile-technique
+(cProfile or pyinstrument restricted to a technique).
+"""
+
+
+import sys
+import json
+import time
+from collections import defaultdict
+
+
+class Hooks:
+    """base hook class, doing nothing
+    """
+    def on_solve_start(self, grid):
+        pass
+
+    def on_technique_start(self, grid, technique):
+        pass
+
+    def on_technique_end(self, grid, technique, found, eliminated, elapsed_ns):
+        pass
+
+    def on_step(self, grid, technique, first):
+        pass
+
+    def close(self):
+        pass
+
+
+class FanOut(Hooks):
+    """dispatch hook calls to several sinks
+    """
+    def __init__(self, sinks):
+        self.sinks = sinks
+
+    def on_solve_start(self, grid):
+        for sink in self.sinks:
+            sink.on_solve_start(grid)
+
+    def on_technique_start(self, grid, technique):
+        for sink in self.sinks:
+            sink.on_technique_start(grid, technique)
+
+    def on_technique_end(self, grid, technique, found, eliminated, elapsed_ns):
+        # reverse order to nest sinks (e.g. a profiler started last is stopped first)
+        for sink in reversed(self.sinks):
+            sink.on_technique_end(grid, technique, found, eliminated, elapsed_ns)
+
+    def on_step(self, grid, technique, first):
+        for sink in self.sinks:
+            sink.on_step(grid, technique, first)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+class JsonTraceSink(Hooks):
+    """Write each step as a JSON object on its own line: grid (s81 string of the
+    grid when solving starts, stable across runs and processes), grid number in
+    the process, step number, technique, placements as [cell number, value], eliminations as
+    {digit: cell numbers}, time spent to find the step (including the
+    techniques which failed before it) and time spent in the technique of the
+    step, in nanoseconds. Lines are buffered and written by blocks.
+    """
+    def __init__(self, file, bufsize=1000):
+        """file: file name or object with a writelines method (e.g. a stream
+        consumed by an asynchronous writer).
+        bufsize: number of lines buffered before writing them.
+        """
+        if isinstance(file, str):
+            self.file = open(file, 'wt', buffering=1 << 20)
+            self.owned = True
+        else:
+            self.file = file
+            self.owned = False
+        self.bufsize = bufsize
+        self.lines = []
+        self.grid = None
+        self.gridnum = 0
+        self.stepnum = 0
+        self.times = defaultdict(int)
+
+    def on_solve_start(self, grid):
+        self.grid = grid.output_s81()
+        self.gridnum += 1
+        self.stepnum = 0
+        self.times.clear()
+
+    def on_technique_end(self, grid, technique, found, eliminated, elapsed_ns):
+        self.times[technique] += elapsed_ns
+
+    def on_step(self, grid, technique, first):
+        placements = []
+        eliminations = defaultdict(set)
+        for item in grid.history[first:grid.history_top + 1]:
+            if item.move == 'value':
+                placements.append([item.cell.cellnum, item.value])
+            else:
+                for digit, cells in item.discarded.items():
+                    eliminations[digit].update(cell.cellnum for cell in cells)
+        self.stepnum += 1
+        self.lines.append(json.dumps({
+            'grid': self.grid,
+            'gridnum': self.gridnum,
+            'step': self.stepnum,
+            'technique': technique,
+            'placements': placements,
+            'eliminations': {str(digit): sorted(cells) for digit, cells in sorted(eliminations.items())},
+            'time_ns': sum(self.times.values()),
+            'technique_ns': self.times[technique]
+        }) + '\n')
+        self.times.clear()
+        if len(self.lines) >= self.bufsize:
+            self.flush()
+
+    def flush(self):
+        self.file.writelines(self.lines)
+        self.lines = []
+
+    def close(self):
+        self.flush()
+        if self.owned:
+            self.file.close()
+
+
+class ChromeTraceSink(Hooks):
+    """Record technique calls as complete events and steps as instant events
+    in the trace event format (chrome://tracing, Perfetto). The file is
+    written when closing.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.events = []
+        self.gridnum = 0
+        self.origin = time.perf_counter_ns()
+        self.start = 0
+
+    def timestamp(self, ns):
+        return (ns - self.origin) / 1000
+
+    def on_solve_start(self, grid):
+        self.gridnum += 1
+        self.events.append({'name': f'grid {self.gridnum}', 'ph': 'i', 's': 'p', 'pid': 1, 'tid': 1,
+                            'ts': self.timestamp(time.perf_counter_ns())})
+
+    def on_technique_start(self, grid, technique):
+        self.start = time.perf_counter_ns()
+
+    def on_technique_end(self, grid, technique, found, eliminated, elapsed_ns):
+        self.events.append({'name': technique, 'cat': 'found' if found else 'failed', 'ph': 'X',
+                            'pid': 1, 'tid': 1, 'ts': self.timestamp(self.start), 'dur': elapsed_ns / 1000,
+                            'args': {'grid': self.gridnum, 'eliminated': eliminated}})
+
+    def on_step(self, grid, technique, first):
+        self.events.append({'name': f'step {technique}', 'ph': 'i', 's': 't', 'pid': 1, 'tid': 1,
+                            'ts': self.timestamp(time.perf_counter_ns())})
+
+    def close(self):
+        with open(self.filename, 'wt') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ns'}, f)
+
+
+class HistogramSink(Hooks):
+    """Count calls, successes and elapsed time of techniques, with the
+    distribution of elapsed times by powers of 2 microseconds. The histogram
+    is printed when closing.
+    """
+    def __init__(self, file=None):
+        self.file = file
+        self.calls = defaultdict(int)
+        self.found = defaultdict(int)
+        self.total = defaultdict(int)
+        self.buckets = defaultdict(lambda: defaultdict(int))
+
+    def on_technique_end(self, grid, technique, found, eliminated, elapsed_ns):
+        self.calls[technique] += 1
+        self.found[technique] += bool(found)
+        self.total[technique] += elapsed_ns
+        self.buckets[technique][(elapsed_ns // 1000).bit_length()] += 1
+
+    def close(self):
+        self.print_histogram(self.file or sys.stdout)
+
+    def print_histogram(self, f):
+        nbuckets = max((max(buckets) for buckets in self.buckets.values()), default=0) + 1
+        print('Technique    Calls  Found  Total(ms)  Mean(us)  Calls by elapsed time (us): '
+              + ' '.join(f'<{1 << bucket}' for bucket in range(nbuckets)), file=f)
+        for technique in sorted(self.total, key=self.total.get, reverse=True):
+            calls = self.calls[technique]
+            print(f'{technique:10} {calls:7} {self.found[technique]:6} {self.total[technique] / 1e6:10.3f}'
+                  f' {self.total[technique] / calls / 1000:9.1f}  '
+                  + ' '.join(str(self.buckets[technique][bucket]) for bucket in range(nbuckets)), file=f)
+
+
+class ProfilerSink(Hooks):
+    """Profile the calls of a single technique with cProfile or pyinstrument.
+    The profile is printed when closing.
+    """
+    def __init__(self, technique, profiler='cprofile', file=None):
+        self.technique = technique
+        self.file = file
+        if profiler == 'pyinstrument':
+            from pyinstrument import Profiler
+            self.profiler = Profiler()
+            self.start, self.stop = self.profiler.start, self.profiler.stop
+        else:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.start, self.stop = self.profiler.enable, self.profiler.disable
+
+    def on_technique_start(self, grid, technique):
+        if technique == self.technique:
+            self.start()
+
+    def on_technique_end(self, grid, technique, found, eliminated, elapsed_ns):
+        if technique == self.technique:
+            self.stop()
+
+    def close(self):
+        f = self.file or sys.stdout
+        if hasattr(self.profiler, 'output_text'):
+            print(self.profiler.output_text(), file=f)
+        else:
+            import pstats
+            pstats.Stats(self.profiler, stream=f).sort_stats('cumulative').print_stats(25)
+
+
+def open_hooks(options):
+    """return the hooks given by options (hooks object or command line
+    options) or None
+    """
+    hooks = getattr(options, 'hooks', None)
+    if hooks is not None:
+        return hooks
+
+    sinks = []
+    if getattr(options, 'trace_json', None):
+        sinks.append(JsonTraceSink(options.trace_json))
+    if getattr(options, 'chrome_trace', None):
+        sinks.append(ChromeTraceSink(options.chrome_trace))
+    if getattr(options, 'histogram', False):
+        sinks.append(HistogramSink())
+    if getattr(options, 'profile_technique', None):
+        sinks.append(ProfilerSink(options.profile_technique, options.profiler))
+
+    if not sinks:
+        return None
+    options.hooks = sinks[0] if len(sinks) == 1 else FanOut(sinks)
+    return options.hooks
+
+
+def close_hooks(options):
+    hooks = getattr(options, 'hooks', None)
+    if hooks is not None:
+        hooks.close()
+        options.hooks = None
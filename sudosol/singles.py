@@ -0,0 +1,112 @@
+"""
+Vectorized singles propagation for batches of grids.
+
+Grids are stored in a N x 81 array of candidate masks (bit d for candidate d,
+a single bit for a solved cell). Naked and hidden singles are applied to all
+grids at once until no more change, full house being a particular case of
+hidden single. Grids which are not solved by singles go on with the object
+based solving engine.
+"""
+
+
+import numpy
+
+
+ALLCANDS = 0x3FE
+
+SOLVED = 0
+STUCK = 1
+CONTRADICTION = 2
+
+
+def make_units():
+    """return the cell numbers of rows, columns and boxes as three 9 x 9 arrays
+    """
+    rows = [[row * 9 + col for col in range(9)] for row in range(9)]
+    cols = [[row * 9 + col for row in range(9)] for col in range(9)]
+    boxes = [[(box // 3 * 3 + i // 3) * 9 + box % 3 * 3 + i % 3 for i in range(9)] for box in range(9)]
+    return tuple(numpy.array(units) for units in (rows, cols, boxes))
+
+
+def make_peers():
+    """return the cell numbers of the 20 peers of each cell as a 81 x 20 array
+    """
+    peers = []
+    for cellnum in range(81):
+        row, col = divmod(cellnum, 9)
+        box = row // 3 * 3 + col // 3
+        peers.append([num for num in range(81) if num != cellnum and (
+            num // 9 == row or num % 9 == col or num // 27 * 3 + num % 9 // 3 == box)])
+    return numpy.array(peers)
+
+
+UNITS = make_units()
+PEERS = make_peers()
+
+
+def masks_from_strings(grids):
+    """return the N x 81 candidate masks of a list of 81 character strings, with
+    '0' or '.' for unknown values. Candidates are not reduced, this is done by
+    propagation.
+    """
+    masks = numpy.full((len(grids), 81), ALLCANDS, dtype=numpy.uint16)
+    for index, string in enumerate(grids):
+        for cellnum, char in enumerate(string[:81]):
+            if char in '123456789':
+                masks[index, cellnum] = 1 << int(char)
+    return masks
+
+
+def masks_to_strings(masks):
+    """return the 81 character strings of a N x 81 array of masks, with '.' for
+    cells with more than one candidate
+    """
+    digits = {1 << digit: str(digit) for digit in range(1, 10)}
+    return [''.join(digits.get(int(mask), '.') for mask in row) for row in masks]
+
+
+def is_single(masks):
+    return (masks != 0) & ((masks & (masks - 1)) == 0)
+
+
+def propagate_singles(batch):
+    """apply naked and hidden singles on a N x 81 array of candidate masks until
+    no more change. Return the propagated masks and an array of N status
+    (SOLVED, STUCK or CONTRADICTION). The input array is not modified.
+    """
+    masks = numpy.array(batch, dtype=numpy.uint16)
+    contradiction = numpy.zeros(len(masks), dtype=bool)
+
+    while True:
+        # naked singles: remove the value of solved cells from their peers
+        single = is_single(masks)
+        values = numpy.where(single, masks, 0)
+        seen = numpy.bitwise_or.reduce(values[:, PEERS], axis=2)
+        contradiction |= (single & (masks & seen != 0)).any(axis=1)
+        reduced = numpy.where(single, masks, masks & ~seen)
+
+        # hidden singles: a candidate occurring once in a unit is the value of its cell
+        hidden = numpy.zeros_like(reduced)
+        for units in UNITS:
+            unitmasks = reduced[:, units]
+            once = numpy.zeros(unitmasks.shape[:2], dtype=numpy.uint16)
+            twice = numpy.zeros_like(once)
+            for index in range(9):
+                twice |= once & unitmasks[:, :, index]
+                once |= unitmasks[:, :, index]
+            contradiction |= (once != ALLCANDS).any(axis=1)
+            unique = once & ~twice
+            hidden[:, units.ravel()] |= (unitmasks & unique[:, :, None]).reshape(len(masks), 81)
+        contradiction |= ((hidden != 0) & ~is_single(hidden)).any(axis=1)
+        reduced = numpy.where(hidden != 0, hidden, reduced)
+        contradiction |= (reduced == 0).any(axis=1)
+
+        # contradictory grids are left as they are
+        reduced[contradiction] = masks[contradiction]
+        if numpy.array_equal(reduced, masks):
+            break
+        masks = reduced
+
+    status = numpy.where(is_single(masks).all(axis=1), SOLVED, STUCK)
+    status[contradiction] = CONTRADICTION
+    return masks, status
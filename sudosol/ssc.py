@@ -19,6 +19,7 @@ from pywinauto.keyboard import send_keys
 from pywinauto import mouse
 
 import sudosol
+import hints
 
 
 class Options:
@@ -343,6 +344,19 @@ def coloring_mode_command(tkapp, win, sscells):
         tkapp.set_coloring_label()
 
 
+def hint_command(tkapp, win):
+    win.set_focus()
+    send_keys('^c')     # copy Simple Sudoku grid into clipboard
+    grid = sudosol.Grid()
+    grid.input(clipboard.paste())
+    hint = tkapp.hint_service.hint(grid)
+    if hint is None:
+        tkapp.bt_hint.configure(text='Hint (none)')
+    else:
+        _, _, _, (caption, *_) = hint
+        tkapp.bt_hint.configure(text=f'Hint ({caption})')
+
+
 def hodoku_hint_command(win):
     win.set_focus()
     send_keys('^c')     # copy Simple Sudoku grid into clipboard
@@ -450,7 +464,7 @@ def load_window_position(app):
         return
     else:
         x, y = [int(_) for _ in position.split(',')]
-        app.geometry(f"200x380+{x}+{y}")
+        app.geometry(f"200x410+{x}+{y}")
 
 
 def get_grid_from_collection(increment):
@@ -495,6 +509,7 @@ class App(customtkinter.CTk):
         self.wheel_mode = 'wheel_digit'
         self.current_digit = 1
         self.current_color = 0
+        self.hint_service = hints.HintService('ssts')
 
     def initialize(self, appauto, win, sscells):
         self.appauto = appauto
@@ -560,13 +575,17 @@ class App(customtkinter.CTk):
             command=lambda: coloring_mode_command(self, win, sscells))
         self.bt_coloring.place(x=DX, y=280)
 
+        self.bt_hint = customtkinter.CTkButton(master=self, text="Hint",
+            command=lambda: hint_command(self, win))
+        self.bt_hint.place(x=DX, y=310)
+
         button = customtkinter.CTkButton(master=self, text="HoDoKu hint",
             command=lambda: hodoku_hint_command(win))
-        button.place(x=DX, y=310)
+        button.place(x=DX, y=340)
 
         button = customtkinter.CTkButton(master=self, text="Quit",
             command=lambda: quit_command(self, win))
-        button.place(x=DX, y=340)
+        button.place(x=DX, y=370)
 
         self.bind("<MouseWheel>", lambda event: self.on_wheel_event(event, win, appauto, sscells))
         self.bind("<Unmap>", self.on_unmap)
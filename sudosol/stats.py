@@ -0,0 +1,157 @@
+"""
+Technique coverage statistics for sudosol.
+
+Every puzzle of a file is solved with a list of techniques. The statistics are
+the number of steps and of puzzles for each technique, the hardest technique
+per puzzle, the distribution of step counts and the number of unsolved
+puzzles. With --all-eliminations, a step is a batch of moves of the same
+technique. The file is streamed by chunks of puzzles, solved by a pool of worker
+processes when several jobs are requested. Each chunk returns its own
+counters, merged in the order of the file. With --unsolved, the positions where
+solving stopped are listed after the statistics, each chunk encoding its own
+positions in a single buffer.
+"""
+
+
+import io
+import re
+import sys
+import time
+import itertools
+from collections import Counter
+
+import sudosol
+
+
+CHUNK_SIZE = 100
+STEPS_BUCKET = 10
+
+
+def puzzles(filename):
+    """iterate on the puzzles of a file, skipping empty lines and comments. A
+    puzzle is the first field of a line, the following ones (solution,
+    comments) are ignored.
+    """
+    with open(filename) as f:
+        for line in f:
+            if '#' in line:
+                line = re.sub('#.*', '', line)
+            if line.strip() and line[0] != ';':
+                yield line.split()[0]
+
+
+def new_counters():
+    return {'puzzles': 0, 'solved': 0, 'errors': 0,
+            'steps': Counter(), 'used': Counter(), 'hardest': Counter(), 'step_counts': Counter(),
+            'unsolved': ''}
+
+
+def merge_counters(counters, other):
+    for key, value in other.items():
+        counters[key] += value
+
+
+def solve_chunk(args):
+    """solve a chunk of puzzles and return the counters of the chunk
+    """
+    chunk, techniques, grid_format, batch, unsolved_format = args
+    list_techniques = sudosol.get_strategy(techniques)
+    counters = new_counters()
+    grid = sudosol.Grid()
+    unsolved = []
+    for puzzle in chunk:
+        counters['puzzles'] += 1
+        try:
+            grid.input(puzzle, format=grid_format)
+        except (ValueError, sudosol.SudokuError):
+            counters['errors'] += 1
+            continue
+        used = set()
+        hardest = -1
+        nsteps = 0
+        while not grid.is_solved() and (technique := sudosol.apply_strategy(grid, list_techniques, False, batch=batch)):
+            counters['steps'][technique] += 1
+            used.add(technique)
+            hardest = max(hardest, list_techniques.index(technique))
+            nsteps += 1
+        counters['used'].update(used)
+        counters['step_counts'][nsteps] += 1
+        if grid.is_solved():
+            counters['solved'] += 1
+            counters['hardest'][list_techniques[hardest] if hardest >= 0 else '-'] += 1
+        else:
+            counters['hardest']['unsolved'] += 1
+            if unsolved_format:
+                position = sudosol.Grid()
+                position.input_gvc(grid.output_gvc())
+                unsolved.append(position)
+    if unsolved:
+        with io.StringIO() as buf:
+            sudosol.write_grids(buf, unsolved, unsolved_format)
+            counters['unsolved'] = buf.getvalue()
+    return counters
+
+
+def chunks(options, grid_format):
+    stream = puzzles(options.stats)
+    if options.first:
+        stream = itertools.islice(stream, options.first)
+    for chunk in sudosol.batched(stream, CHUNK_SIZE):
+        yield chunk, options.techniques, grid_format, options.all_eliminations, options.unsolved
+
+
+def stats(options):
+    """Solve all puzzles of a file and print statistics on the techniques used.
+    """
+    t0 = time.time()
+    grid_format = options.format if options.format in sudosol.INPUT_FORMATS else None
+    list_techniques = sudosol.get_strategy(options.techniques)
+    counters = new_counters()
+    try:
+        if options.jobs > 1:
+            import multiprocessing
+            with multiprocessing.Pool(options.jobs) as pool:
+                for result in pool.imap(solve_chunk, chunks(options, grid_format)):
+                    merge_counters(counters, result)
+        else:
+            for result in map(solve_chunk, chunks(options, grid_format)):
+                merge_counters(counters, result)
+    except IOError:
+        print('sudosol error: unable to read', options.stats)
+        return False, time.time() - t0
+
+    timing = time.time() - t0
+    try:
+        f = open(options.output, 'wt') if options.output else sys.stdout
+        print_stats(counters, list_techniques, f)
+        if options.unsolved:
+            print('Unsolved positions', file=f)
+            f.write(counters['unsolved'])
+    finally:
+        if options.output:
+            f.close()
+
+    print(f'Stats file: {options.stats:20} Puzzles: {counters["puzzles"]} Time: {timing:0.3}')
+    return counters['errors'] == 0, timing
+
+
+def print_stats(counters, list_techniques, f):
+    npuzzles = counters['puzzles'] - counters['errors']
+    unsolved = npuzzles - counters['solved']
+    rate = 100 * unsolved / npuzzles if npuzzles else 0
+    print(f'Puzzles: {npuzzles} Solved: {counters["solved"]} Unsolved: {unsolved} ({rate:0.1f}%)'
+          f' Errors: {counters["errors"]}', file=f)
+
+    print('Technique    Steps  Puzzles  Hardest', file=f)
+    for technique in itertools.chain(list_techniques, ['-', 'unsolved']):
+        if counters['used'][technique] or counters['hardest'][technique]:
+            print(f'{technique:10} {counters["steps"][technique]:7} {counters["used"][technique]:8}'
+                  f' {counters["hardest"][technique]:8}', file=f)
+
+    print('Steps      Puzzles', file=f)
+    buckets = Counter()
+    for nsteps, count in counters['step_counts'].items():
+        buckets[nsteps // STEPS_BUCKET] += count
+    for bucket in sorted(buckets):
+        low = bucket * STEPS_BUCKET
+        print(f'{low:3}-{low + STEPS_BUCKET - 1:<3} {buckets[bucket]:10}', file=f)
@@ -4,36 +4,66 @@ import sys
 import re
 import itertools
 import time
+import json
+import importlib
+import functools
+import bisect
 
 from collections import defaultdict
 from enum import Enum
+from typing import Optional
 
-import clipboard
-import colorama
-from colorama import Fore
-from icecream import ic
+# clipboard, colorama, numpy and dlx_sudoku (dlx) are imported when used to
+# keep startup fast
 
 try:
     # OK when calling from the dev directory but not when calling the
     # installed package (executable entry point)
-    import dlx_sudoku
     import testing
+    import canonical
+    import cache
 except ImportError:
     # OK when calling the installed package (executable entry point) but not
     # when calling from the dev directory
-    from . import dlx_sudoku
     from . import testing
+    from . import canonical
+    from . import cache
 
 
 VERSION = '0.1'
 
 
+def import_sibling(name):
+    """import on demand a module of the package, from the dev directory or
+    from the installed package
+    """
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return importlib.import_module('.' + name, __package__)
+
+
 # Data structures
 
 
 ALLCAND = {1, 2, 3, 4, 5, 6, 7, 8, 9}
 ALLDIGITS = (1, 2, 3, 4, 5, 6, 7, 8, 9)
 
+# MASK_DIGITS[mask] is the tuple of the digits of a candidate mask (bit d for digit d)
+MASK_DIGITS = tuple(tuple(digit for digit in ALLDIGITS if mask & (1 << digit)) for mask in range(1 << 10))
+ALLMASK = 0x3FE
+CHAR_DIGIT = {str(digit): digit for digit in ALLDIGITS}
+
+# MASK_BYTES[mask] is the ascii encoding of the sorted digits of a candidate mask
+MASK_BYTES = tuple(bytes(ord('0') + digit for digit in digits) for digits in MASK_DIGITS)
+
+# size of output buffers, enough for the longest format (hodoku with all exclusions)
+OUTPUT_SIZE = 4096
+
+# output buffer shared by all grids, the view is sliced without copy
+OUTPUT_BUFFER = bytearray(OUTPUT_SIZE)
+OUTPUT_VIEW = memoryview(OUTPUT_BUFFER)
+
 
 class Cell:
     def __init__(self, cellnum):
@@ -149,6 +179,140 @@ class Cell:
         return conj
 
 
+class Move:
+    """base class of history records. A record behaves as the tuple it replaces:
+    (caption, 'value', Cell, value, {cand: set_of_cells, ...}) or
+    (caption, 'discard', {cand: set_of_cells, ...}). Readers in the solver use
+    the attributes (move, caption, cell, value, discarded) which do not build
+    the tuple.
+    """
+    __slots__ = ()
+
+    def __iter__(self):
+        return iter(self.astuple())
+
+    def __getitem__(self, index):
+        return self.astuple()[index]
+
+    def __len__(self):
+        return len(self.astuple())
+
+    def __repr__(self):
+        return repr(self.astuple())
+
+
+class ValueMove(Move):
+    """value set in a cell, with the candidates discarded by the move
+    """
+    __slots__ = ('caption', 'cell', 'value', 'discarded')
+    move = 'value'
+
+    def __init__(self, caption, cell, value, discarded):
+        self.caption = caption
+        self.cell = cell
+        self.value = value
+        self.discarded = discarded
+
+    def astuple(self):
+        return (self.caption, 'value', self.cell, self.value, self.discarded)
+
+    def undo(self):
+        self.cell.value = None
+        self.cell.candidates.add(self.value)
+        for digit, cells in self.discarded.items():
+            for cell in cells:
+                cell.candidates.add(digit)
+
+    def redo(self):
+        self.cell.value = self.value
+        self.cell.candidates = set()
+        for digit, cells in self.discarded.items():
+            for cell in cells:
+                cell.candidates.discard(digit)
+
+
+class PlaceMove(Move):
+    """value set in a cell without building the dictionary of discarded
+    candidates. The record keeps the candidates of the cell and the peers which
+    lost the value, the dictionary is built on demand.
+    """
+    __slots__ = ('caption', 'cell', 'value', 'candidates', 'peers')
+    move = 'value'
+
+    def __init__(self, caption, cell, value, candidates, peers):
+        self.caption = caption
+        self.cell = cell
+        self.value = value
+        self.candidates = candidates
+        self.peers = peers
+
+    @property
+    def discarded(self):
+        discarded = defaultdict(set)
+        for candidate in self.candidates:
+            discarded[candidate].add(self.cell)
+        discarded[self.value].update(self.peers)
+        return discarded
+
+    def astuple(self):
+        return (self.caption, 'value', self.cell, self.value, self.discarded)
+
+    def undo(self):
+        self.cell.value = None
+        self.cell.candidates = set(self.candidates)
+        for peer in self.peers:
+            peer.candidates.add(self.value)
+
+    def redo(self):
+        self.cell.value = self.value
+        self.cell.candidates = set()
+        for peer in self.peers:
+            peer.candidates.discard(self.value)
+
+
+class DiscardMove(Move):
+    """candidates discarded by a technique. removed is the list of (cell, digit)
+    actually removed, if known, to undo exactly without checking peers.
+    """
+    __slots__ = ('caption', 'discarded', 'removed')
+    move = 'discard'
+
+    def __init__(self, caption, discarded, removed=None):
+        self.caption = caption
+        self.discarded = discarded
+        self.removed = removed
+
+    def astuple(self):
+        return (self.caption, 'discard', self.discarded)
+
+    def undo(self):
+        if self.removed is not None:
+            for cell, digit in self.removed:
+                cell.candidates.add(digit)
+            return
+        for digit, cells in self.discarded.items():
+            for cell in cells:
+                # if digit not already eliminated by some value:
+                if all(digit != c.value for c in cell.peers):
+                    cell.candidates.add(digit)
+
+    def redo(self):
+        for digit, cells in self.discarded.items():
+            for cell in cells:
+                cell.candidates.discard(digit)
+
+
+def make_move(item):
+    """return the history record of a tuple
+    """
+    if item[1] == 'value':
+        _, _, cell, value, discarded = item
+        return ValueMove(item[0], cell, value, discarded)
+    else:
+        _, _, discarded = item
+        return DiscardMove(item[0], discarded)
+
+
 class Grid:
     def __init__(self):
         """create a grid without known values
@@ -219,6 +383,19 @@ class Grid:
         # init history
         self.history = []
         self.history_top = -1
+        self.trail = []
+
+        # explanations of steps when explaining
+        self.steps = []
+
+        # ranges of history items applied as a batch (all eliminations mode)
+        self.batches = []
+
+        # almost locked sets, rectangles, clusters and subsets, built on demand
+        self.als_index = None
+        self.rect_index = None
+        self.cluster_index = None
+        self.subset_index = None
 
         # cell decoration when tracing ('color' or 'char')
         self.decorate = 'color'
@@ -226,21 +403,32 @@ class Grid:
     def reset(self):
         self.history = []
         self.history_top = -1
+        self.trail = []
+        self.steps = []
+        self.batches = []
         for cell in self.cells:
             cell.reset()
 
     def units(self):
         return itertools.chain(self.rows, self.cols, self.boxes)
 
-    def input(self, string):
-        if re.match(r'[\d.]{81}$', string):
+    def input(self, string, format=None):
+        """load a grid from a string. format is one of the single line formats
+        ('s81', 'csv', 'gvc', 'hodoku') or None to detect it. Multi line formats
+        are tried when the string is not in a single line format.
+        """
+        if format is None:
+            format = input_format(string)
+        if format == 's81':
             self.input_s81(string)
-        elif re.match('([1-9]{1,9},){80}[1-9]{1,9}$', string):
+        elif format == 'csv':
             self.input_csv(string)
-        elif re.match(r'([gvc][1-9]{1,9}){81}$', string):
+        elif format == 'gvc':
             self.input_gvc(string)
-        elif re.match(r'(\+?[.1-9]){81}:[ 1-9]*$', string):
+        elif format == 'hodoku':
             self.input_hodoku(string)
+        elif format is not None:
+            raise SudokuError(f'unknown grid format: {format}')
         elif string81 := grid_to_string81(string):
             self.input_s81(string81)
         elif stringcsv := grid_to_csv(string):
@@ -252,29 +440,74 @@ class Grid:
         else:
             raise SudokuError(f'illegal grid format in string: {string}')
 
+    def load(self, values, givens, masks=None):
+        """set all cells in a single pass and clear history. values, givens and
+        masks are lists of 81 digits (0 for no value), booleans and candidate
+        masks of cells without value (all candidates if masks is None). Values
+        are discarded from the candidates of their peers.
+        """
+        if len(values) != 81:
+            raise SudokuError(f'illegal number of cells: {len(values)}')
+
+        self.history = []
+        self.history_top = -1
+        self.trail = []
+        self.steps = []
+        self.batches = []
+
+        # digits used in rows (0-8), columns (9-17) and boxes (18-26)
+        used = [0] * 27
+        for cell, digit in zip(self.cells, values):
+            if digit:
+                bit = 1 << digit
+                used[cell.rownum] |= bit
+                used[9 + cell.colnum] |= bit
+                used[18 + cell.boxnum] |= bit
+
+        for cell, digit, given, mask in zip(self.cells, values, givens, masks or [ALLMASK] * 81):
+            if digit:
+                cell.value = digit
+                cell.given = given
+                cell.candidates = set()
+            else:
+                cell.value = None
+                cell.given = False
+                # candidates are built then discarded as when setting values one by
+                # one, which gives the same set iteration order
+                seen = used[cell.rownum] | used[9 + cell.colnum] | used[18 + cell.boxnum]
+                cell.candidates = set(MASK_DIGITS[mask])
+                if mask & seen:
+                    cell.candidates.difference_update(MASK_DIGITS[mask & seen])
+
     def input_s81(self, str81, autofilter=True, given=True):
         """load a 81 character string of given values
         """
+        if autofilter:
+            values = [CHAR_DIGIT.get(char, 0) for char in str81]
+            self.load(values, [given] * 81)
+            return
+
         self.reset()
         for cell, char in zip(self.cells, str81):
-            if char in '123456789':
-                if autofilter is False:
-                    cell.value = int(char)
-                    cell.given = given
-                    cell.candidates = set()
-                else:
-                    self.set_value(cell, int(char), given=given)
+            if char in CHAR_DIGIT:
+                cell.value = int(char)
+                cell.given = given
+                cell.candidates = set()
 
     def input_csv(self, strcand):
         """load a comma separated list of candidates, a single candidate is
         considered as a given value
         """
-        self.reset()
-        for cell, candidates in zip(self.cells, strcand.split(',')):
+        values = []
+        masks = []
+        for candidates in strcand.split(','):
             if len(candidates) == 1:
-                self.set_value(cell, int(candidates[0]), given=True)
+                values.append(CHAR_DIGIT[candidates])
+                masks.append(0)
             else:
-                cell.candidates = set(int(_) for _ in candidates)
+                values.append(0)
+                masks.append(chars_mask(candidates))
+        self.load(values, [True] * 81, masks)
 
     def input_gvc_strings(self, given, values, candidates):
         """input digits given as three strings.
@@ -300,8 +533,7 @@ class Grid:
                 cell_index = int(match[1])
                 cell = self.cells[cell_index]
                 cand = int(match[2])
-                discarded = self.set_value(cell, cand)
-                self.push(('Insert', 'value', cell, cand, discarded))
+                self.place('Insert', cell, cand)
             elif match := re.match(r'E(\d\d)(\d\d)([1-9]{1,8})', line):
                 # TODO: gather cells within same move
                 cell_index = int(match[1])
@@ -310,28 +542,40 @@ class Grid:
                 candidates = match[3]
                 for cand in candidates:
                     cell.discard(int(cand))
-                self.push(('Exclude', 'discard', {int(c): [cell] for c in candidates}))
+                self.push(DiscardMove('Exclude', {int(c): [cell] for c in candidates}))
 
     def input_gvc(self, string):
         """load a given-value-candidates string ([gvc][1-9]{1,9}){81}
         """
-        self.reset()
-        for cell, s in zip(self.cells, re.findall(r'[gvc][1-9]{1,9}', string)):
-            if s[0] == 'g':
-                self.set_value(cell, int(s[1]), given=True)
-            elif s[0] == 'v':
-                self.set_value(cell, int(s[1]), given=False)
+        values = []
+        givens = []
+        masks = []
+        for token in gvc_tokens(string):
+            if token[0] == 'c':
+                values.append(0)
+                givens.append(False)
+                masks.append(chars_mask(token[1:]))
             else:
-                cell.candidates = set(int(_) for _ in s[1:])
+                values.append(CHAR_DIGIT[token[1]])
+                givens.append(token[0] == 'g')
+                masks.append(0)
+        self.load(values, givens, masks)
 
     def input_hodoku(self, string):
         """input a hodoku library format string, see https://hodoku.sourceforge.net/en/libs.php
         """
-        self.reset()
-        values, exclusions = string.split(':')
-        for cell, x in zip(self.cells, re.findall(r'\+?\d|\.', values)):
-            if x != '.':
-                self.set_value(cell, int(x[-1]), given=len(x) == 1)
+        values_string, _, exclusions = string.partition(':')
+        values = []
+        givens = []
+        placed = False
+        for char in values_string:
+            if char == '+':
+                placed = True
+            else:
+                values.append(CHAR_DIGIT.get(char, 0))
+                givens.append(not placed)
+                placed = False
+        self.load(values, givens)
         for exclusion in exclusions.split():
             digit, row, col = (int(_) for _ in exclusion)
             self.cells[9 * (row - 1) + (col - 1)].discard(digit)
@@ -339,49 +583,27 @@ class Grid:
     def output_s81(self, unknown='.', given=False):
         """return a 81 character string
         """
-        return ''.join(str(cell.value) if cell.value and given <= cell.given else unknown for cell in self.cells)
+        size = encode_s81(self.cells, OUTPUT_BUFFER, 0, unknown, given)
+        return str(OUTPUT_VIEW[:size], 'ascii')
 
     def output_csv(self):
         """return a comma separated list of candidates, a value is considered
          as a single candidate
         """
-        return ','.join(str(cell.value) if cell.value else ''.join(str(_) for _ in sorted(cell.candidates)) for cell in self.cells)
+        size = encode_csv(self.cells, OUTPUT_BUFFER, 0)
+        return str(OUTPUT_VIEW[:size], 'ascii')
 
     def output_gvc(self):
         """return a given-value-candidates string ([gvc][1-9]{1,9}){81}
         """
-        lst = []
-        for cell in self.cells:
-            if cell.given:
-                lst.append(f'g{cell.value}')
-            elif cell.value:
-                lst.append(f'v{cell.value}')
-            else:
-                lst.append('c' + ''.join(str(_) for _ in sorted(cell.candidates)))
-        return ''.join(lst)
+        size = encode_gvc(self.cells, OUTPUT_BUFFER, 0)
+        return str(OUTPUT_VIEW[:size], 'ascii')
 
     def output_hodoku(self):
         """return a hodoku library format string, see https://hodoku.sourceforge.net/en/libs.php
         """
-        grid = Grid()
-        lst = []
-        for cell, cell2 in zip(self.cells, grid.cells):
-            if cell.given:
-                lst.append(f'{cell.value}')
-                grid.set_value(cell2, cell.value)
-            elif cell.value:
-                lst.append(f'+{cell.value}')
-                grid.set_value(cell2, cell.value)
-            else:
-                lst.append('.')
-
-        lst2 = []
-        for cell, cell2 in zip(self.cells, grid.cells):
-            if cell.candidates != cell2.candidates:
-                for candidate in cell2.candidates - cell.candidates:
-                    lst2.append(f'{candidate}{cell.rownum}{cell.colnum}')
-
-        return ''.join(lst) + ':' + ' '.join(lst2)
+        size = encode_hodoku(self.cells, OUTPUT_BUFFER, 0)
+        return str(OUTPUT_VIEW[:size], 'ascii')
 
     def compare_string(self, ref):
         if re.match(r'^[\d.]{81}$', ref):
@@ -415,6 +637,64 @@ class Grid:
 
         return discarded
 
+    def place(self, caption, cell, digit):
+        """set value in cell and push a compact record on history, without
+        building the dictionary of discarded candidates
+        """
+        candidates = cell.candidates
+        cell.set_value(digit)
+        peers = [peer for peer in cell.peers if digit in peer.candidates]
+        for peer in peers:
+            peer.candidates.discard(digit)
+        self.push(PlaceMove(caption, cell, digit, candidates, peers))
+
+    def remove_candidates(self, caption, discarded):
+        """discard candidates ({cand: cells}) and push a record on history
+        with the candidates actually removed, for an exact undo
+        """
+        removed = [(cell, digit) for digit, cells in discarded.items()
+                   for cell in cells if digit in cell.candidates]
+        for cell, digit in removed:
+            cell.candidates.discard(digit)
+        self.push(DiscardMove(caption, discarded, removed))
+
+    def mark(self):
+        """return a mark of the current state for rollback
+        """
+        return len(self.trail)
+
+    def assign(self, cell, digit):
+        """set value in cell and discard it from peers. Changes are recorded on
+        the trail, not on history, and are undone with rollback.
+        """
+        trail = self.trail
+        trail.append((cell, None, cell.candidates))
+        cell.value = digit
+        cell.candidates = set()
+        for peer in cell.peers:
+            if digit in peer.candidates:
+                peer.candidates.discard(digit)
+                trail.append((peer, digit, None))
+
+    def rollback(self, mark):
+        """undo the changes recorded on the trail since mark
+        """
+        trail = self.trail
+        while len(trail) > mark:
+            cell, digit, candidates = trail.pop()
+            if digit is None:
+                cell.value = None
+                cell.candidates = candidates
+            else:
+                cell.candidates.add(digit)
+
+    def update_candidates(self):
+        """set the candidates of cells without value from the values of peers
+        """
+        for cell in self.cells:
+            if cell.value is None:
+                cell.candidates = ALLCAND - {peer.value for peer in cell.peers}
+
     def rem_value(self, cell):
         digit = cell.value
         cell.value = None
@@ -481,11 +761,13 @@ class Grid:
 
     def push(self, item):
         """
-        Push item on history. Item is a tuple:
+        Push item on history. Item is a Move record or a tuple:
         (caption, 'value', Cell, value, {cand: set_of_cells, cand: set_of_cells, ...})
         (caption, 'discard', {cand: set_of_cells, cand: set_of_cells, ...})
         """
-        self.history = self.history[:self.history_top + 1]
+        if not isinstance(item, Move):
+            item = make_move(item)
+        del self.history[self.history_top + 1:]
         self.history.append(item)
         self.history_top = len(self.history) - 1
 
@@ -497,24 +779,7 @@ class Grid:
         else:
             item = self.history[self.history_top]
         self.history_top -= 1
-
-        if item[1] == 'discard':
-            _, _, discarded = item
-            for digit, cells in discarded.items():
-                for cell in cells:
-                    # if digit not already eliminated by some value:
-                    if all(digit != c.value for c in cell.peers):
-                        cell.candidates.add(digit)
-
-        elif item[1] == 'value':
-            _, _, cell, value, discarded = item
-            cell.value = None
-            cell.candidates.add(value)
-            for digit, cells in discarded.items():
-                for cell in cells:
-                    cell.candidates.add(digit)
-        else:
-            pass
+        item.undo()
 
     def undo_cells(self):
         """Return cells concerned by the latest move.
@@ -523,15 +788,13 @@ class Grid:
             return None
         item = self.history[self.history_top]
 
-        if item[1] == 'discard':
-            _, _, discarded = item
+        if item.move == 'discard':
             nums = set()
-            for cells in discarded.values():
+            for cells in item.discarded.values():
                 nums |= {cell.cellnum for cell in cells}
             return [self.cells[num] for num in nums]
-        elif item[1] == 'value':
-            _, _, cell, _, _ = item
-            return [cell]
+        elif item.move == 'value':
+            return [item.cell]
         else:
             return None
 
@@ -539,23 +802,7 @@ class Grid:
         if self.history_top == len(self.history) - 1:
             return
         self.history_top += 1
-        item = self.history[self.history_top]
-
-        if item[1] == 'discard':
-            _, _, discarded = item
-            for digit, cells in discarded.items():
-                for cell in cells:
-                    cell.candidates.discard(digit)
-
-        elif item[1] == 'value':
-            _, _, cell, value, discarded = item
-            cell.value = value
-            cell.candidates = set()
-            for digit, cells in discarded.items():
-                for cell in cells:
-                    cell.candidates.discard(digit)
-        else:
-            pass
+        self.history[self.history_top].redo()
 
     def dump_history(self):
         """
@@ -563,14 +810,12 @@ class Grid:
         (caption, 'discard', {cand: set_of_cells, cand: set_of_cells, ...})
         """
         dump = []
-        for _, move, *spec in self.history[:self.history_top]:
-            if move == 'value':
-                cell, value, _ = spec
-                dump.append('I%02d%d' % (cell.cellnum, value))
+        for item in self.history[:self.history_top]:
+            if item.move == 'value':
+                dump.append('I%02d%d' % (item.cell.cellnum, item.value))
             else:
-                discarded, *_ = spec
                 discarded2 = defaultdict(list)
-                for cand, cells in discarded.items():
+                for cand, cells in item.discarded.items():
                     for cell in cells:
                         discarded2[cell.cellnum].append(cand)
                 for index, (cellnum, candidates) in enumerate(sorted(discarded2.items())):
@@ -599,10 +844,10 @@ def solutions(grid, i):
         if candidates:
             for candidate in sorted(candidates):
                 grid.nbbacktrack += 1
-                discarded = grid.set_value(grid.cells[i], candidate)
-                grid.push(('Backtrack', 'value', grid.cells[i], candidate, discarded))
+                mark = grid.mark()
+                grid.assign(grid.cells[i], candidate)
                 yield from solutions(grid, i + 1)
-                grid.undo()
+                grid.rollback(mark)
 
 
 class SudokuError (Exception):
@@ -612,17 +857,33 @@ class SudokuError (Exception):
 
 CellDecor = Enum('CellDecor', 'VALUE GIVEN DEFAULTCAND DEFININGCAND REMOVECAND COLOR1 COLOR2 COLOR3 COLOR4')
 
-CellDecorColor = {
-    CellDecor.GIVEN: Fore.BLUE,
-    CellDecor.VALUE: Fore.CYAN,
-    CellDecor.DEFAULTCAND: Fore.WHITE,
-    CellDecor.DEFININGCAND: Fore.GREEN,
-    CellDecor.REMOVECAND: Fore.RED,
-    CellDecor.COLOR1: Fore.GREEN,
-    CellDecor.COLOR2: Fore.CYAN,
-    CellDecor.COLOR3: Fore.YELLOW,
-    CellDecor.COLOR4: Fore.MAGENTA
-}
+# filled on first use by decor_colors
+CellDecorColor = {}
+
+
+def decor_colors():
+    """return the dictionary of decoration colors and the reset color,
+    colorama being imported and initialized on first call
+    """
+    import colorama
+    from colorama import Fore
+    if not CellDecorColor:
+        # enable ANSI codes on Windows consoles, nothing done otherwise and
+        # redirected output is left untouched
+        colorama.just_fix_windows_console()
+        CellDecorColor.update({
+            CellDecor.GIVEN: Fore.BLUE,
+            CellDecor.VALUE: Fore.CYAN,
+            CellDecor.DEFAULTCAND: Fore.WHITE,
+            CellDecor.DEFININGCAND: Fore.GREEN,
+            CellDecor.REMOVECAND: Fore.RED,
+            CellDecor.COLOR1: Fore.GREEN,
+            CellDecor.COLOR2: Fore.CYAN,
+            CellDecor.COLOR3: Fore.YELLOW,
+            CellDecor.COLOR4: Fore.MAGENTA
+        })
+    return CellDecorColor, Fore.RESET
+
 
 def colorize_candidates_color(cell, color_spec):
     """
@@ -634,20 +895,21 @@ def colorize_candidates_color(cell, color_spec):
     cells and candidates are iterables.
     A cell or a candidate may appear several times. The last color spec is taken into accout.
     """
+    colors, reset = decor_colors()
     if not cell.candidates:
         decor = CellDecor.GIVEN if cell.given else CellDecor.VALUE
-        res = CellDecorColor[decor] + str(cell.value if cell.value else '?') + Fore.RESET
+        res = colors[decor] + str(cell.value if cell.value else '?') + reset
         # manual padding as colorama information fools format padding
         res += ' ' * (9 - 1)
         return res
     else:
         if color_spec is None:
-            res = CellDecorColor[CellDecor.DEFAULTCAND] + str(cell) + Fore.RESET
+            res = colors[CellDecor.DEFAULTCAND] + str(cell) + reset
         else:
             candcol = retain_decor(cell, color_spec)
             res = ''
             for cand in sorted(cell.candidates):
-                res += CellDecorColor[candcol[cand]] + str(cand) + Fore.RESET
+                res += colors[candcol[cand]] + str(cand) + reset
 
         # manual padding as colorama information fools format padding
         res += ' ' * (9 - len(cell.candidates))
@@ -736,6 +998,160 @@ def format_ss_clipboard(grid):
     return '\n\n'.join(lines)
 
 
+INPUT_FORMATS = ('s81', 'csv', 'gvc', 'hodoku')
+S81_CHARS = frozenset('0123456789.')
+CSV_CHARS = frozenset('123456789,')
+GVC_CHARS = frozenset('gvc123456789')
+HODOKU_VALUES_CHARS = frozenset('+.123456789')
+HODOKU_EXCLUSIONS_CHARS = frozenset(' 123456789')
+
+
+def input_format(string: str) -> Optional[str]:
+    """Return the format of a single line grid string ('s81', 'csv', 'gvc' or
+    'hodoku') or None if the string is in none of these formats. The format is
+    detected from the length and the first characters, and validated with
+    character sets and counts.
+    """
+    if not string:
+        return None
+    elif len(string) == 81 and S81_CHARS.issuperset(string):
+        return 's81'
+    elif string[0] in 'gvc':
+        if GVC_CHARS.issuperset(string):
+            tokens = gvc_tokens(string)
+            if len(tokens) == 81 and all(1 < len(token) <= 10 for token in tokens):
+                return 'gvc'
+    elif ':' in string:
+        values, _, exclusions = string.partition(':')
+        if (HODOKU_VALUES_CHARS.issuperset(values) and HODOKU_EXCLUSIONS_CHARS.issuperset(exclusions)
+                and len(values) - values.count('+') == 81
+                and '++' not in values and values[-1] != '+'):
+            return 'hodoku'
+    elif string.count(',') == 80 and CSV_CHARS.issuperset(string):
+        if all(0 < len(field) <= 9 for field in string.split(',')):
+            return 'csv'
+    return None
+
+
+def gvc_tokens(string: str) -> list:
+    """Split a given-value-candidates string into its tokens ([gvc][1-9]*)
+    """
+    return string.replace('g', ' g').replace('v', ' v').replace('c', ' c').split()
+
+
+def chars_mask(chars: str) -> int:
+    """Return the candidate mask of a string of digits
+    """
+    mask = 0
+    for char in chars:
+        mask |= 1 << CHAR_DIGIT[char]
+    return mask
+
+
+# Output encoders: write a grid at position pos of a bytearray and return the
+# position after the last written byte
+
+
+def encode_s81(cells, buffer, pos, unknown='.', given=False):
+    unknown = ord(unknown)
+    for cell in cells:
+        value = cell.value
+        buffer[pos] = 48 + value if value and given <= cell.given else unknown
+        pos += 1
+    return pos
+
+
+def encode_csv(cells, buffer, pos):
+    for cell in cells:
+        if cell.value:
+            buffer[pos] = 48 + cell.value
+            pos += 1
+        else:
+            mask = 0
+            for digit in cell.candidates:
+                mask |= 1 << digit
+            chars = MASK_BYTES[mask]
+            buffer[pos:pos + len(chars)] = chars
+            pos += len(chars)
+        buffer[pos] = 44        # ','
+        pos += 1
+    return pos - 1
+
+
+def encode_gvc(cells, buffer, pos):
+    for cell in cells:
+        if cell.value:
+            buffer[pos] = 103 if cell.given else 118        # 'g' or 'v'
+            buffer[pos + 1] = 48 + cell.value
+            pos += 2
+        else:
+            mask = 0
+            for digit in cell.candidates:
+                mask |= 1 << digit
+            chars = MASK_BYTES[mask]
+            buffer[pos] = 99        # 'c'
+            buffer[pos + 1:pos + 1 + len(chars)] = chars
+            pos += 1 + len(chars)
+    return pos
+
+
+def encode_hodoku(cells, buffer, pos):
+    """Exclusions are the candidates allowed by the values of peers and missing
+    in cells, computed from masks of digits used in units.
+    """
+    used = [0] * 27
+    for cell in cells:
+        value = cell.value
+        if value:
+            if not cell.given:
+                buffer[pos] = 43        # '+'
+                pos += 1
+            buffer[pos] = 48 + value
+            bit = 1 << value
+            used[cell.rownum] |= bit
+            used[9 + cell.colnum] |= bit
+            used[18 + cell.boxnum] |= bit
+        else:
+            buffer[pos] = 46        # '.'
+        pos += 1
+    buffer[pos] = 58        # ':'
+    pos += 1
+
+    start = pos
+    for cell in cells:
+        if not cell.value:
+            mask = 0
+            for digit in cell.candidates:
+                mask |= 1 << digit
+            allowed = ALLMASK & ~(used[cell.rownum] | used[9 + cell.colnum] | used[18 + cell.boxnum])
+            for digit in MASK_DIGITS[allowed & ~mask]:
+                buffer[pos:pos + 4] = b'%d%d%d ' % (digit, cell.rownum + 1, cell.colnum + 1)
+                pos += 4
+    return pos - 1 if pos > start else pos
+
+
+ENCODERS = {
+    's81': encode_s81,
+    'csv': encode_csv,
+    'gvc': encode_gvc,
+    'hodoku': encode_hodoku,
+}
+
+
+def write_grids(f, grids, format='s81'):
+    """Write grids to a text file, one per line, in one of the single line
+    formats. Lines are encoded in a single buffer written at once.
+    """
+    encoder = ENCODERS[format]
+    buffer = bytearray(len(grids) * (OUTPUT_SIZE + 1))
+    pos = 0
+    for grid in grids:
+        pos = encoder(grid.cells, buffer, pos)
+        buffer[pos] = 10        # '\n'
+        pos += 1
+    f.write(str(memoryview(buffer)[:pos], 'ascii'))
+
+
 def grid_to_string81(string: str) -> str:
     """Convert a string containing a grid of values into a normalized string made
     of 81 digits or dots. The grid may contain horizontal or vertical separators.
@@ -878,6 +1294,83 @@ def save_ss_file(grid, filename):
             print(item, file=f)
 
 
+# Explanations
+#
+# When explaining, techniques record a Step for each elimination or placement
+# instead of printing it. Steps are rendered after solving, as text (with
+# colored or char decoration) or as JSON.
+
+
+class Step:
+    """Explanation of a step, with cells as cell numbers and the grid before
+    the step as a gvc string.
+    decor: color specification of the dump (see colorize_candidates_color)
+    removed: {digit: cell numbers} or None if the step places a value
+    singles: singles applied since the previous step (see last_singles)
+    """
+    __slots__ = ('technique', 'text', 'removed', 'decor', 'singles', 'state')
+
+    def __init__(self, technique, text, removed, decor, singles, state):
+        self.technique = technique
+        self.text = text
+        self.removed = removed
+        self.decor = decor
+        self.singles = singles
+        self.state = state
+
+    def to_json(self):
+        digits = set()
+        cells = set()
+        for cellnums, *spec in self.decor:
+            for candidates, decor in zip(spec[::2], spec[1::2]):
+                digits.update(candidates)
+                if decor != CellDecor.REMOVECAND:
+                    cells.update(cellnums)
+        return {
+            'technique': self.technique,
+            'text': self.text,
+            'digits': sorted(digits),
+            'cells': sorted(cells),
+            'removed': None if self.removed is None else {str(digit): list(cellnums) for digit, cellnums in self.removed.items()},
+            'decor': [[list(cellnums)] + [sorted(x) if index % 2 == 0 else x.name for index, x in enumerate(spec)]
+                      for cellnums, *spec in self.decor],
+            'singles': [list(single) for single in self.singles],
+            'grid': self.state
+        }
+
+
+def explain_step(grid, technique, text, removed, decor):
+    """record on grid the explanation of a step, before applying it
+    """
+    decor = tuple((tuple(cell.cellnum for cell in cells),) +
+                  tuple(frozenset(x) if index % 2 == 0 else x for index, x in enumerate(spec))
+                  for cells, *spec in decor)
+    if removed is not None:
+        removed = {digit: tuple(sorted(cell.cellnum for cell in cells)) for digit, cells in sorted(removed.items())}
+    grid.steps.append(Step(technique, text, removed, decor, last_singles(grid), grid.output_gvc()))
+
+
+def print_steps(steps, decorate):
+    """print steps as text, decorate being the decoration of grid dumps
+    """
+    grid = Grid()
+    grid.decorate = decorate
+    for step in steps:
+        grid.input_gvc(step.state)
+        singlehistory = singles_text(step.singles)
+        if singlehistory:
+            print(singlehistory)
+            print()
+        print(step.text)
+        grid.dump([([grid.cells[cellnum] for cellnum in cellnums], *spec) for cellnums, *spec in step.decor])
+
+
+def steps_to_json(steps):
+    """return steps as a JSON array, one step per line
+    """
+    return '[\n' + ',\n'.join(json.dumps(step.to_json()) for step in steps) + '\n]'
+
+
 # Helpers
 
 
@@ -941,8 +1434,10 @@ def candidate_cells(dict_candidate_cells):
 
 
 def apply_remove_candidates(grid, caption, remove_dict):
-    grid.push((caption, 'discard', remove_dict))
-    for candidate, cell in candidate_cells(remove_dict):
+    removed = [(cell, candidate) for candidate, cell in candidate_cells(remove_dict)
+               if candidate in cell.candidates]
+    grid.push(DiscardMove(caption, remove_dict, removed))
+    for cell, candidate in removed:
         cell.candidates.discard(candidate)
     return sum(len(_) for _ in remove_dict.values())
 
@@ -975,8 +1470,7 @@ def packed_candidates(candidates):
 def discarded_at_last_move(grid):
     """Return candidates discarded at last move (from history).
     """
-    _, _, discarded = grid.history[-1]
-    return discarded
+    return grid.history[-1].discarded
 
 
 def discarded_text(cand_cells_dict):
@@ -989,27 +1483,30 @@ def discarded_text(cand_cells_dict):
     return ', '.join(list_coord)
 
 
-def single_history(grid):
-    start = len(grid.history) - 1
-
-    i = start
-    while i >= 0 and grid.history[i][0] in ('Full house', 'Naked single', 'Hidden single'):
+def last_singles(grid):
+    """return the singles at the end of history as a list of (caption, cell
+    number, value)
+    """
+    i = len(grid.history) - 1
+    while i >= 0 and grid.history[i].caption in ('Full house', 'Naked single', 'Hidden single'):
         i -= 1
+    return [(item.caption, item.cell.cellnum, item.value) for item in grid.history[i + 1:]]
 
-    i += 1
+
+def singles_text(singles):
     hist = []
-    while i <= start:
-        tech = grid.history[i][0]
-        ldesc = []
-        while i <= start and grid.history[i][0] == tech:
-            ldesc.append('%s=%d' % (grid.history[i][2].strcoord(), grid.history[i][3]))
-            i += 1
+    for tech, group in itertools.groupby(singles, key=lambda single: single[0]):
+        ldesc = ['r%dc%d=%d' % (cellnum // 9 + 1, cellnum % 9 + 1, value) for _, cellnum, value in group]
         for k in range(0, len(ldesc), 10):
             hist.append('%-13s: ' % tech + ', '.join(ldesc[k:k + 10]))
 
     return '\n'.join(hist)
 
 
+def single_history(grid):
+    return singles_text(last_singles(grid))
+
+
 def print_single_history(grid):
     singlehistory = single_history(grid)
     if singlehistory:
@@ -1017,6 +1514,148 @@ def print_single_history(grid):
         print()
 
 
+def candidates_mask(candidates):
+    """return candidates as a bit mask (bit d for candidate d)
+    """
+    mask = 0
+    for digit in candidates:
+        mask |= 1 << digit
+    return mask
+
+
+def cells_mask(cells):
+    """return cells as a 81 bit mask (bit n for cell number n)
+    """
+    mask = 0
+    for cell in cells:
+        mask |= 1 << cell.cellnum
+    return mask
+
+
+def mask_cells(grid, mask):
+    """return the list of cells of a 81 bit mask, sorted by cell number
+    """
+    cells = []
+    while mask:
+        low = mask & -mask
+        cells.append(grid.cells[low.bit_length() - 1])
+        mask ^= low
+    return cells
+
+
+def popcount(mask):
+    """return the number of bits set in mask (int.bit_count requires python 3.10)
+    """
+    return bin(mask).count('1')
+
+
+def mask_cells_nums(mask):
+    """iterate on the cell numbers of a 81 bit mask, in increasing order
+    """
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def digit_positions(grid, digit):
+    """return the 81 bit mask of cells with digit as candidate
+    """
+    return cells_mask(cell for cell in grid.cells if digit in cell.candidates)
+
+
+def make_peers_masks():
+    masks = []
+    for i in range(81):
+        mask = 0
+        for j in range(81):
+            if i != j and (i // 9 == j // 9 or i % 9 == j % 9 or
+                           (i // 27, i % 9 // 3) == (j // 27, j % 9 // 3)):
+                mask |= 1 << j
+        masks.append(mask)
+    return masks
+
+
+# PEERS_MASK[n] is the mask of the 20 peers of cell n
+PEERS_MASK = make_peers_masks()
+
+
+def make_units_masks():
+    masks = [0] * 27
+    for cellnum in range(81):
+        rownum, colnum = divmod(cellnum, 9)
+        boxnum = rownum // 3 * 3 + colnum // 3
+        masks[rownum] |= 1 << cellnum
+        masks[9 + colnum] |= 1 << cellnum
+        masks[18 + boxnum] |= 1 << cellnum
+    return masks
+
+
+# UNITS_MASK[n] is the mask of the cells of unit n, in the order of grid.units()
+# (rows 0-8, columns 9-17, boxes 18-26)
+UNITS_MASK = make_units_masks()
+ROW_UNITS = tuple(range(0, 9))
+COL_UNITS = tuple(range(9, 18))
+BOX_UNITS = tuple(range(18, 27))
+
+
+def make_pair_tables():
+    sees = []
+    common_peers = []
+    shared_units = []
+    for i in range(81):
+        sees.append(bytes(PEERS_MASK[i] >> j & 1 for j in range(81)))
+        common_peers.append(tuple(PEERS_MASK[i] & PEERS_MASK[j] for j in range(81)))
+        shared_units.append(bytes((i // 9 == j // 9) * SAME_ROW |
+                                  (i % 9 == j % 9) * SAME_COL |
+                                  ((i // 27, i % 9 // 3) == (j // 27, j % 9 // 3)) * SAME_BOX
+                                  for j in range(81)))
+    return tuple(sees), tuple(common_peers), tuple(shared_units)
+
+
+# Tables indexed by pairs of cell numbers [n1][n2]:
+# SEES: 1 if n1 and n2 are peers, 0 otherwise (including n1 == n2)
+# COMMON_PEERS: mask of the cells seeing both n1 and n2
+# SHARED_UNITS: combination of SAME_ROW, SAME_COL and SAME_BOX flags
+SAME_ROW, SAME_COL, SAME_BOX = 1, 2, 4
+SEES, COMMON_PEERS, SHARED_UNITS = make_pair_tables()
+
+
+def common_peers(grid, cell1, cell2):
+    """return the list of cells seeing both cell1 and cell2, in cell order
+    """
+    return mask_cells(grid, COMMON_PEERS[cell1.cellnum][cell2.cellnum])
+
+
+def seen_by_all(cells):
+    """return the mask of cells seeing all cells in argument
+    """
+    mask = (1 << 81) - 1
+    for cell in cells:
+        mask &= PEERS_MASK[cell.cellnum]
+    return mask
+
+
+def seen_by_mask(cellmask, mask=(1 << 81) - 1):
+    """return the cells of mask (by default all cells) seeing all cells of
+    cellmask
+    """
+    while cellmask and mask:
+        low = cellmask & -cellmask
+        mask &= PEERS_MASK[low.bit_length() - 1]
+        cellmask ^= low
+    return mask
+
+
+def seen_by_any(cellmask):
+    """return the mask of cells seeing at least one cell of cellmask
+    """
+    mask = 0
+    for cellnum in mask_cells_nums(cellmask):
+        mask |= PEERS_MASK[cellnum]
+    return mask
+
+
 def batched(iterable, n, *, strict=False):
     # TODO: remove when updating python to 3.12 or above
     # batched('ABCDEFG', 3) → ABC DEF G
@@ -1043,7 +1682,7 @@ def solve_backtrack(grid, explain):
 
 def solve_dancing_links(grid, explain=False):
     s = grid.output_s81(unknown='0')
-    d = dlx_sudoku.DLXsudoku(s)
+    d = import_sibling('dlx_sudoku').DLXsudoku(s)
     for sol in d.solve():
         grid.input(d.createSolutionString(sol))
         return 81
@@ -1052,7 +1691,7 @@ def solve_dancing_links(grid, explain=False):
 
 def nb_solutions(grid, maxout=1000):
     s = grid.output_s81(unknown='0')
-    d = dlx_sudoku.DLXsudoku(s)
+    d = import_sibling('dlx_sudoku').DLXsudoku(s)
     nb = 0
     for sol in d.solve():
         nb += 1
@@ -1070,8 +1709,7 @@ def solve_full_house(grid, explain):
         if len(unset) == 1:
             cell = unset[0]
             cand = list(cell.candidates)[0]
-            discarded = grid.set_value(cell, cand)
-            grid.push(('Full house', 'value', cell, cand, discarded))
+            grid.place('Full house', cell, cand)
             return 10
     return 0
 
@@ -1082,12 +1720,29 @@ def solve_single_candidate(grid, explain, target=None):
         if len(cell.candidates) == 1:
             value = list(cell.candidates)[0]
             if target is None or value == int(target):
-                discarded = grid.set_value(cell, value)
-                grid.push(('Naked single', 'value', cell, value, discarded))
+                grid.place('Naked single', cell, value)
                 return 10
     return 0
 
 
+def has_singles(grid):
+    """return True if a naked or hidden single can be placed
+    """
+    for unit in grid.units():
+        once = 0
+        twice = 0
+        for cell in unit:
+            if cell.value is None:
+                mask = candidates_mask(cell.candidates)
+                if mask & (mask - 1) == 0:
+                    return True
+                twice |= once & mask
+                once |= mask
+        if once & ~twice:
+            return True
+    return False
+
+
 # Single digit techniques
 
 
@@ -1100,8 +1755,7 @@ def solve_hidden_candidate(grid, explain, target=None):
             if (cell.alone_in_row(cand) or
                 cell.alone_in_col(cand) or
                 cell.alone_in_box(cand)) and (target is None or cand == int(target)):
-                discarded = grid.set_value(cell, cand)
-                grid.push(('Hidden single', 'value', cell, cand, discarded))
+                grid.place('Hidden single', cell, cand)
                 return 10
     return 0
 
@@ -1167,10 +1821,10 @@ def apply_locked_sets(grid, caption, explain, candidates, define_set, remove_set
 
 
 def explain_locked_sets(grid, caption, candidates, define_set, remove_set, remove_dict):
-    print_single_history(grid)
-    print(describe_locked_set(caption, candidates, define_set, remove_dict))
-    grid.dump(((define_set, candidates, CellDecor.DEFININGCAND),
-                (remove_set, candidates, CellDecor.REMOVECAND)))
+    text = describe_locked_set(caption, candidates, define_set, remove_dict)
+    decor = ((define_set, candidates, CellDecor.DEFININGCAND),
+              (remove_set, candidates, CellDecor.REMOVECAND))
+    explain_step(grid, caption, text, remove_dict, decor)
 
 
 def describe_locked_set(legend, candidates, define_set, remove_dict):
@@ -1243,10 +1897,10 @@ def apply_locked_candidates(grid, caption, flavor, explain, candidates, define_s
 
 
 def explain_locked_candidates(grid, caption, flavor, candidates, define_set, remove_set, remove_dict):
-    print_single_history(grid)
-    print(describe_locked_candidates(caption, flavor, candidates, define_set, remove_dict))
-    grid.dump(((define_set, candidates, CellDecor.DEFININGCAND),
-               (remove_set, candidates, CellDecor.REMOVECAND)))
+    text = describe_locked_candidates(caption, flavor, candidates, define_set, remove_dict)
+    decor = ((define_set, candidates, CellDecor.DEFININGCAND),
+             (remove_set, candidates, CellDecor.REMOVECAND))
+    explain_step(grid, caption, text, remove_dict, decor)
 
 
 def describe_locked_candidates(caption, flavor, candidates, define_set, remove_dict):
@@ -1304,10 +1958,10 @@ def apply_naked_set(grid, caption, explain, candidates, subset, remove_set):
 
 
 def explain_naked_set(grid, caption, candidates, subset, remove_set, remove_dict):
-    print_single_history(grid)
-    print(describe_locked_set(caption, candidates, subset, remove_dict))
-    grid.dump(((subset, candidates, CellDecor.DEFININGCAND),
-                (remove_set, candidates, CellDecor.REMOVECAND)))
+    text = describe_locked_set(caption, candidates, subset, remove_dict)
+    decor = ((subset, candidates, CellDecor.DEFININGCAND),
+              (remove_set, candidates, CellDecor.REMOVECAND))
+    explain_step(grid, caption, text, remove_dict, decor)
 
 
 def solve_hidden_pair(grid, explain, target=None):
@@ -1352,61 +2006,211 @@ def apply_hidden_set(grid, caption, explain, candidates, define_set, remove_set)
 
 
 def explain_hidden_set(grid, caption, candidates, define_set, remove_set, remove_dict):
-    print_single_history(grid)
     allcand = candidate_union(define_set)
-    print(describe_locked_set(caption, allcand - candidates, remove_set, remove_dict))
-    grid.dump(((remove_set,
-                ALLCAND - candidates, CellDecor.DEFININGCAND,
-                candidates, CellDecor.REMOVECAND),))
+    text = describe_locked_set(caption, allcand - candidates, remove_set, remove_dict)
+    decor = ((remove_set,
+              ALLCAND - candidates, CellDecor.DEFININGCAND,
+              candidates, CellDecor.REMOVECAND),)
+    explain_step(grid, caption, text, remove_dict, decor)
+
+
+# Fishes
+#
+# All fishes are handled by a single engine working on 81 bit masks. For a
+# digit, a fish of size n is made of n base units and n cover units (rows,
+# columns or boxes). Base candidates out of the cover units are fins. Candidates
+# in cover units and not in base units (or in two cover units) can be eliminated
+# if they see all fins.
+
+
+FISH_NAMES = {2: 'X-wing', 3: 'swordfish', 4: 'jellyfish', 5: 'squirmbag', 6: 'whale', 7: 'leviathan'}
+
+
+def fish_search(positions, size, base_units, cover_units, finned, kraken=False):
+    """Generate the fishes of the given size for the candidate positions of a
+    digit, with base units in base_units and cover units in cover_units, as
+    tuples (base, cover, fins, eliminations), fins and eliminations being 81 bit
+    masks. Only fishes with eliminations are generated, in lexicographic order of
+    base and cover units.
+    If finned is false, only fishes without fins are considered, otherwise only
+    fishes with fins. For finned fishes, base units may share candidates (endo
+    fins).
+    If kraken is true, eliminations are the ones of the fish without its fins.
+    Base sets are enumerated recursively, the cover sets of a base are found by
+    deciding for each base candidate if it is covered or if it is a fin, with
+    pruning on the number of cover units and on the visibility of fins.
+    """
+    unitpos = [positions & mask for mask in UNITS_MASK]
+    units = [unit for unit in base_units
+             if 2 <= popcount(unitpos[unit]) and (finned or popcount(unitpos[unit]) <= size)]
+    yield from fish_bases(positions, unitpos, size, units, cover_units, finned, kraken, 0, (), 0, 0)
+
+
+def fish_bases(positions, unitpos, size, units, cover_units, finned, kraken, start, base, basemask, endofins):
+    if len(base) < size:
+        for i in range(start, len(units) - (size - len(base)) + 1):
+            unit = units[i]
+            endofins2 = endofins | basemask & unitpos[unit]
+            if endofins2:
+                # candidates shared by base units are endo fins
+                if not finned:
+                    continue
+                if not kraken and not seen_by_mask(endofins2, positions & ~endofins2):
+                    continue
+            yield from fish_bases(positions, unitpos, size, units, cover_units, finned, kraken,
+                                  i + 1, base + (unit,), basemask | unitpos[unit], endofins2)
+        return
+
+    covers = [unit for unit in cover_units if unit not in base and unitpos[unit] & basemask]
+    if len(covers) < size:
+        return
+
+    for cover, fins in sorted(fish_covers(positions, size, basemask, endofins, covers, finned, kraken).items()):
+        if bool(fins) != finned:
+            continue
+        covered = overlap = 0
+        for unit in cover:
+            overlap |= covered & UNITS_MASK[unit]
+            covered |= UNITS_MASK[unit]
+        eliminations = positions & (covered & ~basemask | overlap & basemask) & ~fins
+        if fins and not kraken:
+            eliminations &= seen_by_mask(fins)
+        if eliminations:
+            yield base, cover, fins, eliminations
+
+
+def fish_covers(positions, size, basemask, endofins, covers, finned, kraken):
+    """return the sets of cover units for a base as a dictionary {cover: fins}.
+    Base candidates are taken in order, and are either covered by a cover unit
+    or fins. Fins must see a common candidate.
+    """
+    found = {}
+    cells = list(mask_cells_nums(basemask & ~endofins))
+    cellcovers = {cell: [unit for unit in covers if UNITS_MASK[unit] >> cell & 1] for cell in cells}
+    maxcover = max(popcount(UNITS_MASK[unit] & basemask) for unit in covers)
+
+    def units_of(coverbits):
+        return tuple(unit for unit in covers if coverbits >> unit & 1)
+
+    visited = set()
+
+    def search(index, coverbits, ncover, covered, fins, targets):
+        # coverbits: bit mask of cover units, targets: candidates seeing all fins
+        while index < len(cells) and covered >> cells[index] & 1:
+            index += 1
+        if (index, coverbits, fins) in visited:
+            return
+        visited.add((index, coverbits, fins))
+        if index == len(cells):
+            # complete with cover units containing neither uncovered candidates nor fins
+            extra = [unit for unit in covers if not coverbits >> unit & 1 and not UNITS_MASK[unit] & fins]
+            for more in itertools.combinations(extra, size - ncover):
+                found[tuple(sorted(units_of(coverbits) + more))] = fins | endofins
+            return
+        if ncover == size:
+            # no more cover units, remaining candidates are fins
+            rest = basemask & ~endofins & ~covered & ~((1 << cells[index]) - 1)
+            if finned and (kraken or seen_by_mask(rest, targets)):
+                found[units_of(coverbits)] = fins | rest | endofins
+            return
+        if not finned:
+            # popcount bound: remaining candidates must be covered by remaining cover units
+            rest = basemask & ~covered & ~((1 << cells[index]) - 1)
+            if popcount(rest) > (size - ncover) * maxcover:
+                return
+        cell = cells[index]
+        for unit in cellcovers[cell]:
+            if not coverbits >> unit & 1 and not UNITS_MASK[unit] & fins:
+                search(index + 1, coverbits | 1 << unit, ncover + 1, covered | UNITS_MASK[unit], fins, targets)
+        if finned:
+            targets2 = targets & PEERS_MASK[cell]
+            if kraken or targets2:
+                search(index + 1, coverbits, ncover, covered, fins | 1 << cell, targets2)
+
+    search(0, 0, 0, 0, 0, seen_by_mask(endofins, positions & ~endofins))
+    return found
+
+
+def is_sashimi(positions, base, fins):
+    """a finned fish is sashimi if a base unit has less than two candidates
+    which are not fins.
+    """
+    return any(popcount(positions & UNITS_MASK[unit] & ~fins) < 2 for unit in base)
+
+
+def is_franken(base, cover):
+    """at least a box, and otherwise rows against columns
+    """
+    units = base + cover
+    if not any(unit in BOX_UNITS for unit in units):
+        return False
+    else:
+        return (all(unit not in COL_UNITS for unit in base) and all(unit not in ROW_UNITS for unit in cover) or
+                all(unit not in ROW_UNITS for unit in base) and all(unit not in COL_UNITS for unit in cover))
+
+
+def is_mutant(base, cover):
+    """neither a basic nor a franken fish
+    """
+    return not (all(unit in ROW_UNITS for unit in base) and all(unit in COL_UNITS for unit in cover) or
+                all(unit in COL_UNITS for unit in base) and all(unit in ROW_UNITS for unit in cover) or
+                is_franken(base, cover))
+
+
+ROW_COL_FISH = ((ROW_UNITS, COL_UNITS, 'H'), (COL_UNITS, ROW_UNITS, 'V'))
+FRANKEN_FISH = ((ROW_UNITS + BOX_UNITS, COL_UNITS + BOX_UNITS, 'H'),
+                (COL_UNITS + BOX_UNITS, ROW_UNITS + BOX_UNITS, 'V'))
+MUTANT_FISH = ((ROW_UNITS + COL_UNITS + BOX_UNITS, ROW_UNITS + COL_UNITS + BOX_UNITS, None),)
+
+
+def unit_cells(grid, positions, unit):
+    return mask_cells(grid, positions & UNITS_MASK[unit])
 
 
 # Basic fishes
 
 
-def solve_X_wing(grid, explain):
-    return solve_basicfish(grid, explain, 2, 'X-wing')
+def solve_X_wing(grid, explain, all_solutions=False):
+    return solve_basicfish(grid, explain, 2, 'X-wing', all_solutions)
 
 
-def solve_swordfish(grid, explain):
-    return solve_basicfish(grid, explain, 3, 'Swordfish')
+def solve_swordfish(grid, explain, all_solutions=False):
+    return solve_basicfish(grid, explain, 3, 'Swordfish', all_solutions)
 
 
-def solve_jellyfish(grid, explain):
-    return solve_basicfish(grid, explain, 4, 'Jellyfish')
+def solve_jellyfish(grid, explain, all_solutions=False):
+    return solve_basicfish(grid, explain, 4, 'Jellyfish', all_solutions)
 
 
-def solve_basicfish(grid, explain, size, name):
-    for digit in ALLDIGITS:
-        nb_removed = solve_basicfish_rows(grid, explain, size, name, digit, grid.rows, grid.cols, Cell.mrownum, Cell.mcolnum, 'H')
-        if nb_removed:
-            return nb_removed
-        nb_removed = solve_basicfish_rows(grid, explain, size, name, digit, grid.cols, grid.rows, Cell.mcolnum, Cell.mrownum, 'V')
-        if nb_removed:
-            return nb_removed
-    return 0
+def solve_squirmbag(grid, explain, all_solutions=False):
+    return solve_basicfish(grid, explain, 5, 'Squirmbag', all_solutions)
 
 
-def solve_basicfish_rows(grid, explain, size, name, digit, rows, cols, mrownum, mcolnum, orientation):
-    candrows = []
-    for row in rows:
-        rowcells = [cell for cell in row if digit in cell.candidates]
-        if 1 < len(rowcells) <= size:
-            candrows.append(rowcells)
-
-    for defrows in itertools.combinations(candrows, size):
-        rowsnum = [mrownum(row[0]) for row in defrows]
-        colsnum = {mcolnum(cell) for row in defrows for cell in row}
-        if len(colsnum) == size:
-            # n rows with candidates in n cols
-            remove_set = []
-            for colnum in colsnum:
-                for cell in cols[colnum]:
-                    if mrownum(cell) not in rowsnum:
-                        remove_set.append(cell)
-            nb_removed = apply_basic_fish(grid, name, explain, [digit], defrows, remove_set, orientation)
-            if nb_removed:
-                return nb_removed
-    return 0
+def solve_whale(grid, explain, all_solutions=False):
+    return solve_basicfish(grid, explain, 6, 'Whale', all_solutions)
+
+
+def solve_leviathan(grid, explain, all_solutions=False):
+    return solve_basicfish(grid, explain, 7, 'Leviathan', all_solutions)
+
+
+def solve_basicfish(grid, explain, size, name, all_solutions=False):
+    """with all_solutions, apply all the fishes found in one pass instead of
+    the first one. Eliminations of a fish remain valid after applying the
+    previous ones and the ones already done are skipped.
+    """
+    total = 0
+    for digit in ALLDIGITS:
+        positions = digit_positions(grid, digit)
+        for base_units, cover_units, orientation in ROW_COL_FISH:
+            for base, _, _, eliminations in fish_search(positions, size, base_units, cover_units, finned=False):
+                defunits = [unit_cells(grid, positions, unit) for unit in base]
+                nb_removed = apply_basic_fish(grid, name, explain, [digit], defunits,
+                                              mask_cells(grid, eliminations), orientation)
+                if nb_removed and not all_solutions:
+                    return nb_removed
+                total += nb_removed
+    return total
 
 
 def apply_basic_fish(grid, caption, explain, candidates, defunits, remove_set, orientation):
@@ -1420,10 +2224,10 @@ def apply_basic_fish(grid, caption, explain, candidates, defunits, remove_set, o
 
 def explain_basic_fish(grid, caption, candidates, defunits, remove_set, remove_dict, orientation):
     subset = cellunionx(*defunits)
-    print_single_history(grid)
-    print(describe_basic_fish(caption, candidates, subset, remove_dict, orientation))
-    grid.dump(((subset, candidates, CellDecor.DEFININGCAND),
-               (remove_set, candidates, CellDecor.REMOVECAND)))
+    text = describe_basic_fish(caption, candidates, subset, remove_dict, orientation)
+    decor = ((subset, candidates, CellDecor.DEFININGCAND),
+             (remove_set, candidates, CellDecor.REMOVECAND))
+    explain_step(grid, caption, text, remove_dict, decor)
 
 
 def describe_basic_fish(legend, candidates, subset, remove_dict, orientation):
@@ -1441,84 +2245,31 @@ def describe_basic_fish(legend, candidates, subset, remove_dict, orientation):
 # Finned and sashimi fishes
 
 
-def solve_finned_x_wing(grid, explain):
-    return solve_finned_x_wing_tech(grid, explain, tech={'Finned'})
-
-
-def solve_sashimi_x_wing(grid, explain):
-    return solve_finned_x_wing_tech(grid, explain, tech={'Sashimi'})
-
-
-def solve_finned_x_wing_tech(grid, explain, tech):
-    for digit in ALLDIGITS:
-        nb_removed = solve_finned_x_wing_unit(grid, explain, digit, grid.rows,
-            Cell.mrownum, Cell.mcolnum, Cell.mboxrow, Cell.mboxcol, tech=tech)
-        if nb_removed:
-            return nb_removed
-        nb_removed = solve_finned_x_wing_unit(grid, explain, digit, grid.cols,
-            Cell.mcolnum, Cell.mrownum, Cell.mboxcol, Cell.mboxrow, tech=tech)
-        if nb_removed:
-            return nb_removed
-    return 0
+def solve_finned_x_wing(grid, explain, all_solutions=False):
+    return solve_finned_fish(grid, explain, 2, 'Finned X-wing', tech={'Finned'}, target=None, all_solutions=all_solutions)
 
 
-def solve_finned_x_wing_unit(grid, explain, digit, rows, rownum, colnum, mboxrow, mboxcol, tech):
-    for row in rows:
-        rowcells = [cell for cell in row if digit in cell.candidates]
-        if len(rowcells) == 2:
-            cell1, cell2 = rowcells
-            for row2 in rows:
-                if row2 == row:
-                    continue
-                cell3 = row2[colnum(cell1)]
-                cell4 = row2[colnum(cell2)]
-                if digit in cell3.candidates or digit in cell4.candidates:
-                    tri3 = mboxrow(cell3)
-                    tri4 = mboxrow(cell4)
-                    row2num = sum(1 for cell in row2 if digit in cell.candidates)
-                    tri3num = sum(1 for cell in tri3 if digit in cell.candidates)
-                    tri4num = sum(1 for cell in tri4 if digit in cell.candidates)
-                    if row2num == tri3num + tri4num:
-                        if ('Finned' in tech and digit in cell3.candidates and tri3num == 1 and
-                            digit in cell4.candidates and tri4num > 1):
-                            flavor = 'Finned'
-                        elif ('Finned' in tech and digit in cell3.candidates and tri3num > 1 and
-                            digit in cell4.candidates and tri4num == 1):
-                            flavor = 'Finned'
-                            cell1, cell2, cell3, cell4, tri3, tri4 = cell2, cell1, cell4, cell3, tri4, tri3
-                        elif 'Sashimi' in tech and digit in cell3.candidates and tri3num == 1 and tri4num > 1: # >= 1
-                            flavor = 'Sashimi'
-                        elif 'Sashimi' in tech and digit in cell4.candidates and tri3num > 1 and tri4num == 1:
-                            flavor = 'Sashimi'
-                            cell1, cell2, cell3, cell4, tri3, tri4 = cell2, cell1, cell4, cell3, tri4, tri3
-                        else:
-                            continue
-                        remove_set = [cell for cell in mboxcol(cell4) if cell != cell2 and cell != cell4]
-                        nb_removed = apply_finned_fish(grid, f'{flavor} X-wing', explain, [digit],
-                            [[cell1, cell2], [cell3, cell4], set(tri4) - {cell4}], remove_set)
-                        if nb_removed:
-                            return nb_removed
-    return 0
+def solve_sashimi_x_wing(grid, explain, all_solutions=False):
+    return solve_finned_fish(grid, explain, 2, 'Sashimi X-wing', tech={'Sashimi'}, target=None, all_solutions=all_solutions)
 
 
-def apply_finned_fish(grid, caption, explain, candidates, defunits, cells_to_discard):
+def apply_finned_fish(grid, caption, explain, candidates, defunits, cells_to_discard, orientation):
     remove_dict = candidates_cells(candidates, cells_to_discard)
     if remove_dict:
         if explain:
-            explain_finned_fish(grid, caption, candidates, defunits, cells_to_discard, remove_dict)
+            explain_finned_fish(grid, caption, candidates, defunits, cells_to_discard, remove_dict, orientation)
         return apply_remove_candidates(grid, caption, remove_dict)
     return 0
 
 
-def explain_finned_fish(grid, caption, candidates, defunits, cells_to_discard, remove_dict):
-    orientation = 'H' if defunits[0][0].rownum == defunits[0][1].rownum else 'V'
+def explain_finned_fish(grid, caption, candidates, defunits, cells_to_discard, remove_dict, orientation):
     subset = cellunionx(*defunits[:-1])
     fin = [cell for cell in defunits[-1] if candidates[0] in cell.candidates]
-    print_single_history(grid)
-    print(describe_finned_fish(caption, candidates, subset, fin, orientation, remove_dict))
-    grid.dump(((subset, candidates, CellDecor.DEFININGCAND),
-               (fin, candidates, CellDecor.COLOR3),
-               (cells_to_discard, candidates, CellDecor.REMOVECAND)))
+    text = describe_finned_fish(caption, candidates, subset, fin, orientation, remove_dict)
+    decor = ((subset, candidates, CellDecor.DEFININGCAND),
+             (fin, candidates, CellDecor.COLOR3),
+             (cells_to_discard, candidates, CellDecor.REMOVECAND))
+    explain_step(grid, caption, text, remove_dict, decor)
 
 
 def describe_finned_fish(legend, candidates, subset, fin, orientation, remove_dict):
@@ -1534,132 +2285,312 @@ def describe_finned_fish(legend, candidates, subset, fin, orientation, remove_di
         discarded_text(remove_dict))
 
 
-def solve_finned_swordfish(grid, explain, target=None):
-    return solve_finned_fish(grid, explain, 3, 'Finned swordfish', tech={'Finned'}, target=target)
+def solve_finned_swordfish(grid, explain, target=None, all_solutions=False):
+    return solve_finned_fish(grid, explain, 3, 'Finned swordfish', tech={'Finned'}, target=target, all_solutions=all_solutions)
 
 
-def solve_finned_jellyfish(grid, explain, target=None):
-    return solve_finned_fish(grid, explain, 4, 'Finned jellyfish', tech={'Finned'}, target=target)
+def solve_finned_jellyfish(grid, explain, target=None, all_solutions=False):
+    return solve_finned_fish(grid, explain, 4, 'Finned jellyfish', tech={'Finned'}, target=target, all_solutions=all_solutions)
 
 
-def solve_sashimi_swordfish(grid, explain, target=None):
-    return solve_finned_fish(grid, explain, 3, 'Sashimi swordfish', tech={'Sashimi'}, target=target)
+def solve_finned_squirmbag(grid, explain, target=None, all_solutions=False):
+    return solve_finned_fish(grid, explain, 5, 'Finned squirmbag', tech={'Finned'}, target=target, all_solutions=all_solutions)
 
 
-def solve_sashimi_jellyfish(grid, explain, target=None):
-    return solve_finned_fish(grid, explain, 4, 'Sashimi jellyfish', tech={'Sashimi'}, target=target)
+def solve_finned_whale(grid, explain, target=None, all_solutions=False):
+    return solve_finned_fish(grid, explain, 6, 'Finned whale', tech={'Finned'}, target=target, all_solutions=all_solutions)
 
 
-def solve_finned_fish(grid, explain, size, name, tech, target):
-    for digit in ALLDIGITS:
-        if not (target is None or digit == int(target)):
-            continue
-        nb_removed = solve_finned_fish_rows(grid, explain, size, name, digit, grid.rows, grid.cols, Cell.mrownum, Cell.mcolnum, Cell.mboxrow, tech)
-        if nb_removed:
-            return nb_removed
-        nb_removed = solve_finned_fish_rows(grid, explain, size, name, digit, grid.cols, grid.rows, Cell.mcolnum, Cell.mrownum, Cell.mboxcol, tech)
-        if nb_removed:
-            return nb_removed
-    return 0
+def solve_finned_leviathan(grid, explain, target=None, all_solutions=False):
+    return solve_finned_fish(grid, explain, 7, 'Finned leviathan', tech={'Finned'}, target=target, all_solutions=all_solutions)
 
 
-def solve_finned_fish_rows(grid, explain, size, name, digit, rows, cols, mrownum, mcolnum, mboxrow, tech):
-    # list of rows with at least two cells with the given candidate
-    candrows = []
-    for row in rows:
-        rowcells = [cell for cell in row if digit in cell.candidates]
-        if len(rowcells) >= 2:
-            candrows.append(rowcells)
-
-    # consider all subsets of candrows with the given size
-    for defrows in itertools.combinations(candrows, size):
-
-        # set of covering columns numbers
-        colsnum = {mcolnum(cell) for row in defrows for cell in row}
-
-        # consider all subsets of covering columns with the given size
-        for covercols in itertools.combinations(sorted(colsnum), size):
-
-            # search for cell in defrows not in covercols (potential fins)
-            complement = set()
-            for row in defrows:
-                for cell in row:
-                    if mcolnum(cell) not in covercols:
-                        complement.add(cell)
-
-            # all cells in complement (potential fins) must be in a single box
-            box = None
-            for cell in complement:
-                if box is None:
-                    box = cell.box
-                elif box == cell.box:
-                    pass
-                else:
-                    # at least two boxes
-                    box = False
-                    break
+def solve_sashimi_swordfish(grid, explain, target=None, all_solutions=False):
+    return solve_finned_fish(grid, explain, 3, 'Sashimi swordfish', tech={'Sashimi'}, target=target, all_solutions=all_solutions)
 
-            if not box:
-                continue
 
-            # the box must intersect with a cover col
-            intersect = False
-            for colnum in covercols:
-                if colnum // 3 == mcolnum(box[0]) // 3:
-                    intersect = True
-                    break
+def solve_sashimi_jellyfish(grid, explain, target=None, all_solutions=False):
+    return solve_finned_fish(grid, explain, 4, 'Sashimi jellyfish', tech={'Sashimi'}, target=target, all_solutions=all_solutions)
 
-            if not intersect:
-                continue
 
-            # test for sashimi
-            if 'Sashimi' in tech or is_genuine_fish(grid, size, digit, rows, defrows, covercols, mrownum, mcolnum):
-                pass
-            else:
-                continue
+def solve_sashimi_squirmbag(grid, explain, target=None, all_solutions=False):
+    return solve_finned_fish(grid, explain, 5, 'Sashimi squirmbag', tech={'Sashimi'}, target=target, all_solutions=all_solutions)
 
-            defcells = []
-            for row in defrows:
-                defcells.extend(cell for cell in row if mcolnum(cell) in covercols)
-
-            fin_set = []
-            remove_set = []
-            for cell in box:
-                in_base = any(cell in row for row in defrows)
-                in_cover = mcolnum(cell) in covercols
-                if in_base and not in_cover:
-                    fin_set.append(cell)
-                elif not in_base and in_cover:
-                    remove_set.append(cell)
-            assert sorted(fin_set) == sorted(complement)
-
-            nb_removed = apply_finned_fish(grid, name, explain, [digit], [defcells] + [fin_set], remove_set)
-            if nb_removed:
-                return nb_removed
+
+def solve_sashimi_whale(grid, explain, target=None, all_solutions=False):
+    return solve_finned_fish(grid, explain, 6, 'Sashimi whale', tech={'Sashimi'}, target=target, all_solutions=all_solutions)
+
+
+def solve_sashimi_leviathan(grid, explain, target=None, all_solutions=False):
+    return solve_finned_fish(grid, explain, 7, 'Sashimi leviathan', tech={'Sashimi'}, target=target, all_solutions=all_solutions)
+
+
+def solve_finned_fish(grid, explain, size, name, tech, target, all_solutions=False):
+    """Finned fishes with base in rows and cover in columns, or the reverse. The
+    sashimi technique accepts both finned and sashimi fishes. all_solutions as
+    for basic fishes.
+    """
+    total = 0
+    for digit in ALLDIGITS:
+        if not (target is None or digit == int(target)):
+            continue
+        positions = digit_positions(grid, digit)
+        for base_units, cover_units, orientation in ROW_COL_FISH:
+            for base, cover, fins, eliminations in fish_search(positions, size, base_units, cover_units, finned=True):
+                if 'Sashimi' not in tech and is_sashimi(positions, base, fins):
+                    continue
+                defcells = []
+                for unit in base:
+                    defcells.extend(unit_cells(grid, positions & ~fins, unit))
+                nb_removed = apply_finned_fish(grid, name, explain, [digit],
+                                               [defcells] + [mask_cells(grid, fins)],
+                                               mask_cells(grid, eliminations), orientation)
+                if nb_removed and not all_solutions:
+                    return nb_removed
+                total += nb_removed
+    return total
+
+
+# Franken and mutant fishes
+
+
+def solve_complex_fish(grid, explain, size, kind, configurations, accept, finned, target=None,
+                       all_solutions=False):
+    """search fishes of the given size with base and cover units taken from
+    configurations, and accepted by the predicate accept(base, cover).
+    all_solutions as for basic fishes.
+    """
+    caption = f'{kind} {FISH_NAMES[size]}'
+    total = 0
+    for digit in ALLDIGITS:
+        if not (target is None or digit == int(target)):
+            continue
+        positions = digit_positions(grid, digit)
+        for base_units, cover_units, _ in configurations:
+            for base, cover, fins, eliminations in fish_search(positions, size, base_units, cover_units, finned):
+                if accept(base, cover):
+                    remove_dict = candidates_cells([digit], mask_cells(grid, eliminations))
+                    if remove_dict:
+                        nb_removed = apply_fish(grid, caption, explain, digit, positions, base, cover, fins,
+                                                remove_dict)
+                        if not all_solutions:
+                            return nb_removed
+                        total += nb_removed
+    return total
+
+
+# technique code -> solver, for sizes 2 (x-wing) to 7 (leviathan)
+COMPLEX_FISH_SOLVERS = {
+    f'{prefix}{size}': functools.partial(solve_complex_fish, size=size, kind=kind,
+                                         configurations=configurations, accept=accept, finned=finned)
+    for prefix, kind, configurations, accept, finned in (
+        ('ff', 'Franken', FRANKEN_FISH, is_franken, False),
+        ('fff', 'Finned franken', FRANKEN_FISH, is_franken, True),
+        ('mf', 'Mutant', MUTANT_FISH, is_mutant, False),
+        ('fmf', 'Finned mutant', MUTANT_FISH, is_mutant, True))
+    for size in range(2, 8)
+}
+
+
+def apply_fish(grid, caption, explain, digit, positions, base, cover, fins, remove_dict):
+    if explain:
+        explain_fish(grid, caption, digit, positions, base, cover, fins, remove_dict)
+    return apply_remove_candidates(grid, caption, remove_dict)
+
+
+def explain_fish(grid, caption, digit, positions, base, cover, fins, remove_dict):
+    basecells = mask_cells(grid, positions & cellunion_mask(base) & ~fins)
+    fincells = mask_cells(grid, fins)
+    text = describe_fish(caption, digit, base, cover, fincells, remove_dict)
+    decor = ((basecells, [digit], CellDecor.DEFININGCAND),
+             (fincells, [digit], CellDecor.COLOR3),
+             (remove_dict[digit], [digit], CellDecor.REMOVECAND))
+    explain_step(grid, caption, text, remove_dict, decor)
+
+
+def cellunion_mask(units):
+    mask = 0
+    for unit in units:
+        mask |= UNITS_MASK[unit]
+    return mask
+
+
+def units_text(units):
+    # r15b3
+    text = ''
+    for letter, first in (('r', 0), ('c', 9), ('b', 18)):
+        numbers = [unit - first + 1 for unit in units if first <= unit < first + 9]
+        if numbers:
+            text += letter + ''.join(str(_) for _ in numbers)
+    return text
+
+
+def describe_fish(legend, digit, base, cover, fins, remove_dict):
+    # Finned franken swordfish: 5 r15b3 c268 fr2c9 => r3c8<>5
+    return '%s: %s %s %s%s => %s' % (legend,
+        digit,
+        units_text(base),
+        units_text(cover),
+        f' f{packed_coordinates(fins)}' if fins else '',
+        discarded_text(remove_dict))
+
+
+# Kraken fishes
+
+
+def solve_kraken_fish_type_1(grid, explain):
+    """Finned fish on digit d: if each fin implies that a cell of the cover
+    units outside the base units cannot hold d, d can be eliminated from this
+    cell (either a fin is true or the fish holds).
+    """
+    implications = KrakenImplications(grid)
+    for digit in ALLDIGITS:
+        positions = digit_positions(grid, digit)
+        for size in range(2, KRAKEN_MAX_SIZE + 1):
+            for base_units, cover_units, _ in ROW_COL_FISH:
+                for base, cover, fins, eliminations in fish_search(positions, size, base_units, cover_units,
+                                                                  finned=True, kraken=True):
+                    removed = 0
+                    for cellnum in mask_cells_nums(eliminations):
+                        if all(implications.excludes(fin, digit, cellnum, digit) for fin in mask_cells_nums(fins)):
+                            removed |= 1 << cellnum
+                    if removed:
+                        remove_dict = {digit: mask_cells(grid, removed)}
+                        return apply_fish(grid, 'Kraken fish type 1', explain, digit, positions,
+                                          base, cover, fins, remove_dict)
     return 0
 
 
-def is_genuine_fish(grid, size, digit, rows, fishrows, colnums, mrownum, mcolnum):
+def solve_kraken_fish_type_2(grid, explain):
+    """Finned fish on digit d: either a fin is true or the fish holds and, for
+    each cover unit, one of the base candidates in this cover unit is true. If
+    a candidate of another digit is excluded by each fin and each of these base
+    candidates, it can be eliminated.
     """
-    Base set in rows, cover set in columns.
-    At least, two candidates in each row of the fish.
-    At least, one candidate in each column of the fish.
-    fishrows: only the cells with candidate in rows
+    implications = KrakenImplications(grid)
+    for digit in ALLDIGITS:
+        positions = digit_positions(grid, digit)
+        for size in range(2, KRAKEN_MAX_SIZE + 1):
+            for base_units, cover_units, _ in ROW_COL_FISH:
+                for base, cover, fins, _ in fish_search(positions, size, base_units, cover_units,
+                                                        finned=True, kraken=True):
+                    basemask = positions & cellunion_mask(base) & ~fins
+                    for unit in cover:
+                        sources = list(mask_cells_nums(basemask & UNITS_MASK[unit])) + list(mask_cells_nums(fins))
+                        excluded = implications.common_exclusions(sources, digit)
+                        remove_dict = {}
+                        for other in ALLDIGITS:
+                            if other != digit and excluded[other]:
+                                remove_dict[other] = mask_cells(grid, excluded[other])
+                        if remove_dict:
+                            return apply_kraken_fish_2(grid, 'Kraken fish type 2', explain, digit, positions,
+                                                       base, cover, fins, remove_dict)
+    return 0
+
+
+def apply_kraken_fish_2(grid, caption, explain, digit, positions, base, cover, fins, remove_dict):
+    if explain:
+        text = describe_fish(caption, digit, base, cover, mask_cells(grid, fins), remove_dict)
+        basecells = mask_cells(grid, positions & cellunion_mask(base) & ~fins)
+        decor = [(basecells, [digit], CellDecor.DEFININGCAND),
+                 (mask_cells(grid, fins), [digit], CellDecor.COLOR3)]
+        decor.extend((cells, {cand}, CellDecor.REMOVECAND) for cand, cells in remove_dict.items())
+        explain_step(grid, caption, text, remove_dict, decor)
+    return apply_remove_candidates(grid, caption, remove_dict)
+
+
+KRAKEN_MAX_SIZE = 4
+
+
+class KrakenImplications:
+    """Consequences of placing a digit in a cell, obtained by propagating naked
+    and hidden singles. Consequences are computed on demand and cached.
     """
-    if len(fishrows) != len(colnums):
-        return False
-    else:
-        for row in fishrows:
-            # number of cells in base row belonging to one of cover columns
-            n = sum(1 for cell in row if mcolnum(cell) in colnums)
-            if n < 2:
-                return False
-        for colnum in colnums:
-            # number of cells in cover column belonging to one of base rows
-            n = sum(1 for row in fishrows if rows[mrownum(row[0])][colnum] in row)
-            if n < 1: # < 2:
-                return False
-        return True
+    def __init__(self, grid):
+        self.candidates = [candidates_mask(cell.candidates) for cell in grid.cells]
+        self.cache = {}
+
+    def removed(self, cellnum, digit):
+        """return for each digit the mask of the cells from which the digit is
+        removed when placing digit in cellnum, or None if a contradiction is
+        met.
+        """
+        key = (cellnum, digit)
+        if key not in self.cache:
+            candidates = kraken_propagate(self.candidates, cellnum, digit)
+            if candidates is None:
+                self.cache[key] = None
+            else:
+                removed = [0] * 10
+                for num, (before, after) in enumerate(zip(self.candidates, candidates)):
+                    lost = before & ~after
+                    while lost:
+                        low = lost & -lost
+                        removed[low.bit_length() - 1] |= 1 << num
+                        lost ^= low
+                self.cache[key] = removed
+        return self.cache[key]
+
+    def excludes(self, cellnum, digit, target, other):
+        """true if placing digit in cellnum removes other from target
+        """
+        removed = self.removed(cellnum, digit)
+        return removed is None or removed[other] >> target & 1
+
+    def common_exclusions(self, cellnums, digit):
+        """return for each digit the mask of the cells from which the digit is
+        removed when placing digit in any of cellnums.
+        """
+        excluded = None
+        for cellnum in cellnums:
+            removed = self.removed(cellnum, digit)
+            if removed is None:
+                continue
+            if excluded is None:
+                excluded = removed
+            else:
+                excluded = [mask1 & mask2 for mask1, mask2 in zip(excluded, removed)]
+            if not any(excluded):
+                break
+        # if all sources are contradictory, the puzzle is invalid
+        return excluded or [0] * 10
+
+
+def kraken_propagate(candidates, cellnum, digit):
+    """place digit in cellnum and propagate naked and hidden singles on a copy of
+    the candidate masks. Return the updated masks or None on contradiction.
+    """
+    candidates = candidates[:]
+    placed = [False] * 81
+    queue = [(cellnum, digit)]
+    while queue:
+        while queue:
+            num, value = queue.pop()
+            bit = 1 << value
+            if not candidates[num] & bit:
+                return None
+            if placed[num]:
+                continue
+            candidates[num] = bit
+            placed[num] = True
+            for peer in mask_cells_nums(PEERS_MASK[num]):
+                if candidates[peer] & bit:
+                    if placed[peer]:
+                        return None
+                    candidates[peer] &= ~bit
+                    if not candidates[peer]:
+                        return None
+                    if candidates[peer] & (candidates[peer] - 1) == 0:
+                        queue.append((peer, candidates[peer].bit_length() - 1))
+
+        # hidden singles
+        for unitmask in UNITS_MASK:
+            for value in ALLDIGITS:
+                bit = 1 << value
+                cells = [num for num in mask_cells_nums(unitmask) if candidates[num] & bit]
+                if len(cells) == 1 and not placed[cells[0]]:
+                    queue.append((cells[0], value))
+    return candidates
 
 
 # Simple coloring
@@ -1670,16 +2601,11 @@ def solve_coloring_trap(grid, explain):
     candidate can be eliminated.
     """
     for digit in ALLDIGITS:
-        clusters = make_clusters(grid, digit)
-        for cluster in clusters:
-            cluster_blue, cluster_green = colorize(digit, cluster)
-
-            peers_cluster_blue = multi_peers(digit, cluster_blue) - cluster_blue
-            peers_cluster_green = multi_peers(digit, cluster_green) - cluster_green
-            remove_set = cellinter(peers_cluster_blue, peers_cluster_green)
-
-            if remove_set:
-                return apply_colortrap(grid, 'Simple color trap', explain, digit, cluster_blue, cluster_green, remove_set)
+        for cluster in get_clusters(grid, digit):
+            remove_mask = cluster.bluepeers & cluster.greenpeers & ~(cluster.bluemask | cluster.greenmask)
+            if remove_mask:
+                return apply_colortrap(grid, 'Simple color trap', explain, digit,
+                                       cluster.blue, cluster.green, mask_cells(grid, remove_mask))
 
     return 0
 
@@ -1692,11 +2618,11 @@ def apply_colortrap(grid, caption, explain, digit, cluster_blue, cluster_green,
 
 
 def explain_colortrap(grid, caption, digit, cluster_blue, cluster_green, remove_set, remove_dict):
-    print_single_history(grid)
-    print(describe_simple_coloring(caption, digit, cluster_green, cluster_blue, remove_dict))
-    grid.dump(((cluster_green, [digit], CellDecor.COLOR1),
-                (cluster_blue, [digit], CellDecor.COLOR2),
-                (remove_set, [digit], CellDecor.REMOVECAND)))
+    text = describe_simple_coloring(caption, digit, cluster_green, cluster_blue, remove_dict)
+    decor = ((cluster_green, [digit], CellDecor.COLOR1),
+              (cluster_blue, [digit], CellDecor.COLOR2),
+              (remove_set, [digit], CellDecor.REMOVECAND))
+    explain_step(grid, caption, text, remove_dict, decor)
 
 
 def describe_simple_coloring(caption, digit, cluster_green, cluster_blue, remove_cells):
@@ -1711,15 +2637,12 @@ def solve_coloring_wrap(grid, explain):
     this color can be eliminated.
     """
     for digit in ALLDIGITS:
-        clusters = make_clusters(grid, digit)
-        for cluster in clusters:
-            cluster_blue, cluster_green = colorize(digit, cluster)
+        for cluster in get_clusters(grid, digit):
+            if cluster.bluemask & cluster.bluepeers:
+                return apply_colorwrap(grid, 'Simple color wrap', explain, digit, cluster.blue, cluster.green, cluster.blue)
 
-            if color_contradiction(cluster_blue):
-                return apply_colorwrap(grid, 'Simple color wrap', explain, digit, cluster_blue, cluster_green, cluster_blue)
-
-            if color_contradiction(cluster_green):
-                return apply_colorwrap(grid, 'Simple color wrap', explain, digit, cluster_blue, cluster_green, cluster_green)
+            if cluster.greenmask & cluster.greenpeers:
+                return apply_colorwrap(grid, 'Simple color wrap', explain, digit, cluster.blue, cluster.green, cluster.green)
 
     return 0
 
@@ -1732,26 +2655,11 @@ def apply_colorwrap(grid, caption, explain, digit, cluster_blue, cluster_green,
 
 
 def explain_colorwrap(grid, caption, explain, digit, cluster_blue, cluster_green, remove_set, remove_dict):
-    print_single_history(grid)
-    print(describe_simple_coloring(caption, digit, cluster_blue, cluster_green, remove_dict))
-    grid.dump(((cluster_blue, [digit], CellDecor.COLOR1),
-                (cluster_green, [digit], CellDecor.COLOR2),
-                (remove_set, [digit], CellDecor.REMOVECAND)))
-
-
-def color_contradiction(same_color):
-    """all cells in same_color must have the same status; if two cells of the
-    same color are in the same unit, the associated candidate cannot be the
-    value.
-    """
-    rows = [0] * 9
-    cols = [0] * 9
-    boxs = [0] * 9
-    for cell in same_color:
-        rows[cell.rownum] += 1
-        cols[cell.colnum] += 1
-        boxs[cell.boxnum] += 1
-    return any(x > 1 for x in rows) or any(x > 1 for x in cols) or any(x > 1 for x in boxs)
+    text = describe_simple_coloring(caption, digit, cluster_blue, cluster_green, remove_dict)
+    decor = ((cluster_blue, [digit], CellDecor.COLOR1),
+              (cluster_green, [digit], CellDecor.COLOR2),
+              (remove_set, [digit], CellDecor.REMOVECAND))
+    explain_step(grid, caption, text, remove_dict, decor)
 
 
 # Multi coloring
@@ -1765,45 +2673,25 @@ def solve_multi_coloring_type_1(grid, explain, target=None):
         if target and int(target) != digit:
             continue
 
-        clusters = make_clusters(grid, digit)
-        clusters_data = []
-        to_be_removed = None
-
-        for cluster in clusters:
-            cluster_blue, cluster_green = colorize(digit, cluster)
-
-            peers_cluster_blue = multi_peers(digit, cluster_blue) #- cluster_blue
-            peers_cluster_green = multi_peers(digit, cluster_green) #- cluster_green
-            common = cellinter(peers_cluster_blue, peers_cluster_green)
+        for cluster1, cluster2 in itertools.combinations(get_clusters(grid, digit), 2):
+            remove_mask = 0
+            if cluster1.bluemask & cluster2.bluepeers:
+                remove_mask |= cluster1.greenpeers & cluster2.greenpeers
 
-            clusters_data.append((cluster, cluster_blue, cluster_green,
-                                  peers_cluster_blue, peers_cluster_green, common))
+            if cluster1.bluemask & cluster2.greenpeers:
+                remove_mask |= cluster1.greenpeers & cluster2.bluepeers
 
-        for clusters_data1, clusters_data2 in itertools.combinations(clusters_data, 2):
-            _, cluster_blue1, cluster_green1, peers_cluster_blue1, peers_cluster_green1, _ = clusters_data1
-            _, cluster_blue2, cluster_green2, peers_cluster_blue2, peers_cluster_green2, _ = clusters_data2
+            if cluster1.greenmask & cluster2.bluepeers:
+                remove_mask |= cluster1.bluepeers & cluster2.greenpeers
 
-            to_be_removed = []
-            if any(cell in peers_cluster_blue2 for cell in cluster_blue1):
-               to_be_removed.extend(cellinter(peers_cluster_green1, peers_cluster_green2))
+            if cluster1.greenmask & cluster2.greenpeers:
+                remove_mask |= cluster1.bluepeers & cluster2.bluepeers
 
-            if any(cell in peers_cluster_green2 for cell in cluster_blue1):
-               to_be_removed.extend(cellinter(peers_cluster_green1, peers_cluster_blue2))
-
-            if any(cell in peers_cluster_blue2 for cell in cluster_green1):
-               to_be_removed.extend(cellinter(peers_cluster_blue1, peers_cluster_green2))
-
-            if any(cell in peers_cluster_green2 for cell in cluster_green1):
-               to_be_removed.extend(cellinter(peers_cluster_blue1, peers_cluster_blue2))
-
-            if to_be_removed:
-                break
-
-        if to_be_removed:
-            return apply_multicolor(grid, 'Multi color type 1', explain, digit,
-                            cluster_blue1, cluster_green1,
-                            cluster_blue2, cluster_green2,
-                            to_be_removed)
+            if remove_mask:
+                return apply_multicolor(grid, 'Multi color type 1', explain, digit,
+                                cluster1.blue, cluster1.green,
+                                cluster2.blue, cluster2.green,
+                                mask_cells(grid, remove_mask))
 
     return 0
 
@@ -1816,47 +2704,25 @@ def solve_multi_coloring_type_2(grid, explain, target=None):
         if target and int(target) != digit:
             continue
 
-        clusters = make_clusters(grid, digit)
-        clusters_data = []
-        to_be_removed = None
-        for cluster in clusters:
-            cluster_blue, cluster_green = colorize(digit, cluster)
-
-            peers_cluster_blue = multi_peers(digit, cluster_blue) #- cluster_blue
-            peers_cluster_green = multi_peers(digit, cluster_green) #- cluster_green
-            common = cellinter(peers_cluster_blue, peers_cluster_green)
+        for cluster1, cluster2 in itertools.combinations(get_clusters(grid, digit), 2):
+            if cluster1.bluemask & cluster2.bluepeers and cluster1.bluemask & cluster2.greenpeers:
+                to_be_removed = cluster1.blue
 
-            clusters_data.append((cluster, cluster_blue, cluster_green,
-                                  peers_cluster_blue, peers_cluster_green, common))
+            elif cluster1.greenmask & cluster2.bluepeers and cluster1.greenmask & cluster2.greenpeers:
+                to_be_removed = cluster1.green
 
-        for clusters_data1, clusters_data2 in itertools.combinations(clusters_data, 2):
-            _, cluster_blue1, cluster_green1, peers_cluster_blue1, peers_cluster_green1, _ = clusters_data1
-            _, cluster_blue2, cluster_green2, peers_cluster_blue2, peers_cluster_green2, _ = clusters_data2
+            elif cluster2.bluemask & cluster1.bluepeers and cluster2.bluemask & cluster1.greenpeers:
+                to_be_removed = cluster2.blue
 
-            if (any(cell in peers_cluster_blue2 for cell in cluster_blue1) and
-                any(cell in peers_cluster_green2 for cell in cluster_blue1)):
-                to_be_removed = cluster_blue1
-                break
+            elif cluster2.greenmask & cluster1.bluepeers and cluster2.greenmask & cluster1.greenpeers:
+                to_be_removed = cluster2.green
 
-            if (any(cell in peers_cluster_blue2 for cell in cluster_green1) and
-                any(cell in peers_cluster_green2 for cell in cluster_green1)):
-                to_be_removed = cluster_green1
-                break
-
-            if (any(cell in peers_cluster_blue1 for cell in cluster_blue2) and
-                any(cell in peers_cluster_green1 for cell in cluster_blue2)):
-                to_be_removed = cluster_blue2
-                break
-
-            if (any(cell in peers_cluster_blue1 for cell in cluster_green2) and
-                any(cell in peers_cluster_green1 for cell in cluster_green2)):
-                to_be_removed = cluster_green2
-                break
+            else:
+                continue
 
-        if to_be_removed:
             return apply_multicolor(grid, 'Multi color type 2', explain, digit,
-                            cluster_blue1, cluster_green1,
-                            cluster_blue2, cluster_green2,
+                            cluster1.blue, cluster1.green,
+                            cluster2.blue, cluster2.green,
                             to_be_removed)
 
     return 0
@@ -1879,15 +2745,15 @@ def explain_multicolor(grid, caption, digit,
                      cluster_blue1, cluster_green1,
                      cluster_blue2, cluster_green2,
                      cells_to_discard, remove_dict):
-    print_single_history(grid)
-    print(describe_multi_coloring(caption, digit,
+    text = describe_multi_coloring(caption, digit,
                 cluster_blue1, cluster_green1,
-                cluster_blue2, cluster_green2, remove_dict))
-    grid.dump(((cluster_blue1, [digit], CellDecor.COLOR1),
-               (cluster_green1, [digit], CellDecor.COLOR2),
-               (cluster_blue2, [digit], CellDecor.COLOR3),
-               (cluster_green2, [digit], CellDecor.COLOR4),
-               (cells_to_discard, [digit], CellDecor.REMOVECAND)))
+                cluster_blue2, cluster_green2, remove_dict)
+    decor = ((cluster_blue1, [digit], CellDecor.COLOR1),
+             (cluster_green1, [digit], CellDecor.COLOR2),
+             (cluster_blue2, [digit], CellDecor.COLOR3),
+             (cluster_green2, [digit], CellDecor.COLOR4),
+             (cells_to_discard, [digit], CellDecor.REMOVECAND))
+    explain_step(grid, caption, text, remove_dict, decor)
 
 
 def describe_multi_coloring(caption, digit,
@@ -1906,67 +2772,95 @@ def describe_multi_coloring(caption, digit,
 
 # Clusters
 
+# A cluster of a digit is a set of cells connected by strong links (conjugate
+# pairs in a unit), colored with two colors alternating along the links. The
+# clusters are built with a union-find on cell numbers keeping the parity of
+# each cell relative to the root of its cluster. They are kept by digit in the
+# cluster index of the grid until the candidates of the digit change. Colors
+# are stored as 81 bit masks with the mask of the cells with the digit seeing
+# them, so that tests between colors are made of a few bitwise operations.
 
-def make_clusters(grid, digit):
-    clusters = []
-    for cell in grid.cells:
-        check_cluster(grid, clusters, cell, digit)
-    return clusters
 
+class Cluster:
+    """Colored cluster of a digit: for each color, the set of cells, the mask
+    of cells and the mask of cells with the digit seeing a cell of the color.
+    """
+    __slots__ = ('blue', 'green', 'bluemask', 'greenmask', 'bluepeers', 'greenpeers')
 
-def check_cluster(grid, clusters, cell, digit):
-    if digit not in cell.candidates:
-        pass
-    elif is_cell_in_clusters(cell, clusters):
-        pass
-    else:
-        new_cluster = set()
-        new_cluster.add(cell)
-        clusters.append(new_cluster)
-        conjs = cell.conjugates(digit)
-        for conj in conjs:
-            check_cluster_conj(grid, new_cluster, conj, digit)
-
-
-def is_cell_in_clusters(cell, clusters):
-    return clusters and any(cell in cluster for cluster in clusters)
-
-
-def check_cluster_conj(grid, cluster, conj, digit):
-    if conj in cluster:
-        pass
-    else:
-        cluster.add(conj)
-        conjs = conj.conjugates(digit)
-        for conj in conjs:
-            check_cluster_conj(grid, cluster, conj, digit)
-
+    def __init__(self, grid, bluemask, greenmask, positions):
+        self.blue = set(mask_cells(grid, bluemask))
+        self.green = set(mask_cells(grid, greenmask))
+        self.bluemask = bluemask
+        self.greenmask = greenmask
+        self.bluepeers = seen_by_any(bluemask) & positions
+        self.greenpeers = seen_by_any(greenmask) & positions
 
-def colorize(digit, cluster):
 
-    def colorize_cell(cell, colorset, conjcolorset):
-        if cell not in colorset and cell not in conjcolorset:
-            colorset.add(cell)
-            for conj in cell.conjugates(digit):
-                colorize_cell(conj, conjcolorset, colorset)
+class ClusterIndex:
+    """Colored clusters by digit, computed again only for digits whose
+    positions have changed.
+    """
+    def __init__(self):
+        self.positions = [None] * 10
+        self.clusters = [None] * 10
 
-    cluster_blue, cluster_green = set(), set()
-    first_cell = list(cluster)[0]
-    colorize_cell(first_cell, cluster_blue, cluster_green)
+    def refresh(self, grid, digit):
+        positions = digit_positions(grid, digit)
+        if positions != self.positions[digit]:
+            self.positions[digit] = positions
+            self.clusters[digit] = make_clusters(grid, positions)
+        return self.clusters[digit]
 
-    if not cluster_blue or not cluster_green:
-        return cluster_blue, cluster_green
-    elif min(cluster_blue) < min(cluster_green):
-        return cluster_blue, cluster_green
-    else:
-        return cluster_green, cluster_blue
 
+def get_clusters(grid, digit):
+    """return the clusters of digit as a list of Cluster, blue being the color
+    of the first cell of the cluster. Clusters are in the order of their first
+    cell. They are shared and must not be modified.
+    """
+    if grid.cluster_index is None:
+        grid.cluster_index = ClusterIndex()
+    return grid.cluster_index.refresh(grid, digit)
+
+
+def make_clusters(grid, positions):
+    parent = {cellnum: cellnum for cellnum in mask_cells_nums(positions)}
+    parity = dict.fromkeys(parent, 0)
+
+    def find(cellnum):
+        path = []
+        while parent[cellnum] != cellnum:
+            path.append(cellnum)
+            cellnum = parent[cellnum]
+        # path compression, parities become relative to the root
+        root_parity = 0
+        for node in reversed(path):
+            root_parity ^= parity[node]
+            parity[node] = root_parity
+            parent[node] = cellnum
+        return cellnum
+
+    for unitmask in UNITS_MASK:
+        mask = positions & unitmask
+        if popcount(mask) == 2:
+            cellnum1, cellnum2 = mask_cells_nums(mask)
+            root1 = find(cellnum1)
+            root2 = find(cellnum2)
+            if root1 != root2:
+                parent[root2] = root1
+                parity[root2] = parity[cellnum1] ^ parity[cellnum2] ^ 1
+
+    # root -> [parity of first cell, blue mask, green mask]
+    colors = {}
+    for cellnum in parent:
+        root = find(cellnum)
+        if root not in colors:
+            colors[root] = [parity[cellnum], 0, 0]
+        if parity[cellnum] == colors[root][0]:
+            colors[root][1] |= 1 << cellnum
+        else:
+            colors[root][2] |= 1 << cellnum
 
-def multi_peers(digit, cluster):
-    digit_peers = set()
-    for cell in cluster:
-        digit_peers = cellunion(digit_peers, set(c for c in cell.peers if digit in c.candidates))
-    return digit_peers
+    return [Cluster(grid, bluemask, greenmask, positions) for _, bluemask, greenmask in colors.values()]
 
 
 # x-chains
@@ -2011,6 +2905,7 @@ def x_links(grid, digit):
     """
     cells = [cell for cell in grid.cells if digit in cell.candidates]
     cells = sorted(cells)
+    positions = cells_mask(cells)
     weak_links = []
     strong_links = []
 
@@ -2018,14 +2913,11 @@ def x_links(grid, digit):
         for cell2 in cells:
             if cell1 == cell2:
                 pass
-            elif cell1 not in cell2.peers:
+            elif not SEES[cell1.cellnum][cell2.cellnum]:
                 pass
             else:
                 weak_links.append([cell1, cell2])
-                peers1 = [cell for cell in cell1.peers if digit in cell.candidates]
-                peers2 = [cell for cell in cell2.peers if digit in cell.candidates]
-                peers = cellinter(peers1, peers2)
-                if len(peers) == 0:
+                if not COMMON_PEERS[cell1.cellnum][cell2.cellnum] & positions:
                     strong_links.append((cell1, cell2))
 
     return cells, weak_links, strong_links
@@ -2065,7 +2957,7 @@ def test_new_xchain(grid, digit, adjacency, chain1, chain2, strong_links, techni
 
 
 def test_x_remove(grid, digit, chain):
-    to_be_removed = cellinter(chain[0].peers, chain[-1].peers)
+    to_be_removed = common_peers(grid, chain[0], chain[-1])
     to_be_removed = [cell for cell in to_be_removed if digit in cell.candidates]
     #to_be_removed = [cell for cell in to_be_removed if cell not in chain]
     return to_be_removed
@@ -2080,14 +2972,13 @@ def apply_x_chain(grid, digit, technique, explain, chain, cells_to_discard):
 
 
 def explain_x_chain(grid, caption, digit, technique, chain, cells_to_discard, remove_dict):
-    print_single_history(grid)
-    print(describe_x_chain(caption[technique], digit, chain, remove_dict))
+    text = describe_x_chain(caption[technique], digit, chain, remove_dict)
     L = []
     for cell1, cell2 in zip(chain[::2], chain[1::2]):
         L.extend((([cell1], [digit], CellDecor.COLOR1),
                     ([cell2], [digit], CellDecor.COLOR2)))
     L.append((cells_to_discard, [digit], CellDecor.REMOVECAND))
-    grid.dump(L)
+    explain_step(grid, caption[technique], text, remove_dict, L)
 
 
 def describe_x_chain(caption, digit, chain, remove_cells):
@@ -2206,12 +3097,11 @@ def apply_empty_rectangle(grid, digit, caption, explain, link, box, cell_to_disc
 
 
 def explain_empty_rectangle(grid, digit, caption, link, box, cell_to_discard, remove_dict):
-    print_single_history(grid)
-    print(describe_empty_rectangle(caption, digit, link, box, remove_dict))
+    text = describe_empty_rectangle(caption, digit, link, box, remove_dict)
     colors = [(link, [digit], CellDecor.COLOR1),
                 (box, [digit], CellDecor.COLOR2),
                 ([cell_to_discard], [digit], CellDecor.REMOVECAND)]
-    grid.dump(colors)
+    explain_step(grid, caption, text, remove_dict, colors)
 
 
 def describe_empty_rectangle(caption, digit, link, box, remove_dict):
@@ -2227,7 +3117,7 @@ def solve_XY_wing(grid, explain, target=None):
         if cell.is_pair():
             pairpeers = (peer for peer in cell.peers if peer.is_pair())
             for wing1, wing2 in itertools.combinations(pairpeers, 2):
-                if wing1 in wing2.peers:
+                if SEES[wing1.cellnum][wing2.cellnum]:
                     # cell, wing1, wing2 in the same house: not a xy-wing
                     continue
                 wings_inter = wing1.candidates.intersection(wing2.candidates)
@@ -2237,7 +3127,7 @@ def solve_XY_wing(grid, explain, target=None):
                 if (cand1 in wing1.candidates and cand2 in wing2.candidates or
                     cand1 in wing2.candidates and cand2 in wing1.candidates):
                     digit = min(wings_inter)
-                    remove_set = cellinter(wing1.peers, wing2.peers)
+                    remove_set = common_peers(grid, wing1, wing2)
                     nb_removed = apply_xy_wing(grid, 'XY-wing', explain, [cand1, cand2, digit], [cell, wing1, wing2], remove_set)
                     if nb_removed:
                         if target is None or target == '%d%d%d' % tuple(sorted([cand1, cand2, digit])):
@@ -2258,11 +3148,11 @@ def apply_xy_wing(grid, caption, explain, candidates, define_set, remove_set):
 def explain_xy_wing(grid, caption, candidates, define_set, remove_dict):
     cand1, cand2, digit = candidates
     cell, wing1, wing2 = define_set
-    print_single_history(grid)
-    print(describe_xy_wing(caption, candidates, define_set, remove_dict))
-    grid.dump(((define_set, cell.candidates, CellDecor.COLOR1),
-               ((wing1, wing2), ALLCAND - cell.candidates, CellDecor.COLOR2),
-               (remove_dict[digit], [digit], CellDecor.REMOVECAND)))
+    text = describe_xy_wing(caption, candidates, define_set, remove_dict)
+    decor = ((define_set, cell.candidates, CellDecor.COLOR1),
+             ((wing1, wing2), ALLCAND - cell.candidates, CellDecor.COLOR2),
+             (remove_dict[digit], [digit], CellDecor.REMOVECAND))
+    explain_step(grid, caption, text, remove_dict, decor)
 
 
 def describe_xy_wing(caption, digits, cells, remove_dict):
@@ -2288,7 +3178,7 @@ def solve_XYZ_wing(grid, explain, target=None):
                     if target and target != wings_union:
                         continue
                     digit = min(wings_inter)
-                    remove_set = cellinterx(wing1.peers, wing2.peers, cell.peers)
+                    remove_set = mask_cells(grid, COMMON_PEERS[wing1.cellnum][wing2.cellnum] & PEERS_MASK[cell.cellnum])
                     nb_removed = apply_xyz_wing(grid, 'XYZ-wing', explain, digit, [cell, wing1, wing2], remove_set)
                     if nb_removed:
                         return nb_removed
@@ -2306,18 +3196,21 @@ def apply_xyz_wing(grid, caption, explain, digit, define_set, remove_set):
 
 def explain_xyz_wing(grid, caption, digit, define_set, remove_dict):
     cell, _, _ = define_set
-    print_single_history(grid)
-    print(describe_xy_wing(caption, [digit], define_set, remove_dict))
-    grid.dump(((define_set, cell.candidates, CellDecor.COLOR1),
-               (define_set, [digit], CellDecor.COLOR2),
-               (remove_dict[digit], [digit], CellDecor.REMOVECAND)))
+    text = describe_xy_wing(caption, [digit], define_set, remove_dict)
+    decor = ((define_set, cell.candidates, CellDecor.COLOR1),
+             (define_set, [digit], CellDecor.COLOR2),
+             (remove_dict[digit], [digit], CellDecor.REMOVECAND))
+    explain_step(grid, caption, text, remove_dict, decor)
 
 
 # xy-chains
 
 
-def solve_XY_chain(grid, explain, target=None, remote_pair=False):
-    all_solutions = False
+def solve_XY_chain(grid, explain, target=None, remote_pair=False, all_solutions=False):
+    """with all_solutions, the chains with eliminations found in the step of the
+    transitive closure giving the first one are all applied, instead of the
+    first chain only.
+    """
     pairs, links = xy_links(grid, remote_pair)
 
     caption = 'Remote pair' if remote_pair else 'XY-chain'
@@ -2331,32 +3224,35 @@ def solve_XY_chain(grid, explain, target=None, remote_pair=False):
         adjacency[pairs.index(pair1)][pairs.index(pair2)].append(link)
 
     # transitive closure
+    found = []
     for k in range(len(pairs)):
         for i in range(len(pairs)):
             for j in range(len(pairs)):
                 for adjacency1 in adjacency[i][k]:
                     for adjacency2 in adjacency[k][j]:
                         cells_to_discard = test_new_chain(grid, adjacency[i][j],
-                                                          adjacency1, adjacency2, all_solutions, remote_pair)
+                                                          adjacency1, adjacency2, remote_pair)
                         if cells_to_discard:
                             _, candchain = adjacency[i][j][-1]
                             candset = candchain[:2] if remote_pair else candchain[:1]
                             if target is None or ''.join(str(_) for _ in sorted(candset)) == target:
-                                return apply_xy_chain(grid, caption, explain, adjacency[i][j][-1], cells_to_discard, remote_pair)
-
-    if all_solutions:  # not used
-        for i in range(len(pairs)):
-            for j in range(len(pairs)):
-                for chain in adjacency[i][j]:
-                    cells_to_discard = test_xy_remove(grid, *chain)
-                    if cells_to_discard:
-                        return apply_xy_chain(grid, caption, explain, chain, cells_to_discard, remote_pair)
+                                if not all_solutions:
+                                    return apply_xy_chain(grid, caption, explain, adjacency[i][j][-1], cells_to_discard, remote_pair)
+                                found.append(adjacency[i][j][-1])
+        if found:
+            break
 
-    return 0
+    total = 0
+    for chain in found:
+        # eliminations still to be done after applying the previous chains
+        cells_to_discard = test_chain_remove(grid, chain, remote_pair)
+        if cells_to_discard:
+            total += apply_xy_chain(grid, caption, explain, chain, cells_to_discard, remote_pair)
+    return total
 
 
-def solve_remote_pair(grid, explain):
-    return solve_XY_chain(grid, explain, remote_pair=True)
+def solve_remote_pair(grid, explain, all_solutions=False):
+    return solve_XY_chain(grid, explain, remote_pair=True, all_solutions=all_solutions)
 
 
 def apply_xy_chain(grid, caption, explain, link, cells_to_discard, remote_pair):
@@ -2380,7 +3276,7 @@ def xy_links(grid, remote_pair):
         for pair2 in pairs:
             if pair1 == pair2:
                 pass
-            elif pair1 not in pair2.peers:
+            elif not SEES[pair1.cellnum][pair2.cellnum]:
                 pass
             elif pair1.candidates == pair2.candidates:
                 # remote pair
@@ -2401,7 +3297,7 @@ def xy_links(grid, remote_pair):
     return pairs, links
 
 
-def test_new_chain(grid, adjacency, adjacency1, adjacency2, all_solutions, remote_pair):
+def test_new_chain(grid, adjacency, adjacency1, adjacency2, remote_pair):
     cellchain1, candchain1 = adjacency1
     cellchain2, candchain2 = adjacency2
     if candchain1[-2:] != candchain2[:2]:
@@ -2430,9 +3326,12 @@ def test_new_chain(grid, adjacency, adjacency1, adjacency2, all_solutions, remot
     #     for index, x in enumerate(adjacency):
     #         print(index, x)
 
-    if all_solutions:
-        return False
-    elif remote_pair:
+    return test_chain_remove(grid, [cellchain, candchain], remote_pair)
+
+
+def test_chain_remove(grid, chain, remote_pair):
+    cellchain, candchain = chain
+    if remote_pair:
         return test_remote_pair_remove(grid, cellchain)
     else:
         return test_xy_remove(grid, cellchain, candchain)
@@ -2441,7 +3340,7 @@ def test_new_chain(grid, adjacency, adjacency1, adjacency2, all_solutions, remot
 def test_xy_remove(grid, cellchain, candchain):
     if candchain[0] == candchain[-1]:
         digit = candchain[0]
-        to_be_removed = cellinter(cellchain[0].peers, cellchain[-1].peers)
+        to_be_removed = common_peers(grid, cellchain[0], cellchain[-1])
         to_be_removed = [cell for cell in to_be_removed if digit in cell.candidates]
         to_be_removed = [cell for cell in to_be_removed if cell not in cellchain]
         return to_be_removed
@@ -2451,7 +3350,7 @@ def test_xy_remove(grid, cellchain, candchain):
 def test_remote_pair_remove(grid, cellchain):
     if len(cellchain) % 2 == 0:
         digits = cellchain[0].candidates
-        to_be_removed = cellinter(cellchain[0].peers, cellchain[-1].peers)
+        to_be_removed = common_peers(grid, cellchain[0], cellchain[-1])
         to_be_removed = [cell for cell in to_be_removed if digits.intersection(cell.candidates)]
         to_be_removed = [cell for cell in to_be_removed if cell not in cellchain]
         return to_be_removed
@@ -2461,13 +3360,12 @@ def test_remote_pair_remove(grid, cellchain):
 def explain_xy_chain(grid, caption, link, cells_to_discard, remote_pair, remove_dict):
     cellchain, candchain = link
     candset = candchain[:2] if remote_pair else candchain[:1]
-    print_single_history(grid)
-    print(describe_xy_chain(caption, candset, cellchain, candchain, remove_dict))
+    text = describe_xy_chain(caption, candset, cellchain, candchain, remove_dict)
     L = []
     for cell, cand1, cand2 in zip(cellchain, candchain[:-1], candchain[1:]):
         L.append(([cell], [cand1], CellDecor.COLOR1, [cand2], CellDecor.COLOR2))
     L.append((cells_to_discard, candset, CellDecor.REMOVECAND))
-    grid.dump(L)
+    explain_step(grid, caption, text, remove_dict, L)
 
 
 def describe_xy_chain(caption, candset, cellchain, candchain, remove_cells):
@@ -2495,7 +3393,7 @@ def solve_w_wing(grid, explain, target=None):
         if target and target != candidates:
             continue
         for wing1, wing2 in itertools.combinations(sorted(cells), 2):
-            if wing1.rownum == wing2.rownum or wing1.colnum == wing2.colnum:
+            if SHARED_UNITS[wing1.cellnum][wing2.cellnum] & (SAME_ROW | SAME_COL):
                 continue
             for candidate in sorted(candidates):
                 peers1 = wing1.same_digit_peers(candidate)
@@ -2505,7 +3403,7 @@ def solve_w_wing(grid, explain, target=None):
                     if inter:
                         nb_removed = apply_w_wing(grid, 'W-wing',
                             explain, candidates - {candidate}, [wing1, wing2, peer, inter[0]],
-                            cellinter(wing1.peers, wing2.peers))
+                            common_peers(grid, wing1, wing2))
                         if nb_removed:
                             return nb_removed
     return 0
@@ -2521,12 +3419,12 @@ def apply_w_wing(grid, caption, explain, candidates, define_set, remove_set):
 
 
 def explain_w_wing(grid, caption, candidates, define_set, remove_set, remove_cells):
-    print_single_history(grid)
-    print(describe_w_wing(caption, candidates, define_set, remove_cells))
+    text = describe_w_wing(caption, candidates, define_set, remove_cells)
     wing1, wing2, _, _ = define_set
-    grid.dump(((define_set, wing1.candidates - candidates, CellDecor.COLOR2),
-               ({wing1, wing2}, candidates, CellDecor.COLOR1),
-               (remove_set, candidates, CellDecor.REMOVECAND),))
+    decor = ((define_set, wing1.candidates - candidates, CellDecor.COLOR2),
+             ({wing1, wing2}, candidates, CellDecor.COLOR1),
+             (remove_set, candidates, CellDecor.REMOVECAND),)
+    explain_step(grid, caption, text, remove_cells, decor)
 
 
 def describe_w_wing(caption, defcands, defset, remset):
@@ -2608,9 +3506,9 @@ def apply_bug1(grid, caption, explain, candidates, define_set, remove_set):
 
 
 def explain_bug1(grid, caption, candidates, define_set, remove_set, remove_dict):
-    print_single_history(grid)
-    print(describe_bug1(caption, candidates, define_set, remove_dict))
-    grid.dump(((remove_set, candidates, CellDecor.REMOVECAND),))
+    text = describe_bug1(caption, candidates, define_set, remove_dict)
+    decor = ((remove_set, candidates, CellDecor.REMOVECAND),)
+    explain_step(grid, caption, text, remove_dict, decor)
 
 
 def describe_bug1(caption, candidates, define_set, remove_dict):
@@ -2620,26 +3518,154 @@ def describe_bug1(caption, candidates, define_set, remove_dict):
 # Unique rectangle
 
 
+# The rectangles which may form a deadly pattern are made of 4 cells in 2 rows,
+# 2 columns and 2 boxes. There are 486 of them, enumerated once at import and
+# indexed by side, by corner and by diagonal. The rectangle index of a grid
+# classifies them by the candidates common to the four corners, the number of
+# bivalue corners and the number of solved (non given) corners. The uniqueness
+# techniques filter the rectangles of the index instead of scanning the grid.
+
+
+def make_rectangles():
+    """return the rectangles as tuples of cell numbers (top left, top right,
+    bottom left, bottom right), with their indexes by side, corner and diagonal.
+    """
+    rectangles = []
+    for row1, row2 in itertools.combinations(range(9), 2):
+        for col1, col2 in itertools.combinations(range(9), 2):
+            if (row1 // 3 == row2 // 3) != (col1 // 3 == col2 // 3):
+                rectangles.append((row1 * 9 + col1, row1 * 9 + col2, row2 * 9 + col1, row2 * 9 + col2))
+
+    # sides[n1, n2]: (rectnum, n3, n4), n3 aligned with n1 and n4 with n2
+    # corners[n1]: (rectnum, n2, n3, n4), n2 in the row and n3 in the column of n1
+    # diagonals[n1, n2]: (rectnum, n3, n4), n3 in the row of n1 and n4 in the row of n2
+    sides = defaultdict(list)
+    corners = [[] for _ in range(81)]
+    diagonals = {}
+    by_cell = [[] for _ in range(81)]
+    for rectnum, (a, b, c, d) in enumerate(rectangles):
+        sides[a, b].append((rectnum, c, d))
+        sides[c, d].append((rectnum, a, b))
+        sides[a, c].append((rectnum, b, d))
+        sides[b, d].append((rectnum, a, c))
+        corners[a].append((rectnum, b, c, d))
+        corners[b].append((rectnum, a, d, c))
+        corners[c].append((rectnum, d, a, b))
+        corners[d].append((rectnum, c, b, a))
+        diagonals[a, d] = (rectnum, b, c)
+        diagonals[b, c] = (rectnum, a, d)
+        for cellnum in (a, b, c, d):
+            by_cell[cellnum].append(rectnum)
+
+    # same order as scanning the other line, and the row then the column of n1
+    for lst in sides.values():
+        lst.sort(key=lambda x: x[1])
+    for lst in corners:
+        lst.sort(key=lambda x: x[1:3])
+
+    return rectangles, dict(sides), corners, diagonals, by_cell
+
+
+RECTANGLES, RECTANGLE_SIDES, RECTANGLE_CORNERS, RECTANGLE_DIAGONALS, RECTANGLES_BY_CELL = make_rectangles()
+
+
+class RectangleIndex:
+    """Classification of the rectangles of a grid. The index is kept along the
+    resolution: when refreshing, only the rectangles with a changed cell are
+    classified again.
+    """
+    def __init__(self):
+        self.cells = None
+        self.signatures = [None] * 81
+        self.common = [0] * len(RECTANGLES)
+        self.bivalues = [0] * len(RECTANGLES)
+        self.solved = [0] * len(RECTANGLES)
+
+    def refresh(self, grid):
+        self.cells = grid.cells
+        changed = set()
+        for cell in grid.cells:
+            signature = (candidates_mask(cell.candidates), cell.value, cell.given)
+            if signature != self.signatures[cell.cellnum]:
+                self.signatures[cell.cellnum] = signature
+                changed.update(RECTANGLES_BY_CELL[cell.cellnum])
+        for rectnum in changed:
+            self.classify(rectnum)
+        return self
+
+    def classify(self, rectnum):
+        common = ALLMASK
+        bivalues = 0
+        solved = 0
+        for cellnum in RECTANGLES[rectnum]:
+            mask, value, given = self.signatures[cellnum]
+            common &= mask
+            if len(MASK_DIGITS[mask]) == 2:
+                bivalues += 1
+            if value and not given:
+                solved += 1
+        self.common[rectnum] = common
+        self.bivalues[rectnum] = bivalues
+        self.solved[rectnum] = solved
+
+    def match(self, rectnum, pairmask, bivalues, solved):
+        return (self.common[rectnum] & pairmask == pairmask and
+                self.bivalues[rectnum] >= bivalues and self.solved[rectnum] >= solved)
+
+    def sides(self, cell1, cell2, pairmask=0, bivalues=0, solved=0):
+        """return the rectangles with side cell1-cell2 as pairs (cell3, cell4),
+        cell3 aligned with cell1 and cell4 with cell2. pairmask: candidates
+        in all corners, bivalues, solved: minimum numbers of bivalue and
+        solved corners.
+        """
+        cells = self.cells
+        return [(cells[n3], cells[n4])
+                for rectnum, n3, n4 in RECTANGLE_SIDES.get((cell1.cellnum, cell2.cellnum), ())
+                if self.match(rectnum, pairmask, bivalues, solved)]
+
+    def corners(self, cell1, pairmask=0, bivalues=0, solved=0):
+        """return the rectangles with corner cell1 as tuples (cell2, cell3,
+        cell4), cell2 in the row and cell3 in the column of cell1.
+        """
+        cells = self.cells
+        return [(cells[n2], cells[n3], cells[n4])
+                for rectnum, n2, n3, n4 in RECTANGLE_CORNERS[cell1.cellnum]
+                if self.match(rectnum, pairmask, bivalues, solved)]
+
+    def diagonal(self, cell1, cell2, pairmask=0, bivalues=0, solved=0):
+        """return the rectangle with diagonal cell1-cell2 as a pair (cell3,
+        cell4), cell3 in the row of cell1 and cell4 in the row of cell2, or
+        None.
+        """
+        rect = RECTANGLE_DIAGONALS.get((cell1.cellnum, cell2.cellnum))
+        if rect is None or not self.match(rect[0], pairmask, bivalues, solved):
+            return None
+        return self.cells[rect[1]], self.cells[rect[2]]
+
+
+def get_rectangle_index(grid):
+    if grid.rect_index is None:
+        grid.rect_index = RectangleIndex()
+    return grid.rect_index.refresh(grid)
+
+
 def solve_uniqueness_test_1(grid, explain):
+    index = get_rectangle_index(grid)
     pairs = bivaluedict(grid)
 
     for candidates, cells in pairs.items():
+        pairmask = candidates_mask(candidates)
         for cell1, cell2 in itertools.combinations(sorted(cells), 2):
             if cell1.rownum == cell2.rownum:
-                for row in grid.rows:
-                    if row[0].rownum != cell1.rownum:
-                        cell3 = row[cell1.colnum]
-                        cell4 = row[cell2.colnum]
-                        if cell3 in cells:
-                            if candidates < cell4.candidates and len(cell4.candidates) > 2:
-                                if in_two_boxes(cell1, cell2, cell3):
-                                    return apply_uniqueness_test_1(grid, 'Uniqueness test 1', explain,
-                                        candidates, [cell1, cell2, cell3, cell4], [cell4])
-                        if cell4 in cells:
-                            if candidates < cell3.candidates and len(cell3.candidates) > 2:
-                                if in_two_boxes(cell1, cell2, cell3):
-                                    return apply_uniqueness_test_1(grid, 'Uniqueness test 1', explain,
-                                        candidates, [cell1, cell2, cell3, cell4], [cell3])
+                for cell3, cell4 in index.sides(cell1, cell2, pairmask, bivalues=3):
+                    if cell3 in cells:
+                        if candidates < cell4.candidates and len(cell4.candidates) > 2:
+                            return apply_uniqueness_test_1(grid, 'Uniqueness test 1', explain,
+                                candidates, [cell1, cell2, cell3, cell4], [cell4])
+                    if cell4 in cells:
+                        if candidates < cell3.candidates and len(cell3.candidates) > 2:
+                            return apply_uniqueness_test_1(grid, 'Uniqueness test 1', explain,
+                                candidates, [cell1, cell2, cell3, cell4], [cell3])
     return False
 
 
@@ -2653,45 +3679,28 @@ def apply_uniqueness_test_1(grid, caption, explain, candidates, define_set, remo
 
 
 def explain_uniqueness_test_1(grid, caption, candidates, define_set, remove_set, remove_dict):
-    print_single_history(grid)
-    print(describe_xy_wing(caption, sorted(candidates), define_set, remove_dict))
-    grid.dump(((define_set, candidates, CellDecor.DEFININGCAND),
-               (remove_set, candidates, CellDecor.REMOVECAND),))
+    text = describe_xy_wing(caption, sorted(candidates), define_set, remove_dict)
+    decor = ((define_set, candidates, CellDecor.DEFININGCAND),
+             (remove_set, candidates, CellDecor.REMOVECAND),)
+    explain_step(grid, caption, text, remove_dict, decor)
 
 
 def solve_uniqueness_test_2(grid, explain):
+    index = get_rectangle_index(grid)
     pairs = bivaluedict(grid)
 
     for candidates, cells in pairs.items():
+        pairmask = candidates_mask(candidates)
         for cell1, cell2 in itertools.combinations(sorted(cells), 2):
-            nb_removed = solve_uniqueness_test_2_on_unit(
-                grid, explain, candidates, cell1, cell2, grid.rows, Cell.mrownum, Cell.mcolnum
-            )
-            if nb_removed:
-                return nb_removed
-            nb_removed = solve_uniqueness_test_2_on_unit(
-                grid, explain, candidates, cell1, cell2, grid.cols, Cell.mcolnum, Cell.mrownum
-            )
-            if nb_removed:
-                return nb_removed
-    return 0
-
-
-def solve_uniqueness_test_2_on_unit(grid, explain, candidates, cell1, cell2, rows, rownum, colnum):
-    if rownum(cell1) == rownum(cell2):
-        for row in rows:
-            if rownum(row[0]) != rownum(cell1):
-                cell3 = row[colnum(cell1)]
-                cell4 = row[colnum(cell2)]
-                if in_two_boxes(cell1, cell2, cell3):
-                    if candidates < cell3.candidates and len(cell3.candidates) == 3 and cell3.candidates == cell4.candidates:
-                        extra = min(cell3.candidates - candidates)
-                        remove_set = cellinter(cell3.same_digit_peers(extra),
-                                               cell4.same_digit_peers(extra))
-                        nb_removed = apply_uniqueness_test_2(grid, 'Uniqueness test 2', explain,
-                            [candidates, [extra]], [cell1, cell2, cell3, cell4], remove_set)
-                        if nb_removed:
-                            return nb_removed
+            for cell3, cell4 in index.sides(cell1, cell2, pairmask):
+                if len(cell3.candidates) == 3 and cell3.candidates == cell4.candidates:
+                    extra = min(cell3.candidates - candidates)
+                    remove_set = cellinter(cell3.same_digit_peers(extra),
+                                           cell4.same_digit_peers(extra))
+                    nb_removed = apply_uniqueness_test_2(grid, 'Uniqueness test 2', explain,
+                        [candidates, [extra]], [cell1, cell2, cell3, cell4], remove_set)
+                    if nb_removed:
+                        return nb_removed
     return 0
 
 
@@ -2707,43 +3716,31 @@ def apply_uniqueness_test_2(grid, caption, explain, candidates, define_set, remo
 
 def explain_uniqueness_test_2(grid, caption, candidates, define_set, remove_set, remove_dict):
     defcand, extra = candidates
-    print_single_history(grid)
-    print(describe_xy_wing(caption, sorted(defcand), define_set, remove_dict))
-    grid.dump(((define_set, defcand, CellDecor.DEFININGCAND),
-               (remove_set, extra, CellDecor.REMOVECAND),))
+    text = describe_xy_wing(caption, sorted(defcand), define_set, remove_dict)
+    decor = ((define_set, defcand, CellDecor.DEFININGCAND),
+             (remove_set, extra, CellDecor.REMOVECAND),)
+    explain_step(grid, caption, text, remove_dict, decor)
 
 
 def solve_uniqueness_test_3(grid, explain):
+    index = get_rectangle_index(grid)
     pairs = bivaluedict(grid)
     for candidates, cells in pairs.items():
+        pairmask = candidates_mask(candidates)
         for cell1, cell2 in itertools.combinations(sorted(cells), 2):
-            nb_removed = solve_uniqueness_test_3_on_unit(grid, explain, candidates, cell1, cell2, grid.rows, Cell.mrownum, Cell.mcolnum)
-            if nb_removed:
-                return nb_removed
-            nb_removed = solve_uniqueness_test_3_on_unit(grid, explain, candidates, cell1, cell2, grid.cols, Cell.mcolnum, Cell.mrownum)
-            if nb_removed:
-                return nb_removed
-    return 0
-
-
-def solve_uniqueness_test_3_on_unit(grid, explain, candidates, cell1, cell2, rows, rownum, colnum):
-    if rownum(cell1) == rownum(cell2):
-        for row in rows:
-            if rownum(row[0]) != rownum(cell1):
-                cell3 = row[colnum(cell1)]
-                cell4 = row[colnum(cell2)]
-                if in_two_boxes(cell1, cell2, cell3):
-                    if candidates < cell3.candidates and candidates < cell4.candidates:
-                        nb_removed = solve_uniqueness_test_3_on_unit_target(grid, explain, candidates, cell1, cell2, cell3, cell4, rows, row)
-                        if nb_removed:
-                            return nb_removed
-                        nb_removed = solve_uniqueness_test_3_on_unit_target(grid, explain, candidates, cell1, cell2, cell3, cell4, rows, cell3.box)
-                        if nb_removed:
-                            return nb_removed
+            for cell3, cell4 in index.sides(cell1, cell2, pairmask):
+                if candidates < cell3.candidates and candidates < cell4.candidates:
+                    unit = cell3.row if cell3.rownum == cell4.rownum else cell3.col
+                    nb_removed = solve_uniqueness_test_3_on_unit_target(grid, explain, candidates, cell1, cell2, cell3, cell4, unit)
+                    if nb_removed:
+                        return nb_removed
+                    nb_removed = solve_uniqueness_test_3_on_unit_target(grid, explain, candidates, cell1, cell2, cell3, cell4, cell3.box)
+                    if nb_removed:
+                        return nb_removed
     return 0
 
 
-def solve_uniqueness_test_3_on_unit_target(grid, explain, candidates, cell1, cell2, cell3, cell4, rows, target):
+def solve_uniqueness_test_3_on_unit_target(grid, explain, candidates, cell1, cell2, cell3, cell4, target):
     # will search for subset in target
     subcells = {cell for cell in target if len(cell.candidates) > 1 and len(cell.candidates.intersection(candidates)) == 0}
     # the additional candidates in rectangle
@@ -2804,132 +3801,104 @@ def apply_naked_set_u3(grid, caption, explain, defcand, setcand, defset, subset)
 
 def explain_uniqueness_test_3(grid, caption, candidates, define_set, subset, remove_set, remove_dict):
     defcand, extra = candidates
-    print_single_history(grid)
-    print(describe_xy_wing(caption, sorted(defcand), define_set, remove_dict))
-    grid.dump(((define_set, defcand, CellDecor.DEFININGCAND),
-               (define_set + list(subset), extra, CellDecor.COLOR3),
-               (remove_set, extra, CellDecor.REMOVECAND),))
+    text = describe_xy_wing(caption, sorted(defcand), define_set, remove_dict)
+    decor = ((define_set, defcand, CellDecor.DEFININGCAND),
+             (define_set + list(subset), extra, CellDecor.COLOR3),
+             (remove_set, extra, CellDecor.REMOVECAND),)
+    explain_step(grid, caption, text, remove_dict, decor)
 
 
 def solve_uniqueness_test_4(grid, explain):
+    index = get_rectangle_index(grid)
     pairs = bivaluedict(grid)
     for candidates, cells in pairs.items():
+        pairmask = candidates_mask(candidates)
         for cell1, cell2 in itertools.combinations(sorted(cells), 2):
-            nb_removed = solve_uniqueness_test_4_on_unit(grid, explain, candidates, cell1, cell2, grid.rows, Cell.mrownum, Cell.mcolnum)
-            if nb_removed:
-                return nb_removed
-            nb_removed = solve_uniqueness_test_4_on_unit(grid, explain, candidates, cell1, cell2, grid.cols, Cell.mcolnum, Cell.mrownum)
-            if nb_removed:
-                return nb_removed
-    return 0
-
-
-def solve_uniqueness_test_4_on_unit(grid, explain, candidates, cell1, cell2, rows, rownum, colnum):
-    if rownum(cell1) == rownum(cell2):
-        for row in rows:
-            if rownum(row[0]) != rownum(cell1):
-                cell3 = row[colnum(cell1)]
-                cell4 = row[colnum(cell2)]
-                if in_two_boxes(cell1, cell2, cell3):
-                    if candidates < cell3.candidates and candidates < cell4.candidates:
-                        for candidate in list(candidates):
-                            peers = cellinter(cell3.same_digit_peers(candidate),
-                                              cell4.same_digit_peers(candidate))
-                            if not peers:
-                                extra = list(candidates - {candidate})[0]
-                                nb_removed = apply_uniqueness_test_2(grid, 'Uniqueness test 4', explain,
-                                            [candidates, [extra]], [cell1, cell2, cell3, cell4], [cell3, cell4])
-                                if nb_removed:
-                                    return nb_removed
+            for cell3, cell4 in index.sides(cell1, cell2, pairmask):
+                if candidates < cell3.candidates and candidates < cell4.candidates:
+                    for candidate in list(candidates):
+                        peers = cellinter(cell3.same_digit_peers(candidate),
+                                          cell4.same_digit_peers(candidate))
+                        if not peers:
+                            extra = list(candidates - {candidate})[0]
+                            nb_removed = apply_uniqueness_test_2(grid, 'Uniqueness test 4', explain,
+                                        [candidates, [extra]], [cell1, cell2, cell3, cell4], [cell3, cell4])
+                            if nb_removed:
+                                return nb_removed
     return 0
 
 
 def solve_uniqueness_test_5(grid, explain):
+    index = get_rectangle_index(grid)
     pairs = bivaluedict(grid)
     for candidates, cells in pairs.items():
+        pairmask = candidates_mask(candidates)
         for cell1 in sorted(cells):
-            cell2s = [cell for cell in cell1.row
-                if candidates < cell.candidates and len(cell.candidates) == 3]
-            cell3s = [cell for cell in cell1.col
-                if candidates < cell.candidates and len(cell.candidates) == 3]
-            for cell2, cell3 in itertools.product(cell2s, cell3s):
-                if cell2.candidates == cell3.candidates:
-                    cell4 = cell3.row[cell2.colnum]
-                    if in_two_boxes(cell1, cell2, cell3):
-                        if cell4.candidates == candidates or cell4.candidates == cell2.candidates:
-                            extracand = list(cell2.candidates - candidates)[0]
-                            remove_set = cellinterx(cell2.same_digit_peers(extracand),
-                                                    cell3.same_digit_peers(extracand),
-                                                    cell4.same_digit_peers(extracand))
-                            nb_removed = apply_uniqueness_test_2(grid, 'Uniqueness test 5', explain,
-                                        [candidates, [extracand]], [cell1, cell2, cell3, cell4], remove_set)
-                            if nb_removed:
-                                return nb_removed
+            for cell2, cell3, cell4 in index.corners(cell1, pairmask):
+                if len(cell2.candidates) == 3 and cell2.candidates == cell3.candidates:
+                    if cell4.candidates == candidates or cell4.candidates == cell2.candidates:
+                        extracand = list(cell2.candidates - candidates)[0]
+                        remove_set = cellinterx(cell2.same_digit_peers(extracand),
+                                                cell3.same_digit_peers(extracand),
+                                                cell4.same_digit_peers(extracand))
+                        nb_removed = apply_uniqueness_test_2(grid, 'Uniqueness test 5', explain,
+                                    [candidates, [extracand]], [cell1, cell2, cell3, cell4], remove_set)
+                        if nb_removed:
+                            return nb_removed
     return 0
 
 
 def solve_uniqueness_test_6(grid, explain):
+    index = get_rectangle_index(grid)
     pairs = bivaluedict(grid)
     for candidates, cells in pairs.items():
+        pairmask = candidates_mask(candidates)
         for cell1, cell2 in itertools.combinations(sorted(cells), 2):
-            if cell1.rownum != cell2.rownum and cell1.colnum != cell2.colnum:
-                cell3 = cell1.row[cell2.colnum]
-                cell4 = cell2.row[cell1.colnum]
-                if in_two_boxes(cell1, cell2, cell3):
-                    if cell3.candidates > candidates and cell4.candidates > candidates:
-                        for candidate in list(candidates):
-                            if (len(cell1.same_digit_in_row(candidate)) == 2 and
-                                len(cell2.same_digit_in_row(candidate)) == 2 and
-                                len(cell1.same_digit_in_col(candidate)) == 2 and
-                                len(cell2.same_digit_in_col(candidate)) == 2):
-                                nb_removed = apply_uniqueness_test_2(grid, 'Uniqueness test 6', explain,
-                                            [candidates, [candidate]], [cell1, cell2, cell3, cell4], [cell3, cell4])
-                                if nb_removed:
-                                    return nb_removed
+            if rectangle := index.diagonal(cell1, cell2, pairmask):
+                cell3, cell4 = rectangle
+                if cell3.candidates > candidates and cell4.candidates > candidates:
+                    for candidate in list(candidates):
+                        if (len(cell1.same_digit_in_row(candidate)) == 2 and
+                            len(cell2.same_digit_in_row(candidate)) == 2 and
+                            len(cell1.same_digit_in_col(candidate)) == 2 and
+                            len(cell2.same_digit_in_col(candidate)) == 2):
+                            nb_removed = apply_uniqueness_test_2(grid, 'Uniqueness test 6', explain,
+                                        [candidates, [candidate]], [cell1, cell2, cell3, cell4], [cell3, cell4])
+                            if nb_removed:
+                                return nb_removed
     return 0
 
 
 def solve_hidden_rectangle(grid, explain, target=None):
     if target:
         target = set(int(_) for _ in target)
+    index = get_rectangle_index(grid)
     pairs = bivaluedict(grid)
     for candidates, cells in pairs.items():
         if target and candidates != target:
             continue
+        pairmask = candidates_mask(candidates)
         for cell1 in sorted(cells):
-            cell2s = [cell for cell in cell1.row if candidates < cell.candidates]
-            cell3s = [cell for cell in cell1.col if candidates < cell.candidates]
-            for cell2, cell3 in itertools.product(cell2s, cell3s):
-                if in_two_boxes(cell1, cell2, cell3):
-                    cell4 = cell3.row[cell2.colnum]
-                    if cell4.candidates >= candidates:
-                        for candidate in list(candidates):
-                            if (len(cell4.same_digit_in_row(candidate)) == 2 and
-                                len(cell4.same_digit_in_col(candidate)) == 2):
-                                extracand = list(cell1.candidates - {candidate})[0]
-                                nb_removed = apply_uniqueness_test_2(grid, 'Hidden rectangle', explain,
-                                            [candidates, [extracand]], [cell1, cell2, cell3, cell4], [cell4])
-                                if nb_removed:
-                                    return nb_removed
+            for cell2, cell3, cell4 in index.corners(cell1, pairmask):
+                if candidates < cell2.candidates and candidates < cell3.candidates:
+                    for candidate in list(candidates):
+                        if (len(cell4.same_digit_in_row(candidate)) == 2 and
+                            len(cell4.same_digit_in_col(candidate)) == 2):
+                            extracand = list(cell1.candidates - {candidate})[0]
+                            nb_removed = apply_uniqueness_test_2(grid, 'Hidden rectangle', explain,
+                                        [candidates, [extracand]], [cell1, cell2, cell3, cell4], [cell4])
+                            if nb_removed:
+                                return nb_removed
     return 0
 
 
-def in_two_boxes(*cells):
-    boxnum = set()
-    for cell in cells:
-        boxnum.add(cell.boxnum)
-    return len(boxnum) == 2
-
-
 def solve_avoidable_rectangle_1(grid, explain):
+    index = get_rectangle_index(grid)
     for cell1 in grid.cells:
         if cell1.value and not cell1.given:
-            cell2s = [cell for cell in cell1.row if cell != cell1 and cell.value and not cell.given]
-            cell3s = [cell for cell in cell1.col if cell != cell1 and cell.value and not cell.given]
-            for cell2, cell3 in itertools.product(cell2s, cell3s):
-                if cell2.value == cell3.value:
-                    if in_two_boxes(cell1, cell2, cell3):
-                        cell4 = cell3.row[cell2.colnum]
+            for cell2, cell3, cell4 in index.corners(cell1, solved=3):
+                if cell2.value and not cell2.given and cell3.value and not cell3.given:
+                    if cell2.value == cell3.value:
                         if cell1.value in cell4.candidates:
                             return apply_uniqueness_test_2(grid, 'Avoidable rectangle type 1', explain,
                                             [[cell1.value, cell2.value], [cell1.value]], [cell1, cell2, cell3, cell4], [cell4])
@@ -2937,28 +3906,25 @@ def solve_avoidable_rectangle_1(grid, explain):
 
 
 def solve_avoidable_rectangle_2(grid, explain):
+    index = get_rectangle_index(grid)
     for cell1 in grid.cells:
         if cell1.value and not cell1.given:
-            cell2s = [cell for cell in cell1.row if cell != cell1]  # TODO: start after cell?
-            cell3s = [cell for cell in cell1.col if cell != cell1]
-            for cell2, cell3 in itertools.product(cell2s, cell3s):
+            for cell2, cell3, cell4 in index.corners(cell1, bivalues=2, solved=2):
                 if (cell2.value and not cell2.given and len(cell3.candidates) == 2 and cell2.value in cell3.candidates or
                     cell3.value and not cell3.given and len(cell2.candidates) == 2 and cell3.value in cell2.candidates):
-                    if in_two_boxes(cell1, cell2, cell3):
-                        cell4 = cell3.row[cell2.colnum]
-                        if len(cell4.candidates) == 2 and cell1.value in cell4.candidates:
-                            extracand = list(cell4.candidates - {cell1.value})[0]
-                            if (cell2.candidates and extracand in cell2.candidates) or extracand in cell3.candidates:
-                                if cell2.candidates:
-                                    remove_set = cellinter(cell4.same_digit_peers(extracand), cell2.same_digit_peers(extracand))
-                                    defcand = [cell1.value, cell3.value]
-                                else:
-                                    remove_set = cellinter(cell4.same_digit_peers(extracand), cell3.same_digit_peers(extracand))
-                                    defcand = [cell1.value, cell2.value]
-                                nb_removed = apply_avoidable_rectangle_2(grid, 'Avoidable rectangle type 2', explain,
-                                                [defcand, [extracand]], [cell1, cell2, cell3, cell4], remove_set)
-                                if nb_removed:
-                                    return nb_removed
+                    if len(cell4.candidates) == 2 and cell1.value in cell4.candidates:
+                        extracand = list(cell4.candidates - {cell1.value})[0]
+                        if (cell2.candidates and extracand in cell2.candidates) or extracand in cell3.candidates:
+                            if cell2.candidates:
+                                remove_set = cellinter(cell4.same_digit_peers(extracand), cell2.same_digit_peers(extracand))
+                                defcand = [cell1.value, cell3.value]
+                            else:
+                                remove_set = cellinter(cell4.same_digit_peers(extracand), cell3.same_digit_peers(extracand))
+                                defcand = [cell1.value, cell2.value]
+                            nb_removed = apply_avoidable_rectangle_2(grid, 'Avoidable rectangle type 2', explain,
+                                            [defcand, [extracand]], [cell1, cell2, cell3, cell4], remove_set)
+                            if nb_removed:
+                                return nb_removed
     return 0
 
 
@@ -2974,23 +3940,70 @@ def apply_avoidable_rectangle_2(grid, caption, explain, candidates, define_set,
 
 def explain_avoidable_rectangle_2(grid, caption, candidates, define_set, remove_set, remove_dict):
     defcand, extracand = candidates
-    print_single_history(grid)
-    print(describe_xy_wing(caption, sorted(defcand), define_set, remove_dict))
-    grid.dump(((define_set, defcand, CellDecor.DEFININGCAND),
-               (define_set, extracand, CellDecor.COLOR4),
-               (remove_set, extracand, CellDecor.REMOVECAND),))
+    text = describe_xy_wing(caption, sorted(defcand), define_set, remove_dict)
+    decor = ((define_set, defcand, CellDecor.DEFININGCAND),
+             (define_set, extracand, CellDecor.COLOR4),
+             (remove_set, extracand, CellDecor.REMOVECAND),)
+    explain_step(grid, caption, text, remove_dict, decor)
 
 
 # Sue de Coq
 
+# The subsets of the cells of a unit with n cells and n + 1 (ALS) or n + 2
+# candidates are enumerated once per state of the unit and stored as pairs of
+# masks (cells, candidates) in the subset index of the grid. Patterns are made
+# by joining the line and box subsets not overlapping the intersection cells,
+# line subsets needing candidates missing from all box subsets being skipped.
 
-def subsets(cells, delta):
-    candcells = [cell for cell in cells if cell.candidates]
-    for size in range(1, len(candcells) + 1):
-        for subset in itertools.combinations(sorted(candcells), size):
-            candidates = candidate_union(subset)
-            if len(candidates) - len(subset) == delta:
-                yield subset, candidates
+
+class SubsetIndex:
+    """Subsets of the cells with candidates of each unit, with one or two more
+    candidates than cells, by size and in lexicographic order of cells. The
+    index is kept along the resolution: when refreshing, only the units whose
+    candidates have changed are enumerated again.
+    """
+    def __init__(self):
+        self.signatures = [None] * 27
+        self.subsets = [None] * 27
+
+    def refresh(self, grid):
+        for unitnum, unit in enumerate(grid.units()):
+            signature = tuple(candidates_mask(cell.candidates) for cell in unit)
+            if signature != self.signatures[unitnum]:
+                self.signatures[unitnum] = signature
+                self.subsets[unitnum] = unit_subsets(unit, signature)
+        return self
+
+    def get(self, unitnum, delta, excluded):
+        """return the subsets of unit with delta more candidates than cells
+        and no cell in excluded mask as pairs (cellmask, candmask)
+        """
+        return [subset for subset in self.subsets[unitnum][delta] if not subset[0] & excluded]
+
+
+def unit_subsets(unit, masks):
+    """return the subsets of the cells of unit with candidates as a dict
+    delta -> list of pairs (cellmask, candmask) for delta 1 and 2
+    """
+    cells = [(1 << cell.cellnum, mask) for cell, mask in zip(unit, masks) if mask]
+    result = {1: [], 2: []}
+    for size in range(1, len(cells) + 1):
+        for subset in itertools.combinations(cells, size):
+            cellmask = 0
+            candmask = 0
+            for cellbit, mask in subset:
+                cellmask |= cellbit
+                candmask |= mask
+            delta = popcount(candmask) - size
+            if delta in result:
+                result[delta].append((cellmask, candmask))
+    return result
+
+
+def get_subset_index(grid):
+    if grid.subset_index is None:
+        grid.subset_index = SubsetIndex()
+    return grid.subset_index.refresh(grid)
 
 
 def solve_sue_de_coq(grid, explain, target=None):
@@ -3038,13 +4051,14 @@ def solve_sue_de_coq_best(grid, explain):
 
 
 def sue_de_coq_patterns(grid, explain):
-    for _ in sue_de_coq_row_patterns(grid, explain, grid.boxrows, grid.rows, grid.boxes, Cell.mrownum):
+    index = get_subset_index(grid)
+    for _ in sue_de_coq_row_patterns(grid, index, grid.boxrows, ROW_UNITS, Cell.mrownum):
         yield _
-    for _ in sue_de_coq_row_patterns(grid, explain, grid.boxcols, grid.cols, grid.boxes, Cell.mcolnum):
+    for _ in sue_de_coq_row_patterns(grid, index, grid.boxcols, COL_UNITS, Cell.mcolnum):
         yield _
 
 
-def sue_de_coq_row_patterns(grid, explain, boxrows, row, box, mrownum):
+def sue_de_coq_row_patterns(grid, index, boxrows, row_units, mrownum):
     for boxrow in boxrows:
         candcells = [cell for cell in boxrow if cell.candidates]
         if len(candcells) < 2:
@@ -3053,44 +4067,54 @@ def sue_de_coq_row_patterns(grid, explain, boxrows, row, box, mrownum):
         for cells in itertools.combinations(candcells, 2):
             candidates = candidate_union(cells)
             if len(candidates) >= 4:
-                row_less_cells = [cell for cell in row[mrownum(cells[0])] if cell.candidates and cell not in cells]
-                box_less_cells = [cell for cell in box[cells[0].boxnum] if cell.candidates and cell not in cells]
-                for (cells_row, cand_row), (cells_box, cand_box) in itertools.product(
-                    subsets(row_less_cells, delta=1),
-                    subsets(box_less_cells, delta=1)):
-                    if candidates <= set().union(cand_row, cand_box) and not cellinterx(cells, cells_row, cells_box):
-                        yield (cells, cells_row, cells_box, candidates, cand_row, cand_box, None,
-                            row_less_cells, box_less_cells)
+                yield from sue_de_coq_join(grid, index, cells, candidates, row_units[mrownum(cells[0])], 1, 1)
 
         if len(candcells) == 3:
             cells = candcells
             candidates = candidate_union(cells)
             if len(candidates) >= 5:
-                row_less_cells = [cell for cell in row[mrownum(cells[0])] if cell.candidates and cell not in cells]
-                box_less_cells = [cell for cell in box[cells[0].boxnum] if cell.candidates and cell not in cells]
-                for (cells_row, cand_row), (cells_box, cand_box) in itertools.product(
-                    subsets(row_less_cells, delta=1),
-                    subsets(box_less_cells, delta=1)):
-                    extra = candidates - set().union(cand_row, cand_box)
-                    if len(extra) == 1 and not cellinterx(cells, cells_row, cells_box):
-                        yield (cells, cells_row, cells_box, candidates, cand_row, cand_box, extra,
-                            row_less_cells, box_less_cells)
-
-                for (cells_row, cand_row), (cells_box, cand_box) in itertools.product(
-                    subsets(row_less_cells, delta=1),
-                    subsets(box_less_cells, delta=2)):
-                    if (candidates <= set().union(cand_row, cand_box) and
-                        not cellinterx(cells, cells_row, cells_box)):
-                        yield (cells, cells_row, cells_box, candidates, cand_row, cand_box, None,
-                            row_less_cells, box_less_cells)
-
-                for (cells_row, cand_row), (cells_box, cand_box) in itertools.product(
-                    subsets(row_less_cells, delta=2),
-                    subsets(box_less_cells, delta=1)):
-                    if (candidates <= set().union(cand_row, cand_box) and
-                        not cellinterx(cells, cells_row, cells_box)):
-                        yield (cells, cells_row, cells_box, candidates, cand_row, cand_box, None,
-                            row_less_cells, box_less_cells)
+                rownum = row_units[mrownum(cells[0])]
+                yield from sue_de_coq_join(grid, index, cells, candidates, rownum, 1, 1, missing=1)
+                yield from sue_de_coq_join(grid, index, cells, candidates, rownum, 1, 2)
+                yield from sue_de_coq_join(grid, index, cells, candidates, rownum, 2, 1)
+
+
+def sue_de_coq_join(grid, index, cells, candidates, rownum, row_delta, box_delta, missing=0):
+    """yield the patterns made of cells (in the intersection of row rownum
+    and a box) and of a pair of row and box subsets. The subsets cover the
+    candidates of cells except missing ones (0 or 1, the extra candidate).
+    """
+    cellmask = cells_mask(cells)
+    candmask = candidates_mask(candidates)
+    boxnum = BOX_UNITS[cells[0].boxnum]
+    row_subsets = index.get(rownum, row_delta, cellmask)
+    box_subsets = index.get(boxnum, box_delta, cellmask)
+    box_union = 0
+    for _, box_candmask in box_subsets:
+        box_union |= box_candmask
+    row_less_cells = None
+
+    for row_cellmask, row_candmask in row_subsets:
+        # candidates of cells missing in the row subset, to be found in the box
+        # subset except missing ones
+        needed = candmask & ~row_candmask
+        if popcount(needed & ~box_union) > missing:
+            continue
+        for box_cellmask, box_candmask in box_subsets:
+            if popcount(needed & ~box_candmask) != missing:
+                continue
+            if row_less_cells is None:
+                row_less_cells = mask_cells(grid, UNITS_MASK[rownum] & ~cellmask)
+                row_less_cells = [cell for cell in row_less_cells if cell.candidates]
+                box_less_cells = mask_cells(grid, UNITS_MASK[boxnum] & ~cellmask)
+                box_less_cells = [cell for cell in box_less_cells if cell.candidates]
+            cells_row = tuple(mask_cells(grid, row_cellmask))
+            cells_box = tuple(mask_cells(grid, box_cellmask))
+            cand_row = candidate_union(cells_row)
+            cand_box = candidate_union(cells_box)
+            yield (cells, cells_row, cells_box, candidates, cand_row, cand_box,
+                   candidates - set().union(cand_row, cand_box) if missing else None,
+                   row_less_cells, box_less_cells)
 
 
 def remove_cells_sue_de_coq(pattern):
@@ -3132,13 +4156,13 @@ def apply_sue_de_coq(grid, caption, explain, candidates, define_set, remove_dict
 
 def explain_sue_de_coq(grid, caption, candidates, define_set, remove_dict):
     cells, cells_row, cells_box = define_set
-    print_single_history(grid)
-    print(describe_sue_de_coq(caption, candidates, define_set, remove_dict))
-    grid.dump([(cells, candidate_union(cells_row), CellDecor.COLOR1),
-               (cells, candidate_union(cells_box), CellDecor.COLOR3),
-               (cells_row, candidate_union(cells_row), CellDecor.COLOR1),
-               (cells_box, candidate_union(cells_box), CellDecor.COLOR3),
-                ] + [(cells, {cand}, CellDecor.REMOVECAND) for cand, cells in remove_dict.items()])
+    text = describe_sue_de_coq(caption, candidates, define_set, remove_dict)
+    decor = [(cells, candidate_union(cells_row), CellDecor.COLOR1),
+             (cells, candidate_union(cells_box), CellDecor.COLOR3),
+             (cells_row, candidate_union(cells_row), CellDecor.COLOR1),
+             (cells_box, candidate_union(cells_box), CellDecor.COLOR3),
+              ] + [(cells, {cand}, CellDecor.REMOVECAND) for cand, cells in remove_dict.items()]
+    explain_step(grid, caption, text, remove_dict, decor)
 
 
 def describe_sue_de_coq(caption, digits, define_set, remove_dict):
@@ -3155,6 +4179,591 @@ def describe_sue_de_coq(caption, digits, define_set, remove_dict):
         discarded_text(remove_dict))
 
 
+# Almost locked sets
+
+
+class Als:
+    """Almost locked set: n cells of a unit with n + 1 candidates.
+    """
+    __slots__ = ('cells', 'cellmask', 'candidates', 'candmask', 'digitcells', 'seen')
+
+    def __init__(self, cells, candmask):
+        self.cells = cells
+        self.cellmask = cells_mask(cells)
+        self.candmask = candmask
+        self.candidates = {digit for digit in ALLDIGITS if candmask & (1 << digit)}
+        # for each candidate, mask of ALS cells with the candidate and mask of
+        # cells seeing all of them
+        self.digitcells = {}
+        self.seen = {}
+        for digit in self.candidates:
+            dcells = [cell for cell in cells if digit in cell.candidates]
+            self.digitcells[digit] = cells_mask(dcells)
+            self.seen[digit] = seen_by_all(dcells)
+
+    def __str__(self):
+        return '%s {%s}' % (packed_coordinates(self.cells),
+                            ''.join(str(_) for _ in sorted(self.candidates)))
+
+
+def unit_als(unit):
+    """enumerate the ALS of a unit in order of size.
+    """
+    cells = [cell for cell in unit if cell.candidates]
+    masks = [candidates_mask(cell.candidates) for cell in cells]
+    for size in range(1, len(cells)):
+        for indexes in itertools.combinations(range(len(cells)), size):
+            mask = 0
+            for index in indexes:
+                mask |= masks[index]
+            if popcount(mask) == size + 1:
+                yield Als([cells[index] for index in indexes], mask)
+
+
+class AlsIndex:
+    """All ALS of a grid, indexed by digit and by cell. The index is kept
+    along the resolution: when refreshing, only the units whose candidates have
+    changed are enumerated again, and only the ALS of these units are removed
+    from or added to the index, with their restricted common candidates.
+
+    An ALS is identified by a key (unitnum, ordinal): the first unit where it
+    is found and its rank in the enumeration of the unit. Keys are sorted in
+    the order of a full enumeration of the grid.
+    """
+    def __init__(self):
+        self.signatures = [None] * 27
+        # for each unit, ALS of the unit by cell mask with their ordinal
+        self.unit_als = [{} for _ in range(27)]
+        self.units_of = defaultdict(set)
+        self.keys = {}
+        self.als = {}
+        self.by_digit = {digit: [] for digit in ALLDIGITS}
+        self.by_cell = defaultdict(list)
+        # restricted commons by pair of keys (i, j) with i < j
+        self.rcc = {}
+        self.partners = defaultdict(set)
+        self.rccs = None
+        self.adjacency = None
+
+    def refresh(self, grid):
+        masks = [candidates_mask(cell.candidates) for cell in grid.cells]
+        changed = set()
+        touched = set()
+        for unitnum, unit in enumerate(grid.units()):
+            signature = tuple(masks[cell.cellnum] for cell in unit)
+            if signature != self.signatures[unitnum]:
+                self.signatures[unitnum] = signature
+                changed.add(unitnum)
+                for cellmask in self.unit_als[unitnum]:
+                    self.units_of[cellmask].discard(unitnum)
+                    touched.add(cellmask)
+                self.unit_als[unitnum] = {als.cellmask: (ordinal, als)
+                                          for ordinal, als in enumerate(unit_als(unit))}
+                for cellmask in self.unit_als[unitnum]:
+                    self.units_of[cellmask].add(unitnum)
+                    touched.add(cellmask)
+        if not touched:
+            return self
+
+        # ALS from a changed unit are replaced as their candidates may differ
+        added = []
+        for cellmask in touched:
+            key = self.keys.get(cellmask)
+            units = self.units_of[cellmask]
+            newkey = None
+            if units:
+                unitnum = min(units)
+                newkey = (unitnum, self.unit_als[unitnum][cellmask][0])
+            else:
+                del self.units_of[cellmask]
+            if key is not None and (key != newkey or key[0] in changed):
+                self.remove(key)
+                del self.keys[cellmask]
+                key = None
+            if key is None and newkey is not None:
+                added.append((cellmask, newkey))
+
+        for cellmask, key in added:
+            self.add(cellmask, key)
+        for _, key in added:
+            self.link(key)
+        self.rccs = None
+        self.adjacency = None
+        return self
+
+    def add(self, cellmask, key):
+        als = self.unit_als[key[0]][cellmask][1]
+        self.keys[cellmask] = key
+        self.als[key] = als
+        for digit in als.candidates:
+            bisect.insort(self.by_digit[digit], key)
+        for cell in als.cells:
+            bisect.insort(self.by_cell[cell.cellnum], key)
+
+    def remove(self, key):
+        als = self.als.pop(key)
+        for digit in als.candidates:
+            self.by_digit[digit].remove(key)
+        for cell in als.cells:
+            self.by_cell[cell.cellnum].remove(key)
+        for other in self.partners.pop(key, ()):
+            self.partners[other].discard(key)
+            del self.rcc[min(key, other), max(key, other)]
+
+    def link(self, key):
+        """add the restricted common candidates between an ALS and the others.
+        A digit is a restricted common if all its occurrences in one ALS see
+        all its occurrences in the other one.
+        """
+        als1 = self.als[key]
+        for digit in als1.candidates:
+            for cellnum in mask_cells_nums(als1.seen[digit]):
+                for other in self.by_cell[cellnum]:
+                    als2 = self.als[other]
+                    if (digit in als2.candidates and
+                        not als1.cellmask & als2.cellmask and
+                        not als2.digitcells[digit] & ~als1.seen[digit]):
+                        self.rcc.setdefault((min(key, other), max(key, other)), set()).add(digit)
+                        self.partners[key].add(other)
+                        self.partners[other].add(key)
+
+    def restricted_commons(self):
+        """return the list of pairs of non overlapping ALS with their restricted
+        common candidates: ((i, j), [digit, ...]) with i < j.
+        """
+        if self.rccs is None:
+            self.rccs = sorted((pair, sorted(digits)) for pair, digits in self.rcc.items())
+        return self.rccs
+
+    def linked(self):
+        """return for each ALS the list of (ALS, restricted common candidate)
+        """
+        if self.adjacency is None:
+            self.adjacency = {key: [] for key in sorted(self.als)}
+            for (i, j), digits in self.restricted_commons():
+                for digit in digits:
+                    self.adjacency[i].append((j, digit))
+                    self.adjacency[j].append((i, digit))
+            for links in self.adjacency.values():
+                links.sort()
+        return self.adjacency
+
+
+def get_als_index(grid):
+    if grid.als_index is None:
+        grid.als_index = AlsIndex()
+    return grid.als_index.refresh(grid)
+
+
+def als_eliminations(alss, digits, positions, removed=None, excluded=0):
+    """Add to removed the candidates in digits which see all their occurrences
+    in the list of ALS. Cells of the ALS and excluded cells are not considered.
+    """
+    if removed is None:
+        removed = {}
+    for als in alss:
+        excluded |= als.cellmask
+    for digit in digits:
+        mask = positions[digit] & ~excluded
+        for als in alss:
+            mask &= als.seen[digit]
+        if mask:
+            removed[digit] = removed.get(digit, 0) | mask
+    return removed
+
+
+def als_remove_dict(grid, removed):
+    return {digit: mask_cells(grid, mask) for digit, mask in sorted(removed.items())}
+
+
+def all_positions(grid):
+    return [0] + [digit_positions(grid, digit) for digit in ALLDIGITS]
+
+
+def solve_als_xz(grid, explain, target=None):
+    """Two ALS A and B linked by a restricted common candidate x: z common to A
+    and B can be eliminated from cells seeing all z in A and B. If A and B are
+    linked by two restricted commons (doubly linked), each ALS becomes a locked
+    set.
+    """
+    if target:
+        target = set(int(_) for _ in target)
+    index = get_als_index(grid)
+    positions = all_positions(grid)
+
+    for (i, j), rccs in index.restricted_commons():
+        als1, als2 = index.als[i], index.als[j]
+        common = als1.candidates & als2.candidates
+        if len(rccs) == 1:
+            removed = als_eliminations([als1, als2], sorted(common - set(rccs)), positions)
+        else:
+            removed = als_eliminations([als1, als2], sorted(common), positions)
+            # each ALS is now a locked set without the restricted commons
+            excluded = als1.cellmask | als2.cellmask
+            for als in (als1, als2):
+                als_eliminations([als], sorted(als.candidates - set(rccs)), positions,
+                                 removed, excluded)
+        if not removed or target and set(removed) != target:
+            continue
+        return apply_als(grid, 'ALS-XZ', explain, [als1, als2], [rccs],
+                         als_remove_dict(grid, removed))
+    return 0
+
+
+def solve_als_xy_wing(grid, explain, target=None):
+    """Three ALS A, B and C. A and C linked by restricted common x, B and C
+    linked by restricted common y, x != y: z common to A and B can be eliminated
+    from cells seeing all z in A and B.
+    """
+    if target:
+        target = set(int(_) for _ in target)
+    index = get_als_index(grid)
+    positions = all_positions(grid)
+    adjacency = index.linked()
+
+    for k, links in adjacency.items():
+        for (i, x), (j, y) in itertools.combinations(links, 2):
+            if i == j or x == y:
+                continue
+            als1, als2 = index.als[i], index.als[j]
+            if als1.cellmask & als2.cellmask:
+                continue
+            common = als1.candidates & als2.candidates - {x, y}
+            removed = als_eliminations([als1, als2], sorted(common), positions)
+            if not removed or target and set(removed) != target:
+                continue
+            return apply_als(grid, 'ALS-XY-wing', explain, [als1, index.als[k], als2], [[x], [y]],
+                             als_remove_dict(grid, removed))
+    return 0
+
+
+ALS_CHAIN_MAX_LENGTH = 6
+
+
+def solve_als_xy_chain(grid, explain, target=None):
+    """Chain of ALS A1 ... An, two consecutive ALS linked by a restricted
+    common, two consecutive restricted commons being different: z common to A1
+    and An and different from first and last restricted commons can be
+    eliminated from cells seeing all z in A1 and An. Chains with three ALS are
+    ALS-XY-wings and are not considered.
+    """
+    if target:
+        target = set(int(_) for _ in target)
+    index = get_als_index(grid)
+    positions = all_positions(grid)
+    adjacency = index.linked()
+
+    def chains(chain, rccs, cellmask, length):
+        if len(chain) == length:
+            yield chain, rccs
+            return
+        for other, digit in adjacency[chain[-1]]:
+            if digit != rccs[-1] and not index.als[other].cellmask & cellmask:
+                yield from chains(chain + [other], rccs + [digit],
+                                  cellmask | index.als[other].cellmask, length)
+
+    for length in range(4, ALS_CHAIN_MAX_LENGTH + 1):
+        for first, links in adjacency.items():
+            for second, digit in links:
+                cellmask = index.als[first].cellmask | index.als[second].cellmask
+                for chain, rccs in chains([first, second], [digit], cellmask, length):
+                    if chain[0] > chain[-1]:
+                        # reversed chain already seen
+                        continue
+                    als1, als2 = index.als[chain[0]], index.als[chain[-1]]
+                    common = als1.candidates & als2.candidates - {rccs[0], rccs[-1]}
+                    removed = als_eliminations([als1, als2], sorted(common), positions)
+                    if not removed or target and set(removed) != target:
+                        continue
+                    return apply_als(grid, 'ALS-XY-chain', explain,
+                                     [index.als[_] for _ in chain], [[_] for _ in rccs],
+                                     als_remove_dict(grid, removed))
+    return 0
+
+
+def apply_als(grid, caption, explain, alss, rccs, remove_dict):
+    if explain:
+        explain_als(grid, caption, alss, rccs, remove_dict)
+    return apply_remove_candidates(grid, caption, remove_dict)
+
+
+def explain_als(grid, caption, alss, rccs, remove_dict):
+    text = describe_als(caption, alss, rccs, remove_dict)
+    colors = (CellDecor.COLOR1, CellDecor.COLOR2, CellDecor.COLOR3, CellDecor.COLOR4)
+    decor = [(als.cells, als.candidates, colors[index % 4]) for index, als in enumerate(alss)]
+    allcells = cellunionx(*[als.cells for als in alss])
+    decor.append((allcells, set().union(*rccs), CellDecor.DEFININGCAND))
+    decor.extend((cells, {cand}, CellDecor.REMOVECAND) for cand, cells in remove_dict.items())
+    explain_step(grid, caption, text, remove_dict, decor)
+
+
+def describe_als(caption, alss, rccs, remove_dict):
+    # ALS-XZ: r1c2 {13} -3- r4c56 {234} => r3c2<>1
+    chain = [str(alss[0])]
+    for als, digits in zip(alss[1:], rccs):
+        chain.append('-%s-' % ','.join(str(_) for _ in digits))
+        chain.append(str(als))
+    return '%s: %s => %s' % (caption, ' '.join(chain), discarded_text(remove_dict))
+
+
+def solve_death_blossom(grid, explain, target=None):
+    """A stem cell and, for each candidate of the stem, an ALS (petal) whose
+    occurrences of the candidate all see the stem: z common to all petals can be
+    eliminated from cells seeing all z in the petals (and the stem if z is a
+    candidate of the stem).
+    """
+    if target:
+        target = set(int(_) for _ in target)
+    index = get_als_index(grid)
+    positions = all_positions(grid)
+
+    def blossoms(petals, selection, cellmask, targets):
+        if len(selection) == len(petals):
+            yield selection, targets
+            return
+        digit = len(selection)
+        for i in petals[digit]:
+            als = index.als[i]
+            if als.cellmask & cellmask:
+                continue
+            targets2 = {z: mask & als.seen[z] & ~als.cellmask
+                        for z, mask in targets.items()
+                        if z in als.candidates and mask & als.seen[z] & ~als.cellmask}
+            if targets2:
+                yield from blossoms(petals, selection + [i], cellmask | als.cellmask, targets2)
+
+    for stem in grid.cells:
+        if len(stem.candidates) < 2:
+            continue
+        stembit = 1 << stem.cellnum
+        stempeers = PEERS_MASK[stem.cellnum]
+        petals = []
+        for digit in sorted(stem.candidates):
+            petals.append([i for i in index.by_digit[digit]
+                           if not index.als[i].cellmask & stembit and
+                           not index.als[i].digitcells[digit] & ~stempeers])
+        if not all(petals):
+            continue
+
+        targets = {}
+        for z in ALLDIGITS:
+            mask = positions[z] & ~stembit
+            if z in stem.candidates:
+                mask &= stempeers
+            if mask:
+                targets[z] = mask
+
+        for selection, removed in blossoms(petals, [], stembit, targets):
+            if target and set(removed) != target:
+                continue
+            return apply_death_blossom(grid, 'Death blossom', explain, stem,
+                                       [index.als[_] for _ in selection],
+                                       als_remove_dict(grid, removed))
+    return 0
+
+
+def apply_death_blossom(grid, caption, explain, stem, petals, remove_dict):
+    if explain:
+        explain_death_blossom(grid, caption, stem, petals, remove_dict)
+    return apply_remove_candidates(grid, caption, remove_dict)
+
+
+def explain_death_blossom(grid, caption, stem, petals, remove_dict):
+    text = describe_death_blossom(caption, stem, petals, remove_dict)
+    colors = (CellDecor.COLOR1, CellDecor.COLOR2, CellDecor.COLOR3, CellDecor.COLOR4)
+    decor = [([stem], stem.candidates, CellDecor.DEFININGCAND)]
+    for index, (digit, als) in enumerate(zip(sorted(stem.candidates), petals)):
+        decor.append((als.cells, als.candidates, colors[index % 4]))
+        decor.append((als.cells, {digit}, CellDecor.DEFININGCAND))
+    decor.extend((cells, {cand}, CellDecor.REMOVECAND) for cand, cells in remove_dict.items())
+    explain_step(grid, caption, text, remove_dict, decor)
+
+
+def describe_death_blossom(caption, stem, petals, remove_dict):
+    # Death blossom: r5c5 {127} 1: r1c5 {15}, 2: r5c13 {235}, 7: r6c4 {57} => r1c4<>5
+    return '%s: %s {%s} %s => %s' % (caption,
+        stem.strcoord(),
+        ''.join(str(_) for _ in sorted(stem.candidates)),
+        ', '.join(f'{digit}: {als}' for digit, als in zip(sorted(stem.candidates), petals)),
+        discarded_text(remove_dict))
+
+
+# Templates
+
+
+# A template is a valid placement of a digit in the grid, i.e. a set of 9 cells
+# with one cell in each row, column and box. There are 46656 templates. They
+# are stored as 81 bit masks split in two uint64 arrays (bits 0-63 and 64-80),
+# so that the templates compatible with a position are filtered in a single
+# vectorized operation. The table is generated on first use.
+
+
+TEMPLATES = None
+
+
+def make_templates():
+    """return the low and high words of the 46656 templates, in cell order
+    """
+    templates = []
+
+    def place(rownum, cols, boxes, mask):
+        if rownum == 9:
+            templates.append(mask)
+            return
+        for colnum in range(9):
+            boxnum = (rownum // 3) * 3 + colnum // 3
+            if not cols >> colnum & 1 and not boxes >> boxnum & 1:
+                place(rownum + 1, cols | 1 << colnum, boxes | 1 << boxnum,
+                      mask | 1 << (rownum * 9 + colnum))
+
+    place(0, 0, 0, 0)
+    import numpy
+    low = numpy.array([mask & 0xFFFFFFFFFFFFFFFF for mask in templates], dtype=numpy.uint64)
+    high = numpy.array([mask >> 64 for mask in templates], dtype=numpy.uint64)
+    return low, high
+
+
+def get_templates():
+    global TEMPLATES
+    if TEMPLATES is None:
+        TEMPLATES = make_templates()
+    return TEMPLATES
+
+
+def split_mask(mask):
+    import numpy
+    return numpy.uint64(mask & 0xFFFFFFFFFFFFFFFF), numpy.uint64(mask >> 64)
+
+
+def join_mask(low, high):
+    return int(low) | int(high) << 64
+
+
+def template_selection(mask, placed):
+    """return the boolean selection of the templates included in mask and
+    including placed
+    """
+    low, high = get_templates()
+    mask_low, mask_high = split_mask(mask)
+    placed_low, placed_high = split_mask(placed)
+    return (((low & ~mask_low) == 0) & ((high & ~mask_high) == 0) &
+            ((low & placed_low) == placed_low) & ((high & placed_high) == placed_high))
+
+
+def template_masks(grid):
+    """return for each digit the mask of the cells common to all its valid
+    templates and the mask of the cells covered by at least one of them.
+
+    Templates of a digit are valid if they include the cells where the digit
+    is placed and are included in the cells where it is placed or candidate.
+    Templates using a cell which belongs to all the templates of another digit
+    are then discarded until no more template is removed.
+    """
+    import numpy
+    low, high = get_templates()
+    selections = {}
+    for digit in ALLDIGITS:
+        placed = cells_mask(cell for cell in grid.cells if cell.value == digit)
+        selections[digit] = template_selection(digit_positions(grid, digit) | placed, placed)
+
+    while True:
+        common = {}
+        for digit in ALLDIGITS:
+            if not selections[digit].any():
+                # no template for digit: invalid grid, nothing can be deduced
+                return None
+            common[digit] = join_mask(numpy.bitwise_and.reduce(low[selections[digit]]),
+                                      numpy.bitwise_and.reduce(high[selections[digit]]))
+        changed = False
+        for digit in ALLDIGITS:
+            others = 0
+            for other in ALLDIGITS:
+                if other != digit:
+                    others |= common[other]
+            others_low, others_high = split_mask(others)
+            selection = selections[digit] & ((low & others_low) == 0) & ((high & others_high) == 0)
+            if selection.sum() < selections[digit].sum():
+                selections[digit] = selection
+                changed = True
+        if not changed:
+            break
+
+    covered = {}
+    for digit in ALLDIGITS:
+        covered[digit] = join_mask(numpy.bitwise_or.reduce(low[selections[digit]]),
+                                   numpy.bitwise_or.reduce(high[selections[digit]]))
+    return common, covered
+
+
+def solve_template_set(grid, explain, target=None):
+    """a digit can be placed in a cell common to all its valid templates
+    """
+    masks = template_masks(grid)
+    if masks is None:
+        return 0
+    common, _ = masks
+    for digit in ALLDIGITS:
+        if not (target is None or digit == int(target)):
+            continue
+        for cell in mask_cells(grid, common[digit] & digit_positions(grid, digit)):
+            return apply_template_set(grid, 'Template set', explain, cell, digit)
+    return 0
+
+
+def apply_template_set(grid, caption, explain, cell, digit):
+    if explain:
+        explain_template_set(grid, caption, cell, digit)
+    grid.place(caption, cell, digit)
+    return 10
+
+
+def explain_template_set(grid, caption, cell, digit):
+    text = describe_template_set(caption, cell, digit)
+    decor = (([cell], [digit], CellDecor.DEFININGCAND),)
+    explain_step(grid, caption, text, None, decor)
+
+
+def describe_template_set(caption, cell, digit):
+    # Template set: 9 => r1c4=9
+    return '%s: %d => %s=%d' % (caption, digit, cell.strcoord(), digit)
+
+
+def solve_template_delete(grid, explain, target=None):
+    """a candidate which does not belong to any valid template of its digit
+    can be eliminated
+    """
+    masks = template_masks(grid)
+    if masks is None:
+        return 0
+    _, covered = masks
+    for digit in ALLDIGITS:
+        if not (target is None or digit == int(target)):
+            continue
+        eliminations = digit_positions(grid, digit) & ~covered[digit]
+        if eliminations:
+            return apply_template_delete(grid, 'Template delete', explain, digit,
+                                         mask_cells(grid, eliminations))
+    return 0
+
+
+def apply_template_delete(grid, caption, explain, digit, remove_set):
+    remove_dict = candidates_cells([digit], remove_set)
+    if explain:
+        explain_template_delete(grid, caption, digit, remove_set, remove_dict)
+    return apply_remove_candidates(grid, caption, remove_dict)
+
+
+def explain_template_delete(grid, caption, digit, remove_set, remove_dict):
+    text = describe_template_delete(caption, digit, remove_dict)
+    decor = ((remove_set, [digit], CellDecor.REMOVECAND),)
+    explain_step(grid, caption, text, remove_dict, decor)
+
+
+def describe_template_delete(caption, digit, remove_dict):
+    # Template delete: 9 => r1c1,r1c2<>9
+    return '%s: %d => %s' % (caption, digit, discarded_text(remove_dict))
+
+
 # Solving engine
 
 
@@ -3169,14 +4778,74 @@ STRATEGY_SSTS = STRATEGY_SSTS_EXTREME
 
 
 # Hodoku
-# upper case techniques are not yet implemented
+# upper case techniques are skipped. In hodoku-unfair, the large fishes BF5 to
+# SBF7 are implemented but deliberately disabled to keep the ratings of this
+# level unchanged. hodoku-extreme (STRATEGY_HODOKU_EXTREME) enables them with the
+# other fishes.
 STRATEGY_HODOKU_EASY = 'fh,n1,h1'
 STRATEGY_HODOKU_MEDIUM = 'fh,n1,h1,l2,l3,lc1,lc2,n2,n3,h2,h3'
 STRATEGY_HODOKU_HARD = 'fh,n1,h1,l2,l3,lc1,lc2,n2,n3,h2,h3,n4,h4,bf2,bf3,bf4,rp,bug1,sk,2sk,tf,er,w,xy,xyz,u1,u2,u3,u4,u5,u6,hr,ar1,ar2,fbf2,sbf2,sc1,sc2,mc1,mc2'
-STRATEGY_HODOKU_UNFAIR = STRATEGY_HODOKU_HARD + ',BF5,BF6,BF7,fbf3,sbf3,fbf4,sbf4,FBF5,SBF5,FBF6,SBF6,FBF7,SBF7,sdc,x,xyc'
+STRATEGY_HODOKU_UNFAIR = STRATEGY_HODOKU_HARD + ',BF5,BF6,BF7,fbf3,sbf3,fbf4,sbf4,FBF5,SBF5,FBF6,SBF6,FBF7,SBF7,sdc,x,xyc,axz,axy,ach,db,ts,td'
+STRATEGY_HODOKU_EXTREME = STRATEGY_HODOKU_HARD + ',bf5,bf6,bf7,fbf3,sbf3,fbf4,sbf4,fbf5,sbf5,fbf6,sbf6,fbf7,sbf7,ff2,ff3,ff4,fff2,fff3,fff4,mf2,mf3,mf4,fmf2,fmf3,fmf4,kf1,kf2,sdc,x,xyc,axz,axy,ach,db,ts,td'
+
+
+# Named strategies (e.g. technique orders tuned with --tune), one per line:
+# name = techniques. They are read only from the file given by --strategies or,
+# without this option, by the environment variable SUDOSOL_STRATEGIES, and are
+# expanded in the techniques option. Names may not shadow builtin strategies or
+# techniques.
+STRATEGIES_ENV = 'SUDOSOL_STRATEGIES'
+BUILTIN_STRATEGIES = (
+    ('all', 'ssts', 'ssts-easy', 'ssts-standard', 'ssts-hard', 'ssts-expert', 'ssts-extreme',
+     'hodoku-easy', 'hodoku-medium', 'hodoku-hard', 'hodoku-unfair', 'hodoku-extreme') +
+    tuple(f'sudosol-level-{level}' for level in range(1, 7)))
+
+
+def shadows_builtin(name):
+    """return True if a strategy name is the one of a builtin strategy or of a
+    technique
+    """
+    return name in BUILTIN_STRATEGIES or name.lower() in SOLVER
+
+
+def load_strategies(filename):
+    """return the named strategies of a strategies file as a dict name -> techniques
+    """
+    strategies = {}
+    with open(filename) as f:
+        for lineno, line in enumerate(f, 1):
+            line = re.sub('#.*', '', line).strip()
+            if line:
+                match = re.match(r'([\w-]+)\s*=\s*([\w,-]+)$', line)
+                if not match:
+                    raise SudokuError(f'illegal named strategy at line {lineno} of {filename}')
+                name, techniques = match.groups()
+                if shadows_builtin(name):
+                    raise SudokuError(f'strategy name shadows a builtin one: {name} in {filename}')
+                strategies[name] = techniques
+    return strategies
+
+
+def named_strategies(filename=None):
+    """return the named strategies of filename, or of the file given by the
+    environment, or none
+    """
+    filename = filename or os.environ.get(STRATEGIES_ENV)
+    return load_strategies(filename) if filename else {}
+
+
+def expand_strategies(strategy, strategies):
+    """replace in strategy the names of named strategies by their techniques.
+    This is done before expanding builtin strategies as names may contain the
+    builtin ones.
+    """
+    for name, techniques in strategies.items():
+        strategy = re.sub(rf'(?<![\w-]){re.escape(name)}(?![\w-])', techniques, strategy)
+    return strategy
 
 
 def make_list_techniques(strategy):
+
     ALL = ','.join(SOLVER.keys())
     ALL = STRATEGY_SSTS + ','  + ','.join(sorted(set(SOLVER.keys()) - set(STRATEGY_SSTS.split(','))))
     ALL = ALL.replace(',bt', '')
@@ -3193,6 +4862,7 @@ def make_list_techniques(strategy):
     strategy = re.sub(r'\bhodoku-medium\b', STRATEGY_HODOKU_MEDIUM, strategy)
     strategy = re.sub(r'\bhodoku-hard\b', STRATEGY_HODOKU_HARD , strategy)
     strategy = re.sub(r'\bhodoku-unfair\b', STRATEGY_HODOKU_UNFAIR , strategy)
+    strategy = re.sub(r'\bhodoku-extreme\b', STRATEGY_HODOKU_EXTREME , strategy)
 
     strategy = re.sub(r'\bsudosol-level-1\b', STRATEGY_SSTS_EASY, strategy)
     strategy = re.sub(r'\bsudosol-level-2\b', STRATEGY_SSTS_STANDARD, strategy)
@@ -3237,6 +4907,18 @@ SOLVER = {
     'sbf3': solve_sashimi_swordfish,
     'fbf4': solve_finned_jellyfish,
     'sbf4': solve_sashimi_jellyfish,
+    'bf5': solve_squirmbag,
+    'bf6': solve_whale,
+    'bf7': solve_leviathan,
+    'fbf5': solve_finned_squirmbag,
+    'sbf5': solve_sashimi_squirmbag,
+    'fbf6': solve_finned_whale,
+    'sbf6': solve_sashimi_whale,
+    'fbf7': solve_finned_leviathan,
+    'sbf7': solve_sashimi_leviathan,
+    **COMPLEX_FISH_SOLVERS,
+    'kf1': solve_kraken_fish_type_1,
+    'kf2': solve_kraken_fish_type_2,
     'sc1': solve_coloring_trap,
     'sc2': solve_coloring_wrap,
     'mc1': solve_multi_coloring_type_1,
@@ -3263,47 +4945,238 @@ SOLVER = {
     'w': solve_w_wing,
     'sdc': solve_sue_de_coq,
     'sdc*': solve_sue_de_coq_best,
+    'axz': solve_als_xz,
+    'axy': solve_als_xy_wing,
+    'ach': solve_als_xy_chain,
+    'db': solve_death_blossom,
+    'ts': solve_template_set,
+    'td': solve_template_delete,
     'bt': solve_backtrack,
     'dlx': solve_dancing_links,
 }
 
 
+SINGLE_TECHNIQUES = ('fh', 'n1', 'h1')
+
+
 TARGETED_TECHNIQUES = (
     'n1', 'h1', 'lc1', 'lc2', 'n2', 'n3', 'n4', 'l2', 'l3', 'h2', 'h3', 'h4',
     'er', 'x', 'sk', '2sk', 'tf', 'xy', 'mc1', 'mc2', 'xyc', 'fbf3', 'sbf3', 'fbf4', 'sbf4',
-    'xyz', 'w', 'sdc', 'hr'
+    'xyz', 'w', 'sdc', 'hr', 'axz', 'axy', 'ach', 'db',
+    'fbf5', 'sbf5', 'fbf6', 'sbf6', 'fbf7', 'sbf7',
+    'ff2', 'ff3', 'ff4', 'ff5', 'ff6', 'ff7', 'fff2', 'fff3', 'fff4', 'fff5', 'fff6', 'fff7',
+    'mf2', 'mf3', 'mf4', 'mf5', 'mf6', 'mf7', 'fmf2', 'fmf3', 'fmf4', 'fmf5', 'fmf6', 'fmf7',
+    'ts', 'td'
 )
 
 
-def apply_strategy(grid, list_techniques, explain, target=None):
-    for technique in list_techniques:
-        if technique.isupper():
-            continue
-        if technique in TARGETED_TECHNIQUES:
-            if SOLVER[technique](grid, explain, target=target):
-                return True
-        else:
-            if SOLVER[technique](grid, explain):
-                return True
+# techniques applying all the eliminations found in one pass with all_solutions=True
+ALL_SOLUTIONS_TECHNIQUES = (
+    'bf2', 'bf3', 'bf4', 'bf5', 'bf6', 'bf7',
+    'fbf2', 'sbf2', 'fbf3', 'sbf3', 'fbf4', 'sbf4', 'fbf5', 'sbf5', 'fbf6', 'sbf6', 'fbf7', 'sbf7',
+    'ff2', 'ff3', 'ff4', 'ff5', 'ff6', 'ff7', 'fff2', 'fff3', 'fff4', 'fff5', 'fff6', 'fff7',
+    'mf2', 'mf3', 'mf4', 'mf5', 'mf6', 'mf7', 'fmf2', 'fmf3', 'fmf4', 'fmf5', 'fmf6', 'fmf7',
+    'xyc', 'rp'
+)
+ALL_SOLUTIONS = {'all_solutions': True}
+
+
+class Strategy:
+    """list of techniques compiled once. Disabled (upper case) techniques are
+    dropped from the solvers, which are bound to the target when targeting.
+    A strategy behaves as the list of its techniques.
+    """
+    def __init__(self, techniques):
+        if isinstance(techniques, str):
+            techniques = make_list_techniques(techniques)
+        self.techniques = list(techniques)
+        self.ranks = {}
+        for index, technique in enumerate(self.techniques):
+            self.ranks.setdefault(technique, index)
+        self.solvers = [(technique, SOLVER[technique]) for technique in self.techniques if not technique.isupper()]
+        # target -> solvers bound to target
+        self.bound = {None: self.solvers}
+        # (hooks, target, solvers calling hooks) for the last hooks used
+        self.hooked = None
+
+    def __iter__(self):
+        return iter(self.techniques)
+
+    def __len__(self):
+        return len(self.techniques)
+
+    def __getitem__(self, index):
+        return self.techniques[index]
+
+    def __contains__(self, technique):
+        return technique in self.ranks
+
+    def index(self, technique):
+        return self.ranks[technique]
+
+    def bound_solvers(self, target=None):
+        """return the list of (technique, solver) with solvers taking grid and
+        explain as arguments. Solvers are bound once for each target.
+        """
+        solvers = self.bound.get(target)
+        if solvers is None:
+            solvers = self.bound[target] = [
+                (technique, functools.partial(solver, target=target) if technique in TARGETED_TECHNIQUES else solver)
+                for technique, solver in self.solvers]
+        return solvers
+
+    def hooked_solvers(self, target, hooks):
+        """return the solvers bound to target calling hooks around techniques.
+        They are built once for the last hooks and target used.
+        """
+        if self.hooked is None or self.hooked[0] is not hooks or self.hooked[1] != target:
+            solvers = [(technique, hooked_solver(technique, solver, hooks))
+                       for technique, solver in self.bound_solvers(target)]
+            self.hooked = (hooks, target, solvers)
+        return self.hooked[2]
+
+
+@functools.lru_cache(maxsize=64)
+def compiled_strategy(key):
+    """return the compiled strategy for a strategy string or a tuple of
+    techniques. The most recently used strategies are kept.
+    """
+    return Strategy(key)
+
+
+def get_strategy(techniques):
+    """return the compiled strategy for a strategy string, a list of techniques
+    or a strategy
+    """
+    if isinstance(techniques, Strategy):
+        return techniques
+    return compiled_strategy(techniques if isinstance(techniques, str) else tuple(techniques))
+
+
+def hooked_solver(technique, solver, hooks):
+    """return solver calling hooks around the technique (see hooks module)
+    """
+    def hooked(grid, explain, **kwargs):
+        first = grid.history_top + 1
+        hooks.on_technique_start(grid, technique)
+        t0 = time.perf_counter_ns()
+        found = solver(grid, explain, **kwargs)
+        elapsed = time.perf_counter_ns() - t0
+        eliminated = 0
+        if found:
+            for item in grid.history[first:grid.history_top + 1]:
+                eliminated += sum(len(cells) for cells in item.discarded.values())
+        hooks.on_technique_end(grid, technique, found, eliminated, elapsed)
+        return found
+    return hooked
+
+
+def apply_strategy(grid, strategy, explain, target=None, batch=False, hooks=None):
+    """apply the first technique of strategy (strategy string, list of
+    techniques or Strategy) which succeeds. Return the technique or False if
+    none succeeds. With batch, techniques of ALL_SOLUTIONS_TECHNIQUES apply all
+    the eliminations they find in one pass, and the technique is applied
+    again as long as it succeeds, instead of restarting from the first
+    technique after each move. The range of history items of the batch is
+    appended to grid.batches as (technique, first, last). Singles are cheap
+    enough to restart from. Other techniques may rely on the absence of singles
+    (e.g. hidden sets ignore cells with a single candidate): they are applied
+    again only while there is no single to place. hooks are called around
+    techniques and after the step (see hooks module).
+    """
+    if hooks is None:
+        solvers = get_strategy(strategy).bound_solvers(target)
+    else:
+        solvers = get_strategy(strategy).hooked_solvers(target, hooks)
+    for technique, solver in solvers:
+        first = grid.history_top + 1
+        kwargs = ALL_SOLUTIONS if batch and technique in ALL_SOLUTIONS_TECHNIQUES else {}
+        if solver(grid, explain, **kwargs):
+            if batch:
+                while (not grid.is_solved() and
+                       technique not in SINGLE_TECHNIQUES and
+                       not has_singles(grid) and
+                       solver(grid, explain, **kwargs)):
+                    pass
+                grid.batches.append((technique, first, grid.history_top))
+            if hooks is not None:
+                hooks.on_step(grid, technique, first)
+            return technique
     else:
         return False
 
 
-def solve(grid, options, techniques, explain, step=False, target=None):
+def apply_technique(grid, technique, explain, target=None):
+    if technique in TARGETED_TECHNIQUES:
+        return SOLVER[technique](grid, explain, target=target)
+    else:
+        return SOLVER[technique](grid, explain)
+
+
+# command line options handled by hooks
+HOOK_OPTIONS = ('trace_json', 'chrome_trace', 'histogram', 'profile_technique')
+
+
+def solve(grid, options, techniques, explain, step=False, target=None, hooks=None):
+    """solve grid with techniques (strategy string, list of techniques or
+    Strategy). Return the hardest technique used, i.e. the last one in the
+    list of techniques, or None. hooks default to the ones given by options
+    (see hooks module). Results are cached if a cache is given in options,
+    except when explaining, stepping, targeting, applying all eliminations of
+    a technique in batches or calling hooks.
+    """
     # TODO: why arg step and option step?
-    list_techniques = make_list_techniques(techniques)
-    if explain:
+    strategy = get_strategy(techniques)
+    batch = getattr(options, 'all_eliminations', False)
+    if hooks is None:
+        hooks = getattr(options, 'hooks', None)
+    if hooks is None and any(getattr(options, name, None) for name in HOOK_OPTIONS):
+        hooks = import_sibling('hooks').open_hooks(options)
+    solvecache = None
+    if not (explain or step or options.step or target or batch or hooks):
+        solvecache = cache.open_cache(options)
+    if solvecache:
+        key = solvecache.key(grid, strategy)
+        result = solvecache.get(key)
+        if result:
+            history, final, hardest = result
+            top = grid.history_top
+            cache.replay_history(grid, history)
+            if grid.output_gvc() == final:
+                return hardest or None
+            # the replay does not give the stored grid: undo it and solve again
+            while grid.history_top > top:
+                grid.undo(strict=True)
+            solvecache.invalidate(key)
+
+    start = grid.history_top + 1
+    first_step = len(grid.steps)
+    hardest = -1
+    explain_json = explain and getattr(options, 'explain_format', 'text') == 'json'
+    if explain and not explain_json:
         print(grid.output_s81())
         grid.dump()
-    while not grid.is_solved() and apply_strategy(grid, list_techniques, explain, target) and not options.step:
+    if hooks is not None:
+        hooks.on_solve_start(grid)
+    while not grid.is_solved() and (technique := apply_strategy(grid, strategy, explain, target, batch, hooks)) and not options.step:
+        hardest = max(hardest, strategy.index(technique))
         if step:
             break
         else:
             pass
-    if explain and not options.step:
-        print_single_history(grid)
-        grid.dump()
-    return None
+    if explain_json:
+        print(steps_to_json(grid.steps[first_step:]))
+    elif explain:
+        print_steps(grid.steps[first_step:], grid.decorate)
+        if not options.step:
+            print_single_history(grid)
+            grid.dump()
+
+    hardest = strategy[hardest] if hardest >= 0 else None
+    if solvecache:
+        solvecache.put(key, cache.history_to_json(grid.history[start:grid.history_top + 1]),
+                       grid.output_gvc(), hardest or '')
+    return hardest
 
 
 # Commands
@@ -3325,6 +5198,7 @@ def solvegrid(options, techniques, explain, target):
     elif re.match(r'(\+?[.1-9]){81}:[ 1-9]*$', options.solve):
         sgrid = options.solve
     elif options.solve == 'clipboard':
+        import clipboard
         sgrid = clipboard.paste()
     elif os.path.isfile(options.solve):
         with open(options.solve) as f:
@@ -3334,6 +5208,8 @@ def solvegrid(options, techniques, explain, target):
 
     if options.format is None:
         grid.input(sgrid)
+    elif options.format in INPUT_FORMATS:
+        grid.input(sgrid.strip(), format=options.format)
     elif options.format == 'ss':
         # TODO: remove
         grid.input(sgrid)
@@ -3343,6 +5219,7 @@ def solvegrid(options, techniques, explain, target):
 
     if options.output == 'clipboard':
         solve(grid, options, techniques, explain, options.step, target)
+        import clipboard
         clipboard.copy(grid.dumpstr())
     else:
         if not explain:
@@ -3370,13 +5247,27 @@ def parse_command_line(argstring=None):
                         action='store', default=None)
     xgroup.add_argument('--regression', help='regression testing',
                         action='store')
+    xgroup.add_argument('--dedupe', help='remove puzzles equivalent to a previous one from file',
+                        action='store', default=None)
+    xgroup.add_argument('--stats', help='statistics of techniques used to solve the puzzles of file',
+                        action='store', default=None)
+    xgroup.add_argument('--tune', help='tune the order of techniques on the puzzles of file',
+                        action='store', default=None)
+    xgroup.add_argument('--singles', help='compare vectorized singles with techniques fh,n1,h1 on the puzzles of file',
+                        action='store', default=None)
+    xgroup.add_argument('--hints', help='check the hint service on the puzzles of file',
+                        action='store', default=None)
+    xgroup.add_argument('--generator', help='check the generator gives the same puzzles for a seed',
+                        action='store', default=None)
+    xgroup.add_argument('--importtime', help='check heavy and optional modules are not imported when solving a grid',
+                        action='store_true', default=False)
 
     agroup = parser.add_argument_group('Parameters')
     agroup.add_argument('--compare', help='compare test output with file argument',
                         action='store', default=None)
     agroup.add_argument('--reference', help='make file reference for comparison',
                         action='store', default=None)
-    agroup.add_argument('-f', '--format', help='format',
+    agroup.add_argument('-f', '--format', help='input format (s81, csv, gvc, hodoku), detected by default',
                         action='store', default=None)
     agroup.add_argument('--random', help='test N random grids from file',
                         type=int,
@@ -3392,16 +5283,46 @@ def parse_command_line(argstring=None):
                         action='store_true', default=False)
     agroup.add_argument('--explain', help='explain techniques',
                         action='store_true', default=False)
+    agroup.add_argument('--all-eliminations', help='apply each technique as long as it succeeds before restarting from the first one, fishes and chains applying all the eliminations found in a pass',
+                        action='store_true', default=False)
+    agroup.add_argument('--explain-format', help='render explanations as text or JSON',
+                        choices=['text', 'json'],
+                        action='store', default='text')
     agroup.add_argument('--decorate', help='candidate decor when tracing grid',
                         choices=['none', 'color', 'char'],
                         action='store', default=None)
     agroup.add_argument('--trace', help='additional traces',
                         choices=['success', 'failure'],
                         action='store', default=None)
-    agroup.add_argument('--output', help='file to trace on',
+    agroup.add_argument('--unsolved', help='with --stats, list the positions where solving stopped in format (s81, csv, gvc, hodoku)',
+                        action='store', default=None, choices=INPUT_FORMATS)
+    agroup.add_argument('--output', help='file to trace on, or strategies file written by --tune',
+                        action='store', default=None)
+    agroup.add_argument('--trace-json', help='write solving steps with timings to file as JSON lines',
+                        action='store', default=None)
+    agroup.add_argument('--chrome-trace', help='write technique calls to file as trace events (chrome://tracing, Perfetto)',
                         action='store', default=None)
+    agroup.add_argument('--histogram', help='print calls and timings of techniques',
+                        action='store_true', default=False)
+    agroup.add_argument('--profile-technique', help='profile the calls of a technique',
+                        action='store', default=None)
+    agroup.add_argument('--profiler', help='profiler used by --profile-technique',
+                        choices=['cprofile', 'pyinstrument'],
+                        action='store', default='cprofile')
     agroup.add_argument('--progressbar', help='display progress bar when solving file',
                         action='store_true', default=False)
+    agroup.add_argument('--cache', help='cache solving results in SQLite file (memory: no file)',
+                        action='store', default=None)
+    agroup.add_argument('--jobs', help='number of worker processes for --stats',
+                        type=int,
+                        action='store', default=1)
+    agroup.add_argument('--name', help='name of the strategy saved by --tune',
+                        action='store', default='tuned')
+    agroup.add_argument('--holdout', help='number of puzzles held out by --tune to verify ratings (default: a quarter)',
+                        type=int,
+                        action='store', default=None)
+    agroup.add_argument('--strategies', help=f'file of named strategies (default: ${STRATEGIES_ENV} if set)',
+                        action='store', default=None)
 
     if argstring is None:
         args = parser.parse_args()
@@ -3418,6 +5339,20 @@ def main(argstring=None):
 
 
 def main_args(options):
+    try:
+        options.techniques = expand_strategies(options.techniques, named_strategies(options.strategies))
+    except (IOError, SudokuError) as exc:
+        print('sudosol error:', exc)
+        return False, None
+    try:
+        return run_command(options)
+    finally:
+        if getattr(options, 'hooks', None):
+            import_sibling('hooks').close_hooks(options)
+        cache.close_cache(options)
+
+
+def run_command(options):
     if options.compare or options.reference:
         # Must be done before testfile, testdir, testbatch, regr. Result of comparison
         # becomes result of test.
@@ -3438,12 +5373,32 @@ def main_args(options):
     elif options.regression:
         return testing.regression_testing(options.regression)
 
+    elif options.dedupe:
+        return canonical.dedupe(options)
+
+    elif options.stats:
+        return import_sibling('stats').stats(options)
+
+    elif options.tune:
+        return import_sibling('tune').tune_file(options)
+
+    elif options.singles:
+        return testing.check_singles(options)
+
+    elif options.hints:
+        return testing.check_hints(options)
+
+    elif options.generator:
+        return testing.check_generator(options)
+
+    elif options.importtime:
+        return testing.import_time()
+
     else:
         return False, None
 
 
 if __name__ == '__main__':
-    colorama.init()
     success, timing = main()
     if success:
         exit(0)
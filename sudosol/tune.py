@@ -0,0 +1,163 @@
+"""
+Technique order tuning for sudosol.
+
+When rating, only the result of solving and the hardest technique of each
+puzzle matter, the hardest technique being the one of highest rank in the
+canonical order. A strategy is tuned on a training deck. Each technique is first
+profiled (mean cost of a call and number of successes). Then techniques are
+moved, one at a time, before the ones costing more time per success. A move is
+kept when the rating of every puzzle of the deck is unchanged and the expected
+solving time, estimated from the profile, decreases. The tuned order is then
+verified on a held-out deck (the last puzzles of the file, a quarter by
+default, see --holdout): every puzzle must get the same rating as with the
+canonical order. The tuned order is saved as a named strategy in the file
+given by --output (strategies.txt in the working directory by default). It is
+used with --strategies FILE or the environment variable SUDOSOL_STRATEGIES.
+"""
+
+
+import os
+import re
+import time
+import itertools
+from collections import Counter
+
+import sudosol
+
+try:
+    import stats
+except ImportError:
+    from . import stats
+
+
+TUNED_STRATEGIES_FILE = 'strategies.txt'
+
+
+def profile(puzzles, list_techniques, rank):
+    """solve puzzles with list_techniques. Return the ratings of puzzles, as
+    (solved, hardest technique), and the number of calls, the number of
+    successes and the time spent for each technique. The hardest technique is
+    the one of highest rank (index in the canonical order).
+    """
+    ratings = []
+    calls = Counter()
+    hits = Counter()
+    times = Counter()
+    grid = sudosol.Grid()
+    for puzzle in puzzles:
+        grid.input(puzzle)
+        hardest = None
+        while not grid.is_solved():
+            for technique in list_techniques:
+                t0 = time.perf_counter()
+                success = sudosol.apply_technique(grid, technique, False)
+                times[technique] += time.perf_counter() - t0
+                calls[technique] += 1
+                if success:
+                    hits[technique] += 1
+                    if hardest is None or rank[technique] > rank[hardest]:
+                        hardest = technique
+                    break
+            else:
+                break
+        ratings.append((grid.is_solved(), hardest))
+    return ratings, calls, hits, times
+
+
+def expected_time(calls, cost):
+    return sum(calls[technique] * cost[technique] for technique in calls)
+
+
+def tune(puzzles, list_techniques):
+    """return the tuned order of list_techniques for puzzles, the expected
+    solving times before and after tuning, and the number of moves kept
+    """
+    order = [technique for technique in list_techniques if not technique.isupper()]
+    rank = {technique: index for index, technique in enumerate(order)}
+    ratings, calls, hits, times = profile(puzzles, order, rank)
+    cost = {technique: times[technique] / calls[technique] if calls[technique] else 0 for technique in order}
+    cost_per_hit = {technique: times[technique] / hits[technique] if hits[technique] else float('inf') for technique in order}
+    initial = best = expected_time(calls, cost)
+
+    moves = 0
+    for technique in sorted(order, key=lambda technique: cost_per_hit[technique]):
+        index = order.index(technique)
+        # leftmost position such that all techniques skipped cost more per success
+        first = index
+        while first > 0 and cost_per_hit[order[first - 1]] > cost_per_hit[technique]:
+            first -= 1
+        # try the farthest move, then halve it until ratings are preserved
+        position = first
+        while position < index:
+            candidate = order[:position] + [technique] + order[position:index] + order[index + 1:]
+            candidate_ratings, candidate_calls, _, _ = profile(puzzles, candidate, rank)
+            if candidate_ratings == ratings:
+                estimate = expected_time(candidate_calls, cost)
+                if estimate < best:
+                    order, best = candidate, estimate
+                    moves += 1
+                break
+            position = (position + index + 1) // 2
+
+    return order, initial, best, moves
+
+
+def verify(puzzles, list_techniques, order):
+    """return the number of puzzles whose rating with order differs from the
+    one with the canonical order list_techniques
+    """
+    canonical = [technique for technique in list_techniques if not technique.isupper()]
+    rank = {technique: index for index, technique in enumerate(canonical)}
+    ratings, *_ = profile(puzzles, canonical, rank)
+    tuned_ratings, *_ = profile(puzzles, order, rank)
+    return sum(rating != tuned_rating for rating, tuned_rating in zip(ratings, tuned_ratings))
+
+
+def save_strategy(filename, name, list_techniques):
+    """add or replace a named strategy in a strategies file
+    """
+    lines = []
+    if os.path.isfile(filename):
+        with open(filename) as f:
+            lines = f.readlines()
+    newline = f'{name} = {",".join(list_techniques)}\n'
+    for index, line in enumerate(lines):
+        if re.match(rf'{re.escape(name)}\s*=', line):
+            lines[index] = newline
+            break
+    else:
+        lines.append(newline)
+    with open(filename, 'wt') as f:
+        f.writelines(lines)
+
+
+def tune_file(options):
+    """Tune the order of techniques on the puzzles of a file and save it as a
+    named strategy.
+    """
+    t0 = time.time()
+    try:
+        puzzles = stats.puzzles(options.tune)
+        puzzles = list(itertools.islice(puzzles, options.first) if options.first else puzzles)
+    except IOError:
+        print('sudosol error: unable to read', options.tune)
+        return False, time.time() - t0
+
+    if sudosol.shadows_builtin(options.name):
+        print('sudosol error: strategy name shadows a builtin one:', options.name)
+        return False, time.time() - t0
+
+    holdout = len(puzzles) // 4 if options.holdout is None else options.holdout
+    training, heldout = puzzles[:len(puzzles) - holdout], puzzles[len(puzzles) - holdout:]
+    list_techniques = sudosol.make_list_techniques(options.techniques)
+    order, initial, best, moves = tune(training, list_techniques)
+    differences = verify(heldout, list_techniques, order)
+    if differences == 0:
+        save_strategy(options.output or TUNED_STRATEGIES_FILE, options.name, order)
+
+    timing = time.time() - t0
+    print(f'{options.name} = {",".join(order)}')
+    print(f'Tune file: {options.tune:20} Puzzles: {len(training)} Held out: {len(heldout)} '
+          f'Differences: {differences} Moves: {moves} '
+          f'Expected time: {initial:0.3} -> {best:0.3} Time: {timing:0.3}')
+    return differences == 0, timing